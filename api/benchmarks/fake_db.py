@@ -0,0 +1,44 @@
+"""
+An in-memory stand-in for the parts of a Motor database the benchmarks exercise.
+"""
+from unittest import mock
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+
+class FakeCollection:
+    """
+    The `insert_one` and `find_one` methods of a Motor collection, backed by a list.
+
+    Attributes:
+        documents (list): The stored documents.
+        unique (tuple): Fields that must be unique, like the `email_unique` index of users.
+    """
+
+    def __init__(self, documents=None, unique=()):
+        self.documents = list(documents or [])
+        self.unique = unique
+
+    async def insert_one(self, document):
+        if any(doc.get(field) == document.get(field) for field in self.unique for doc in self.documents):
+            raise DuplicateKeyError("E11000 duplicate key error")
+        document = dict(document, _id=document.get("_id", ObjectId()))
+        self.documents.append(document)
+        return mock.Mock(inserted_id=document["_id"])
+
+    async def find_one(self, query, projection=None):
+        doc = next((doc for doc in self.documents if all(doc.get(k) == v for k, v in query.items())), None)
+        if doc is None or projection is None:
+            return doc
+        return {k: v for k, v in doc.items() if k == "_id" or projection.get(k)}
+
+
+class FakeDatabase(dict):
+    """
+    A database whose collections are created on first access.
+    """
+
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection(unique=("email",) if name == "users" else ())
+        return collection
@@ -0,0 +1,121 @@
+"""
+Measures the cold import time of the API and fails when it exceeds a budget.
+
+The app is imported in a fresh interpreter with `python -X importtime`, several
+times, and the fastest run counts, since the slower ones mostly measure a cold
+disk cache or a busy machine. The report lists the total, the time spent in each
+top-level package (the sum of its modules' own import times) and the slowest
+modules by cumulative time.
+
+It also checks that the libraries the API imports lazily, through
+`lazy_imports.lazy_import`, are not imported at startup after all, e.g. by a new
+`import cv2` at the top of a module. The command exits with status 1 if the total
+is over `--budget-ms` or one of the `--deferred` packages was imported.
+
+Usage (from the api directory):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget-ms 800 --runs 5
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+API_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(API_ROOT)
+
+# Imported on first use by the endpoints that need them
+DEFERRED = ("cv2", "PIL", "pytesseract", "bcrypt", "scipy")
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(output):
+    """
+    Parses the output of `python -X importtime`.
+
+    Returns:
+        list: (module, self_us, cumulative_us, depth) tuples in the order printed.
+    """
+    modules = []
+    for line in output.splitlines():
+        match = _LINE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return modules
+
+
+def summarize(modules, module, top=15):
+    """
+    Summarizes one import of `module`.
+
+    Args:
+        modules (list): The parsed output, as returned by `parse_importtime`.
+        module (str): The imported module, whose cumulative time is the total.
+        top (int, optional): The number of slowest modules listed. Defaults to 15.
+
+    Returns:
+        dict: The total in milliseconds, the milliseconds by top-level package, the
+        slowest modules and every imported top-level package.
+    """
+    total = next((cumulative for name, _, cumulative, depth in modules if name == module and depth == 0), None)
+    if total is None:
+        raise ValueError(f"{module} was not imported")
+    packages = {}
+    for name, own, _, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + own
+    slowest = sorted(modules, key=lambda entry: entry[2], reverse=True)[:top]
+    return {
+        "total_ms": total / 1000,
+        "packages_ms": {name: own / 1000 for name, own in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+        "slowest_ms": {name: cumulative / 1000 for name, _, cumulative, _ in slowest},
+        "imported": sorted(packages),
+    }
+
+
+def measure(module="api.main", runs=3):
+    """
+    Imports `module` in `runs` fresh interpreters.
+
+    Returns:
+        dict: The summary of the fastest run, as returned by `summarize`.
+    """
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [API_ROOT, os.getenv("PYTHONPATH")])),
+           "PYTHONDONTWRITEBYTECODE": "1"}
+    env.pop("PREWARM_IMPORTS", None)
+    best = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_ROOT, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+        summary = summarize(parse_importtime(result.stderr), module)
+        if best is None or summary["total_ms"] < best["total_ms"]:
+            best = summary
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="api.main")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", 1000)))
+    parser.add_argument("--deferred", nargs="*", default=list(DEFERRED),
+                        help="Packages that must not be imported at startup")
+    args = parser.parse_args()
+
+    summary = measure(args.module, args.runs)
+    eager = sorted(set(args.deferred) & set(summary.pop("imported")))
+    over_budget = summary["total_ms"] > args.budget_ms
+    print(json.dumps({"module": args.module, "budget_ms": args.budget_ms, "over_budget": over_budget,
+                      "eager_deferred": eager, **summary}, indent=2))
+    if eager:
+        print(f"Imported at startup although deferred: {', '.join(eager)}", file=sys.stderr)
+    sys.exit(1 if over_budget or eager else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Load-tests the API over HTTP and reports throughput, latency and resource use per endpoint.
+
+The benchmark drives the full application, `api.main:app`, with an in-memory stand-in
+for MongoDB and the sample images bundled with the API, so runs are reproducible
+without any services. The app is served in one of three ways:
+
+- "inprocess": through httpx's ASGI transport, without sockets.
+- "uvicorn": by a uvicorn server on a free local port, started in a background thread.
+- "url": by an already running server at `--url`, e.g. a staging worker; that server
+  uses its own database, in which the `--email` user must exist, and `--pid` selects
+  the process whose CPU and memory are reported.
+
+Each endpoint of the mix is first loaded on its own, so that CPU time and memory can be
+attributed to it, and then all of them together in the given proportions. Latencies
+include errors; their status codes are counted separately. CPU and RSS are those of
+the serving process, which for "inprocess" and "uvicorn" also runs the load generator.
+
+Usage (from the api directory):
+    python -m benchmarks.load_bench --mix process-image=4,upload=1,ocr=1,login=2 --requests 50 --concurrency 8
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import threading
+import time
+
+import httpx
+import numpy as np
+from bson import ObjectId
+
+os.environ.setdefault("JWT_SECRET", "benchmark-secret-with-enough-length-for-hs256")
+
+# `api.main` imports its routers relative to the `api` package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from benchmarks.fake_db import FakeDatabase
+from db.mongodb_utils import get_db
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_IMAGES = [os.path.join(API_DIR, "1.png"), os.path.join(API_DIR, "test.jpeg")]
+
+DEFAULT_MIX = "process-image=4,upload=1,ocr=1,login=2"
+
+MEDIA_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+
+
+def load_samples(paths):
+    """
+    Reads the sample images as (filename, bytes, media type) upload tuples.
+    """
+    samples = []
+    for path in paths:
+        with open(path, "rb") as f:
+            samples.append((os.path.basename(path), f.read(), MEDIA_TYPES.get(os.path.splitext(path)[1].lower(),
+                                                                              "application/octet-stream")))
+    return samples
+
+
+def build_request(endpoint, samples, rng, credentials):
+    """
+    Builds the arguments of `httpx.AsyncClient.request` for one request to an endpoint.
+
+    Args:
+        endpoint (str): A key of `ENDPOINTS`.
+        samples (list): The upload tuples from `load_samples`.
+        rng (random.Random): Picks the sample image, so runs with the same seed are identical.
+        credentials (dict): The email and password of the benchmark user.
+
+    Returns:
+        dict: The request's method, URL and body.
+    """
+    if endpoint == "login":
+        return {"method": "POST", "url": "/login/", "json": credentials}
+    if endpoint == "upload":
+        return {"method": "POST", "url": "/upload", "files": [("files", sample) for sample in samples]}
+    return {"method": "POST", "url": ENDPOINTS[endpoint], "files": {"file": rng.choice(samples)}}
+
+
+ENDPOINTS = {
+    "process-image": "/process-image/",
+    "ocr": "/ocr/",
+    "upload": "/upload",
+    "login": "/login/",
+    "enhance-image": "/enhance-image/",
+    "thumbnail": "/thumbnail/",
+}
+
+
+def parse_mix(mix):
+    """
+    Parses a request mix such as "process-image=4,login=1" into endpoint weights.
+
+    Raises:
+        ValueError: If an endpoint is unknown or a weight is not positive.
+    """
+    weights = {}
+    for part in mix.split(","):
+        endpoint, _, weight = part.strip().partition("=")
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {endpoint!r}; choose from {', '.join(ENDPOINTS)}")
+        weights[endpoint] = float(weight or 1)
+        if weights[endpoint] <= 0:
+            raise ValueError(f"The weight of {endpoint} must be positive")
+    return weights
+
+
+def process_usage(pid=None):
+    """
+    Returns the CPU time and resident memory of a process.
+
+    Args:
+        pid (int, optional): The process id. Defaults to the current process.
+
+    Returns:
+        tuple: User plus system CPU seconds, and the resident set size in bytes (None
+        where `/proc` is not available).
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        ticks = os.sysconf("SC_CLK_TCK")
+        return (int(fields[11]) + int(fields[12])) / ticks, rss_pages * os.sysconf("SC_PAGE_SIZE")
+    except FileNotFoundError:
+        if pid is not None:
+            raise
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime, None
+
+
+def latency_stats(latencies, elapsed):
+    """
+    Summarizes request latencies in seconds as throughput and percentiles in milliseconds.
+    """
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+async def run_phase(client, endpoints, requests, concurrency, samples, credentials, seed, pid=None):
+    """
+    Sends `requests` requests with at most `concurrency` in flight and measures them.
+
+    Args:
+        client (httpx.AsyncClient): The client connected to the app.
+        endpoints (list): The endpoint of every request, in sending order.
+        requests (int): The number of requests; the length of `endpoints`.
+        concurrency (int): The number of requests in flight at once.
+        samples (list): The upload tuples from `load_samples`.
+        credentials (dict): The email and password of the benchmark user.
+        seed (int): The seed of the sample choice.
+        pid (int, optional): The serving process. Defaults to the current process.
+
+    Returns:
+        dict: The phase's overall and per-endpoint statistics.
+    """
+    rng = random.Random(seed)
+    queue = collections.deque(build_request(endpoint, samples, rng, credentials) | {"endpoint": endpoint}
+                              for endpoint in endpoints)
+    latencies = collections.defaultdict(list)
+    statuses = collections.defaultdict(collections.Counter)
+    peak_rss = 0
+    done = asyncio.Event()
+
+    async def worker():
+        while queue:
+            request = queue.popleft()
+            endpoint = request.pop("endpoint")
+            start = time.perf_counter()
+            try:
+                status = (await client.request(**request)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies[endpoint].append(time.perf_counter() - start)
+            statuses[endpoint][str(status)] += 1
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while not done.is_set():
+            peak_rss = max(peak_rss, process_usage(pid)[1] or 0)
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_rss())
+    cpu_start, rss_start = process_usage(pid)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - start
+    cpu_end, rss_end = process_usage(pid)
+    done.set()
+    await sampler
+    peak_rss = max(peak_rss, rss_start or 0, rss_end or 0)
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    errors = sum(count for counter in statuses.values() for status, count in counter.items() if not status.startswith("2"))
+    return {
+        **latency_stats(all_latencies, elapsed),
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "cpu_s": cpu_end - cpu_start,
+        "cpu_ms_per_request": (cpu_end - cpu_start) / max(1, requests) * 1000,
+        "cpu_utilization": (cpu_end - cpu_start) / elapsed,
+        "rss_mb_start": rss_start / 2 ** 20 if rss_start else None,
+        "rss_mb_end": rss_end / 2 ** 20 if rss_end else None,
+        "rss_mb_peak": peak_rss / 2 ** 20 if peak_rss else None,
+        "endpoints": {endpoint: {**latency_stats(values, elapsed), "status_codes": dict(statuses[endpoint])}
+                      for endpoint, values in latencies.items()},
+    }
+
+
+def local_app(credentials):
+    """
+    Returns `api.main:app` backed by an in-memory database holding the benchmark user.
+    """
+    import bcrypt
+    import passwords
+    from api.main import app
+
+    hashed = bcrypt.hashpw(credentials["password"].encode("utf-8"), bcrypt.gensalt(rounds=passwords.BCRYPT_ROUNDS))
+    database = FakeDatabase()
+    database["users"].documents.append({"_id": ObjectId(), "email": credentials["email"], "username": "bench",
+                                        "password": hashed})
+    app.dependency_overrides[get_db] = lambda: database
+    return app
+
+
+def start_uvicorn(app):
+    """
+    Serves an app with uvicorn on a free local port from a background thread.
+
+    The lifespan is turned off, so the app does not connect to MongoDB.
+
+    Returns:
+        tuple: The server, for `should_exit`, its thread, and its base URL.
+    """
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.01)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    samples = load_samples(args.images)
+    credentials = {"email": args.email, "password": args.password}
+    server = None
+    if args.server == "inprocess":
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=local_app(credentials)), base_url="http://bench")
+    elif args.server == "uvicorn":
+        server, thread, url = start_uvicorn(local_app(credentials))
+        client = httpx.AsyncClient(base_url=url)
+    else:
+        client = httpx.AsyncClient(base_url=args.url)
+
+    try:
+        async with client:
+            client.timeout = httpx.Timeout(args.timeout)
+            rng = random.Random(args.seed)
+            # One request per endpoint first, so that imports and caches do not count
+            await run_phase(client, list(weights), len(weights), 1, samples, credentials, args.seed, args.pid)
+
+            isolated = {}
+            for endpoint in weights:
+                isolated[endpoint] = await run_phase(client, [endpoint] * args.requests, args.requests,
+                                                     args.concurrency, samples, credentials, args.seed, args.pid)
+                del isolated[endpoint]["endpoints"]
+            total = args.mix_requests or args.requests * len(weights)
+            endpoints = rng.choices(list(weights), weights=list(weights.values()), k=total)
+            mix = await run_phase(client, endpoints, total, args.concurrency, samples, credentials, args.seed, args.pid)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join()
+
+    return {
+        "config": {
+            "server": args.server,
+            "url": args.url,
+            "mix": weights,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "images": [os.path.basename(path) for path in args.images],
+            "seed": args.seed,
+            "cpu_count": os.cpu_count(),
+        },
+        "isolated": isolated,
+        "mix": mix,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--server", choices=["inprocess", "uvicorn", "url"], default="inprocess")
+    parser.add_argument("--url", help='The base URL of a running server, for --server url')
+    parser.add_argument("--pid", type=int, help="The process id of the server at --url, for CPU and RSS")
+    parser.add_argument("--email", default="bench@example.com", help="The login user; it must exist for --server url")
+    parser.add_argument("--password", default="correct horse battery staple")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Endpoint weights; endpoints: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per endpoint when loaded on its own")
+    parser.add_argument("--mix-requests", type=int, help="Requests of the mixed phase; defaults to --requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--images", nargs="+", default=SAMPLE_IMAGES)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.server == "url" and not args.url:
+        parser.error("--server url requires --url")
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
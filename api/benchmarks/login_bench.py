@@ -0,0 +1,106 @@
+"""
+Measures login throughput and the latency of an unrelated endpoint under concurrent logins.
+
+The users router runs in-process behind httpx's ASGI transport with an in-memory users
+collection, so the numbers reflect the worker's event loop rather than the database.
+Each mode is run in turn:
+
+- "inline": bcrypt is called directly inside the request handler, as it used to be.
+- "pool": bcrypt runs in the dedicated `passwords` thread pool.
+
+Usage (from the api directory):
+    python -m benchmarks.login_bench --logins 64 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import bcrypt
+import cv2
+import httpx
+import numpy as np
+from bson import ObjectId
+from fastapi import FastAPI
+
+os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+
+import passwords
+from benchmarks.fake_db import FakeCollection
+from db.mongodb_utils import get_db
+from v1.endpoints import users
+
+EMAIL = "bench@example.com"
+PASSWORD = "correct horse battery staple"
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else None
+
+
+async def inline_verify_password(password, hashed):
+    return bcrypt.checkpw(password.encode("utf-8"), hashed)
+
+
+async def run(mode, logins, concurrency):
+    hashed = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=passwords.BCRYPT_ROUNDS))
+    db = {"users": FakeCollection([{"_id": ObjectId(), "email": EMAIL, "username": "bench", "password": hashed}])}
+    app = FastAPI()
+    app.include_router(users.router)
+    app.dependency_overrides[get_db] = lambda: db
+    users.verify_password = inline_verify_password if mode == "inline" else passwords.verify_password
+
+    probe_image = cv2.imencode(".png", np.zeros((64, 64, 3), np.uint8))[1].tobytes()
+    login_times, probe_times = [], []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def login_worker(count):
+            for _ in range(count):
+                start = time.perf_counter()
+                response = await client.post("/login/", json={"email": EMAIL, "password": PASSWORD})
+                assert response.status_code == 200, response.text
+                login_times.append(time.perf_counter() - start)
+
+        async def prober():
+            while not done.is_set():
+                start = time.perf_counter()
+                response = await client.post("/apply-invert/", files={"file": ("probe.png", probe_image, "image/png")})
+                assert response.status_code == 200, response.text
+                probe_times.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(prober())
+        start = time.perf_counter()
+        await asyncio.gather(*(login_worker(logins // concurrency + (i < logins % concurrency))
+                               for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    return {
+        "mode": mode,
+        "logins": len(login_times),
+        "logins_per_second": len(login_times) / elapsed,
+        "login_p50_ms": percentile(login_times, 50),
+        "login_p99_ms": percentile(login_times, 99),
+        "probe_requests": len(probe_times),
+        "probe_p50_ms": percentile(probe_times, 50),
+        "probe_p99_ms": percentile(probe_times, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--modes", nargs="+", default=["inline", "pool"], choices=["inline", "pool"])
+    args = parser.parse_args()
+    results = [asyncio.run(run(mode, args.logins, args.concurrency)) for mode in args.modes]
+    print(json.dumps({"bcrypt_rounds": passwords.BCRYPT_ROUNDS, "hash_workers": passwords.PASSWORD_HASH_WORKERS,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Times the image primitives of the scan pipeline and fails on regressions against a baseline.
+
+Each primitive runs on a synthetic photo of a document page at several realistic
+sizes. The time is the best of `--repeat` runs of an automatically sized loop, as
+with `timeit`, and the peak memory is the largest traced allocation during one call,
+measured separately with `tracemalloc`. It covers Python and NumPy allocations,
+including arrays returned by OpenCV, but not OpenCV's internal buffers.
+
+Results are compared to a baseline JSON file written by `--save-baseline`. A case
+regresses when its time grows by more than `--tolerance` or its peak memory by more
+than `--memory-tolerance` (both relative), and the command then exits with status 1.
+Timings depend on the machine, so baselines should be recorded on the machine that
+checks them; the baseline keeps a description of its machine for that reason.
+
+Some primitives are pure Python loops or build large temporaries and only run at the
+sizes listed for them in `CASES`.
+
+Usage (from the api directory):
+    python -m benchmarks.primitives_bench --save-baseline
+    python -m benchmarks.primitives_bench --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import corners
+from helpers import clockwise_order
+from v1.endpoints.users import (bilinear_interpolate, draw_line, enhance_image_cv, four_point_transform,
+                                gaussian_kernel, order_points, pre_process, vectorized_gaussian_blur)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "primitives_baseline.json")
+
+# Image sizes as (width, height); "quad" cases work on the four page corners only
+SIZES = {"500px": (500, 375), "3MP": (2000, 1500), "12MP": (4000, 3000)}
+
+# Differences below these are noise, whatever the tolerance
+MIN_TIME_DELTA_MS = 0.05
+MIN_MEMORY_DELTA_KB = 64
+
+
+def make_scene(width, height, seed=0):
+    """
+    Draws a photo-like scene: a slightly rotated page with lines of text on a darker desk.
+
+    Returns:
+        tuple: The BGR image and the page corners as a float32 (4, 2) array in random order.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = (60, 70, 80)
+    image += rng.integers(0, 12, image.shape, dtype=np.uint8)
+
+    margin_x, margin_y = width * 0.12, height * 0.1
+    corners = np.array([[margin_x, margin_y * 1.2], [width - margin_x * 1.1, margin_y],
+                        [width - margin_x, height - margin_y], [margin_x * 0.9, height - margin_y * 1.1]], np.float32)
+    cv2.fillConvexPoly(image, corners.astype(np.int32), (235, 240, 245))
+    line_height = max(4, height // 40)
+    for y in range(int(margin_y * 1.5), int(height - margin_y * 1.5), line_height * 2):
+        cv2.line(image, (int(margin_x * 1.5), y), (int(width - margin_x * 1.6), y), (40, 40, 40), max(1, line_height // 2))
+    return image, corners[rng.permutation(4)]
+
+
+# name -> (sizes, function building the call's arguments from the scene)
+CASES = {
+    "pre_process": (("500px", "3MP", "12MP"), lambda image, corners: (pre_process, image)),
+    "four_point_transform": (("500px", "3MP", "12MP"), lambda image, corners: (four_point_transform, image, corners)),
+    "enhance_image_cv": (("500px", "3MP", "12MP"), lambda image, corners: (enhance_image_cv, image)),
+    "draw_line": (("500px", "3MP", "12MP"), lambda image, corners: (
+        draw_line, image.copy(), (0, 0), (image.shape[1] - 1, image.shape[0] - 1), (0, 0, 255), 1)),
+    # Builds a float64 copy of every 5x5 window: about 600 MB at 3 MP and 2.4 GB at 12 MP
+    "vectorized_gaussian_blur": (("500px", "3MP"), lambda image, corners: (
+        vectorized_gaussian_blur, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), gaussian_kernel(5))),
+    # A pure Python loop over every output pixel and channel
+    "bilinear_interpolate": (("500px",), lambda image, corners: (
+        bilinear_interpolate, image, image.shape[1] // 2, image.shape[0] // 2)),
+    "order_points": (("quad",), lambda image, corners: (order_points, corners)),
+    "clockwise_order": (("quad",), lambda image, corners: (clockwise_order, corners)),
+    # The batch form, on 10000 quads at once
+    "order_points_batch": (("quad",), lambda image, quad: (corners.order_points, np.tile(quad, (10000, 1, 1)))),
+}
+
+
+def measure(function, *args, repeat=5):
+    """
+    Measures the best time and the peak traced memory of a call.
+
+    Args:
+        function (callable): The primitive.
+        *args: Its arguments.
+        repeat (int, optional): The number of timed loops. Defaults to 5.
+
+    Returns:
+        dict: The time per call in milliseconds and the peak allocation in KiB.
+    """
+    timer = timeit.Timer(lambda: function(*args))
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"time_ms": best * 1000, "peak_kb": peak / 1024}
+
+
+def run(cases, sizes, repeat):
+    """
+    Benchmarks the selected cases at the selected sizes.
+
+    Returns:
+        dict: The measurements by "case@size".
+    """
+    scenes = {}
+    results = {}
+    for name in cases:
+        case_sizes, make_call = CASES[name]
+        for size in case_sizes:
+            if size != "quad" and size not in sizes:
+                continue
+            if size not in scenes:
+                scenes[size] = make_scene(*SIZES.get(size, SIZES["500px"]))
+            function, *args = make_call(*scenes[size])
+            results[f"{name}@{size}"] = measure(function, *args, repeat=repeat)
+            print(f"{name}@{size}: {results[f'{name}@{size}']['time_ms']:.3f} ms", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    """
+    Compares measurements to a baseline.
+
+    Args:
+        results (dict): The measurements by "case@size", as returned by `run`.
+        baseline (dict): The baseline measurements in the same form.
+        tolerance (float): The allowed relative growth of the time, e.g. 0.2 for 20%.
+        memory_tolerance (float): The allowed relative growth of the peak memory.
+
+    Returns:
+        dict: For every case, its measurements, the baseline's, their ratios and a
+        status: "ok", "regressed", or "new" without a baseline.
+    """
+    report = {}
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            report[key] = {**current, "status": "new"}
+            continue
+        time_regressed = (current["time_ms"] > base["time_ms"] * (1 + tolerance)
+                          and current["time_ms"] - base["time_ms"] > MIN_TIME_DELTA_MS)
+        memory_regressed = (current["peak_kb"] > base["peak_kb"] * (1 + memory_tolerance)
+                            and current["peak_kb"] - base["peak_kb"] > MIN_MEMORY_DELTA_KB)
+        report[key] = {
+            **current,
+            "baseline_time_ms": base["time_ms"],
+            "baseline_peak_kb": base["peak_kb"],
+            "time_ratio": current["time_ms"] / base["time_ms"] if base["time_ms"] else None,
+            "memory_ratio": current["peak_kb"] / base["peak_kb"] if base["peak_kb"] else None,
+            "status": "regressed" if time_regressed or memory_regressed else "ok",
+        }
+    return report
+
+
+def machine():
+    """
+    Describes the machine and library versions that timings depend on.
+    """
+    return {"platform": platform.platform(), "processor": platform.processor(), "cpu_count": os.cpu_count(),
+            "python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Record the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("BENCH_TOLERANCE", 0.25)))
+    parser.add_argument("--memory-tolerance", type=float, default=float(os.getenv("BENCH_MEMORY_TOLERANCE", 0.1)))
+    args = parser.parse_args()
+
+    results = run(args.cases, args.sizes, args.repeat)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": machine(), "results": results}, f, indent=2)
+            f.write("\n")
+        print(json.dumps({"baseline": args.baseline, "results": results}, indent=2))
+        return
+
+    baseline = {"machine": None, "results": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline first", file=sys.stderr)
+    report = compare(results, baseline["results"], args.tolerance, args.memory_tolerance)
+    regressions = sorted(key for key, case in report.items() if case["status"] == "regressed")
+    print(json.dumps({"machine": machine(), "baseline_machine": baseline["machine"], "tolerance": args.tolerance,
+                      "memory_tolerance": args.memory_tolerance, "regressions": regressions, "results": report},
+                     indent=2))
+    if baseline["machine"] is not None and baseline["machine"] != machine():
+        print("Warning: the baseline was recorded on a different machine or library versions", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
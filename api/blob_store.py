@@ -0,0 +1,470 @@
+import bisect
+import json
+import os
+import re
+import tempfile
+
+import anyio.from_thread
+import anyio.to_thread
+import motor.motor_asyncio
+from gridfs.errors import NoFile
+from pymongo.errors import DuplicateKeyError
+
+from db.mongodb_utils import BLOB_BUCKET, get_database
+
+# "local" keeps blobs in a directory tree; "gridfs" keeps them in MongoDB, split into chunks
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local")
+# The GridFS chunk size and the size of the pieces a download is sent in
+BLOB_CHUNK_SIZE = int(os.getenv("BLOB_CHUNK_SIZE", 255 * 1024))
+
+_NAME = re.compile(r"[0-9A-Za-z_-]{1,128}")
+
+def check_name(name):
+    """
+    Checks that a blob name is safe to use as a file name.
+
+    Raises:
+        ValueError: If the name contains anything but letters, digits, "-" and "_".
+    """
+    if not _NAME.fullmatch(name):
+        raise ValueError("Invalid blob name")
+    return name
+
+def byte_range(header, length):
+    """
+    Parses a `Range` request header for a single byte range.
+
+    Args:
+        header (str): The header value, e.g. `bytes=0-499`, `bytes=500-` or `bytes=-500`; may be None.
+        length (int): The size of the blob.
+
+    Raises:
+        ValueError: If the range cannot be satisfied.
+
+    Returns:
+        tuple: The first and last byte offsets, inclusive, or None to send the whole blob,
+        as for a missing, malformed or multi-range header.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        if not start:
+            start, end = max(0, length - int(end)), length - 1
+        else:
+            start, end = int(start), min(int(end), length - 1) if end else length - 1
+    except ValueError:
+        return None
+    if start > end or start >= length:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+class BlobReader:
+    """
+    The interface shared by the readers of all backends.
+
+    Readers behave like binary files with asynchronous `read` and `readline`, and
+    `chunks` iterates over a byte range without holding more than one chunk.
+
+    Attributes:
+        length (int): The size of the blob in bytes.
+        chunk_size (int): The size of the pieces yielded by `chunks`.
+    """
+
+    async def chunks(self, start=0, end=None):
+        """
+        Yields the bytes from `start` to `end`, inclusive, one chunk at a time.
+
+        Args:
+            start (int, optional): The first byte offset. Defaults to 0.
+            end (int, optional): The last byte offset. Defaults to the end of the blob.
+
+        Yields:
+            bytes: Consecutive pieces of at most `chunk_size` bytes.
+        """
+        remaining = (self.length - 1 if end is None else end) - start + 1
+        self.seek(start)
+        while remaining > 0:
+            chunk = await self.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+class LocalBlobReader(BlobReader):
+    """
+    Reads a blob file; reads run in a worker thread so they do not block the event loop.
+    """
+
+    def __init__(self, path, chunk_size):
+        self.file = open(path, "rb")
+        self.length = os.fstat(self.file.fileno()).st_size
+        self.chunk_size = chunk_size
+
+    async def read(self, size=-1):
+        return await anyio.to_thread.run_sync(self.file.read, size)
+
+    async def readline(self):
+        return await anyio.to_thread.run_sync(self.file.readline)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def blocking(self):
+        """
+        Returns a file object with blocking methods, for parsers running in a worker thread.
+        """
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+class LocalBlobWriter:
+    """
+    Writes a blob to a temporary file; the file operations run in a worker thread so
+    they do not block the event loop.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        os.makedirs(store.root, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=store.root)
+        self.file = os.fdopen(fd, "wb")
+
+    async def write(self, data):
+        await anyio.to_thread.run_sync(self.file.write, data)
+
+    async def commit(self, name, metadata):
+        """
+        Moves the written blob to its name and stores its metadata next to it.
+
+        Returns:
+            bool: True if the blob was stored, False if a blob with this name already
+            existed and the new copy was discarded.
+        """
+        return await anyio.to_thread.run_sync(self._commit, name, metadata)
+
+    def _commit(self, name, metadata):
+        self.file.close()
+        path = self.store.path(name)
+        if self.store.read_metadata(name) is not None and os.path.exists(path):
+            os.unlink(self.tmp_path)
+            return False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.tmp_path, path)
+        fd, meta_tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(metadata, f)
+        os.replace(meta_tmp, self.store.path(name, ".json"))
+        return True
+
+    async def abort(self):
+        await anyio.to_thread.run_sync(self._abort)
+
+    def _abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+class LocalBlobStore:
+    """
+    Stores blobs as files in a local directory tree.
+
+    Blobs are spread over subdirectories named after the first two characters of their
+    name (`ab/abcd...`) and each has a JSON metadata file next to it. Writes go to a
+    temporary file first and are renamed into place, so readers never see partial files.
+    Downloads can be sent straight from the file with `local_path`. Every file operation
+    of the asynchronous methods runs in a worker thread, so slow disks do not stall the
+    event loop.
+
+    Attributes:
+        root (str): The directory holding the blobs.
+        suffix (str): The file name extension of the blobs, e.g. ".pdf".
+        chunk_size (int): The size of the pieces downloads are read in.
+    """
+
+    def __init__(self, root, suffix="", chunk_size=BLOB_CHUNK_SIZE):
+        self.root = root
+        self.suffix = suffix
+        self.chunk_size = chunk_size
+
+    def path(self, name, suffix=None):
+        """
+        Returns the location of a blob, or with suffix ".json" of its metadata.
+
+        Raises:
+            ValueError: If the name is not a valid blob name.
+        """
+        check_name(name)
+        return os.path.join(self.root, name[:2], name + (self.suffix if suffix is None else suffix))
+
+    def local_path(self, name):
+        return self.path(name)
+
+    async def create(self):
+        """
+        Starts writing a new blob; it gets its name when it is committed.
+
+        Returns:
+            LocalBlobWriter: The writer, with asynchronous `write`, `commit` and `abort` methods.
+        """
+        return await anyio.to_thread.run_sync(LocalBlobWriter, self)
+
+    async def open(self, name):
+        """
+        Opens a blob for reading.
+
+        Returns:
+            LocalBlobReader: The reader, or None if there is no blob with this name.
+        """
+        path = self.path(name)
+        try:
+            return await anyio.to_thread.run_sync(LocalBlobReader, path, self.chunk_size)
+        except FileNotFoundError:
+            return None
+
+    async def metadata(self, name):
+        """
+        Returns the metadata stored with a blob, or None if there is no blob with this name.
+        """
+        return await anyio.to_thread.run_sync(self.read_metadata, name)
+
+    def read_metadata(self, name):
+        """
+        Reads the metadata of a blob in the calling thread; see `metadata`.
+        """
+        try:
+            with open(self.path(name, ".json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+class BlockingReader:
+    """
+    Gives parsers running in a worker thread a blocking file interface to an
+    asynchronous reader, by running each read on the event loop.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def read(self, size=-1):
+        return anyio.from_thread.run(self.reader.read, size)
+
+    def readline(self):
+        return anyio.from_thread.run(self.reader.readline)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.reader.seek(offset, whence)
+
+    def tell(self):
+        return self.reader.tell()
+
+class GridFSBlobReader(BlobReader):
+
+    def __init__(self, grid_out, chunk_size):
+        self.grid_out = grid_out
+        self.length = grid_out.length
+        self.chunk_size = chunk_size
+
+    async def read(self, size=-1):
+        return await self.grid_out.read(size)
+
+    async def readline(self):
+        return await self.grid_out.readline()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.grid_out.seek(offset, whence)
+
+    def tell(self):
+        return self.grid_out.tell()
+
+    def blocking(self):
+        return BlockingReader(self)
+
+    def close(self):
+        self.grid_out.close()
+
+class ConcatenatedReader(BlobReader):
+    """
+    Reads several blobs one after the other as if they were a single blob.
+
+    This serves a document stored as a base and the updates appended to it, e.g. a PDF
+    and its incremental updates, without copying the base into every version.
+
+    Attributes:
+        readers (list): The readers of the parts, in order; nested concatenations are flattened.
+    """
+
+    def __init__(self, readers):
+        self.readers = []
+        for reader in readers:
+            self.readers += reader.readers if isinstance(reader, ConcatenatedReader) else [reader]
+        self._starts = []
+        self.length = 0
+        for reader in self.readers:
+            self._starts.append(self.length)
+            self.length += reader.length
+        self.chunk_size = self.readers[0].chunk_size
+        self._position = 0
+
+    def _part(self):
+        """
+        Returns the reader holding the current position, positioned there, and the bytes left in it.
+        """
+        index = bisect.bisect_right(self._starts, self._position) - 1
+        reader = self.readers[index]
+        offset = self._position - self._starts[index]
+        reader.seek(offset)
+        return reader, reader.length - offset
+
+    async def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self._position
+        parts = []
+        while size > 0 and self._position < self.length:
+            reader, left = self._part()
+            data = await reader.read(min(size, left))
+            if not data:
+                break
+            parts.append(data)
+            self._position += len(data)
+            size -= len(data)
+        return b"".join(parts)
+
+    async def readline(self):
+        parts = []
+        while self._position < self.length:
+            reader, _ = self._part()
+            line = await reader.readline()
+            if not line:
+                break
+            parts.append(line)
+            self._position += len(line)
+            if line.endswith(b"\n"):
+                break
+        return b"".join(parts)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def blocking(self):
+        return BlockingReader(self)
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+class GridFSBlobWriter:
+
+    def __init__(self, store, grid_in):
+        self.store = store
+        self.grid_in = grid_in
+
+    async def write(self, data):
+        await self.grid_in.write(data)
+
+    async def commit(self, name, metadata):
+        """
+        Finishes the upload, then renames it and attaches its metadata in one update.
+
+        The bucket's file names are unique (see `db.mongodb_utils.INDEXES`), so when two
+        copies of a blob are committed at the same time exactly one of them is kept.
+
+        Returns:
+            bool: True if the blob was stored, False if a blob with this name already
+            existed and the new copy was discarded.
+        """
+        check_name(name)
+        await self.grid_in.close()
+        try:
+            await self.store.files().update_one({"_id": self.grid_in._id},
+                                                {"$set": {"filename": name, "metadata": metadata}})
+            return True
+        except DuplicateKeyError:
+            await self.store.bucket().delete(self.grid_in._id)
+            return False
+
+    async def abort(self):
+        if self.grid_in.closed:
+            await self.store.bucket().delete(self.grid_in._id)
+        else:
+            await self.grid_in.abort()
+
+class GridFSBlobStore:
+    """
+    Stores blobs in a MongoDB GridFS bucket, split into `chunk_size` chunks.
+
+    Uploads are written chunk by chunk as their bytes arrive under a temporary name,
+    and downloads are read chunk by chunk, so memory per transfer stays constant
+    however large the blob is. Metadata is kept in the bucket's files collection.
+
+    Attributes:
+        bucket_name (str): The name of the GridFS bucket.
+        chunk_size (int): The size of the chunks blobs are stored and read in.
+    """
+
+    def __init__(self, bucket_name=BLOB_BUCKET, chunk_size=BLOB_CHUNK_SIZE, get_database=get_database):
+        self.bucket_name = bucket_name
+        self.chunk_size = chunk_size
+        self.get_database = get_database
+
+    def bucket(self):
+        return motor.motor_asyncio.AsyncIOMotorGridFSBucket(self.get_database(), self.bucket_name,
+                                                            chunk_size_bytes=self.chunk_size)
+
+    def files(self):
+        return self.get_database()[self.bucket_name + ".files"]
+
+    def local_path(self, name):
+        return None
+
+    async def create(self):
+        grid_in = self.bucket().open_upload_stream(f".tmp-{os.urandom(8).hex()}")
+        return GridFSBlobWriter(self, grid_in)
+
+    async def open(self, name):
+        check_name(name)
+        try:
+            grid_out = await self.bucket().open_download_stream_by_name(name)
+        except NoFile:
+            return None
+        return GridFSBlobReader(grid_out, self.chunk_size)
+
+    async def metadata(self, name):
+        check_name(name)
+        document = await self.files().find_one({"filename": name}, {"metadata": 1})
+        return document.get("metadata") if document is not None else None
+
+def make_blob_store(root, suffix="", backend=BLOB_BACKEND):
+    """
+    Creates the blob store selected by `BLOB_BACKEND`.
+
+    Args:
+        root (str): The directory of the "local" backend.
+        suffix (str, optional): The file name extension of the "local" backend. Defaults to none.
+        backend (str, optional): "local" or "gridfs". Defaults to `BLOB_BACKEND`.
+
+    Raises:
+        ValueError: If the backend is unknown.
+
+    Returns:
+        LocalBlobStore | GridFSBlobStore: The store.
+    """
+    if backend == "local":
+        return LocalBlobStore(root, suffix)
+    if backend == "gridfs":
+        return GridFSBlobStore()
+    raise ValueError("Unknown blob backend: %s" % backend)
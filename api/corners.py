@@ -0,0 +1,149 @@
+import numpy as np
+
+def as_quads(quads):
+    """
+    Checks and converts a batch of quadrilaterals.
+
+    Args:
+        quads (array-like): N quadrilaterals as an (N, 4, 2) array, or (N, 4, 1, 2) as
+            OpenCV returns contours.
+
+    Returns:
+        np.ndarray: The quads as an (N, 4, 2) float64 array.
+
+    Raises:
+        ValueError: If the array does not hold N times four 2-D points.
+    """
+    quads = np.asarray(quads)
+    if quads.ndim == 4 and quads.shape[2] == 1:
+        quads = quads.reshape(quads.shape[0], quads.shape[1], 2)
+    if quads.ndim != 3 or quads.shape[1:] != (4, 2):
+        raise ValueError("Quads must have the shape (N, 4, 2)")
+    return quads.astype(np.float64)
+
+def angle_order(quads):
+    """
+    Orders the corners of each quad clockwise, in image coordinates, by their angle about the quad's centroid.
+
+    For a convex quad this is its clockwise outline, whatever the order of the input.
+    Degenerate quads are ordered consistently: corners at the same angle, such as
+    repeated points or points collinear with the centroid, are ordered by their
+    distance from the centroid and then by their input position.
+
+    Args:
+        quads (np.ndarray): An (N, 4, 2) array from `as_quads`.
+
+    Returns:
+        np.ndarray: (N, 4) corner indices, starting at the corner with the smallest angle.
+    """
+    offsets = quads - quads.mean(axis=1, keepdims=True)
+    # With y pointing down, increasing angles run clockwise on screen
+    angles = np.arctan2(offsets[..., 1], offsets[..., 0])
+    distances = np.hypot(offsets[..., 0], offsets[..., 1])
+    positions = np.broadcast_to(np.arange(4), angles.shape)
+    return np.lexsort((positions, distances, angles), axis=-1)
+
+def start_at(order, start):
+    """
+    Rotates each row of `order` so that it begins with the corner index `start[n]`.
+    """
+    shift = np.argmax(order == start[:, np.newaxis], axis=1)
+    return np.take_along_axis(order, (shift[:, np.newaxis] + np.arange(4)) % 4, axis=1)
+
+def is_convex(ordered):
+    """
+    Tells which ordered quads are strictly convex and clockwise in image coordinates.
+
+    Args:
+        ordered (np.ndarray): An (N, 4, 2) array of ordered corners.
+
+    Returns:
+        np.ndarray: An (N,) boolean array; False for concave, self-intersecting and
+        degenerate quads, such as ones with repeated or collinear corners.
+    """
+    ordered = np.asarray(ordered, np.float64)
+    edges = np.roll(ordered, -1, axis=1) - ordered
+    following = np.roll(edges, -1, axis=1)
+    turns = edges[..., 0] * following[..., 1] - edges[..., 1] * following[..., 0]
+    return np.all(turns > 0, axis=1)
+
+def _take(quads, order):
+    return np.take_along_axis(quads, order[..., np.newaxis], axis=1)
+
+def clockwise_indices(quads):
+    """
+    Orders each quad clockwise, starting with the corner closest to the origin.
+
+    Ties in the distance to the origin go to the corner that comes first in the input.
+
+    Args:
+        quads (array-like): N quadrilaterals, see `as_quads`.
+
+    Returns:
+        tuple: (N, 4) corner indices, and an (N,) boolean array of the quads that are
+        strictly convex.
+    """
+    points = as_quads(quads)
+    start = np.argmin(np.sqrt(points[..., 0] ** 2 + points[..., 1] ** 2), axis=1)
+    order = start_at(angle_order(points), start)
+    return order, is_convex(_take(points, order))
+
+def clockwise_order(quads):
+    """
+    Orders each quad clockwise, starting with the corner closest to the origin.
+
+    The batch form of `helpers.clockwise_order`, which finds an order for the convex
+    quads only; see `clockwise_indices`.
+
+    Args:
+        quads (array-like): N quadrilaterals, see `as_quads`.
+
+    Returns:
+        tuple: The ordered corners as an (N, 4, 2) array of the input's type, and an
+        (N,) boolean array of the quads that are strictly convex.
+    """
+    order, convex = clockwise_indices(quads)
+    quads = np.asarray(quads).reshape(order.shape + (2,))
+    return _take(quads, order), convex
+
+def order_points(quads):
+    """
+    Orders each quad as (top-left, top-right, bottom-right, bottom-left).
+
+    The batch form of `v1.endpoints.users.order_points`. The top-left corner is chosen
+    the same way, as the upper of the two leftmost corners, and the others follow it
+    clockwise. This matches `users.order_points` wherever its result is a clockwise
+    outline, and unlike it never swaps the top-right and bottom-right corners of
+    strongly rotated quads into a self-intersecting order.
+
+    Args:
+        quads (array-like): N quadrilaterals, see `as_quads`.
+
+    Returns:
+        np.ndarray: The ordered corners as an (N, 4, 2) float32 array.
+    """
+    points = as_quads(quads)
+    leftmost = np.argsort(points[..., 0], axis=1, kind="stable")[:, :2]
+    left_y = np.take_along_axis(points[..., 1], leftmost, axis=1)
+    top_left = np.where(left_y[:, 1] < left_y[:, 0], leftmost[:, 1], leftmost[:, 0])
+    return _take(points, start_at(angle_order(points), top_left)).astype(np.float32)
+
+def reorder(quads):
+    """
+    Orders each quad as (top-left, top-right, bottom-left, bottom-right) for `cv2.getPerspectiveTransform`.
+
+    The batch form of `utils.reorder`. The top-left corner is the one with the smallest
+    x + y, as there, and the others are taken from the clockwise outline, so each
+    corner is used exactly once even where `utils.reorder`'s sums and differences pick
+    a corner twice.
+
+    Args:
+        quads (array-like): N quadrilaterals, see `as_quads`.
+
+    Returns:
+        np.ndarray: The ordered corners as an (N, 4, 1, 2) int32 array.
+    """
+    points = as_quads(quads)
+    top_left = np.argmin(points.sum(axis=2), axis=1)
+    order = start_at(angle_order(points), top_left)[:, [0, 1, 3, 2]]
+    return _take(points, order).astype(np.int32)[:, :, np.newaxis, :]
@@ -1,37 +1,241 @@
+import logging
 import os
+import threading
 import motor.motor_asyncio
+from pymongo import ASCENDING, DESCENDING, IndexModel, monitoring
+from pymongo.errors import OperationFailure, PyMongoError, ServerSelectionTimeoutError
 
-def get_database():
+logger = logging.getLogger(__name__)
+
+DATABASE_NAME = "document_scanner"
+# The GridFS bucket of the blob store, when `BLOB_BACKEND` is "gridfs"
+BLOB_BUCKET = "pdfs"
+
+# Connection pool and timeout settings; see the PyMongo documentation of MongoClient
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 100))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", 300000))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", 10000))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", 10000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", 30000))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+
+# The indexes every collection needs, created at startup by `ensure_indexes`
+INDEXES = {
+    "users": [IndexModel([("email", ASCENDING)], unique=True, name="email_unique")],
+    "documents": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created"),
+    ],
+    # Blobs are content-addressed, so a name is stored once; see `blob_store.GridFSBlobStore`
+    BLOB_BUCKET + ".files": [IndexModel([("filename", ASCENDING)], unique=True, name="filename_unique")],
+}
+
+# Indexes that no query uses any more, dropped by `ensure_indexes` so inserts stop maintaining them
+OBSOLETE_INDEXES = {
+    "documents": ["user_pdf"],
+}
+# The server's error code when an index to drop does not exist
+INDEX_NOT_FOUND = 27
+
+_client = None
+_client_lock = threading.Lock()
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """
+    Counts connection pool events of the shared MongoDB client.
+
+    PyMongo calls the listener from its own threads, so the counters are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {
+                "open_connections": 0,
+                "checked_out": 0,
+                "connections_created": 0,
+                "connections_closed": 0,
+                "checkouts": 0,
+                "checkout_failures": 0,
+                "pool_clears": 0,
+            }
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    def snapshot(self):
+        """
+        Returns a copy of the counters.
+        """
+        with self._lock:
+            return dict(self.counters)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open_connections=1, connections_created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open_connections=-1, connections_closed=1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(checked_out=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+pool_stats = PoolStats()
+
+def is_configured():
+    """
+    Tells whether a database is configured, i.e. whether 'MONGODB_URL' is set.
     """
-    Connects to the MongoDB database using connection parameters from environment variables.
+    return bool(os.getenv("MONGODB_URL"))
 
-    It constructs the connection string from the environment variables 'MONGODB_PASSWORD'
-    and 'MONGODB_URL', where 'MONGODB_PASSWORD' is inserted into the 'MONGODB_URL' at the 
+def connection_string():
+    """
+    Builds the connection string from the environment variables 'MONGODB_URL' and
+    'MONGODB_PASSWORD', where 'MONGODB_PASSWORD' is inserted into 'MONGODB_URL' at the
     placeholder '<password>'.
 
+    Raises:
+        RuntimeError: If 'MONGODB_URL' is not set.
+
+    Returns:
+        str: The MongoDB connection string.
+    """
+    if not is_configured():
+        raise RuntimeError("MONGODB_URL is not set, so the database cannot be used")
+    return os.getenv("MONGODB_URL").replace("<password>", os.getenv("MONGODB_PASSWORD", ""))
+
+def connect():
+    """
+    Creates the application's MongoDB client if it does not exist yet.
+
+    The client owns a connection pool shared by all requests, so connections and TLS
+    sessions are reused instead of being set up per request. It is normally created
+    in the FastAPI lifespan and closed on shutdown with `close`.
+
+    Returns:
+        AsyncIOMotorClient: The shared client.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = motor.motor_asyncio.AsyncIOMotorClient(
+                connection_string(),
+                maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                minPoolSize=MONGODB_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                event_listeners=[pool_stats],
+            )
+        return _client
+
+def close():
+    """
+    Closes the shared MongoDB client and its connections, if it was created.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def get_database():
+    """
+    Returns the application database from the shared MongoDB client.
+
+    The client is created on first use if the application lifespan has not created it,
+    e.g. in scripts and tests.
+
     Returns:
         AsyncIOMotorDatabase: An instance of the connected database.
     """
-    password = os.getenv("MONGODB_PASSWORD")
-    conn_str_template = os.getenv("MONGODB_URL")
-    conn_str = conn_str_template.replace("<password>", password)
-    client = motor.motor_asyncio.AsyncIOMotorClient(conn_str)
-    return client["document_scanner"]
+    return connect()[DATABASE_NAME]
+
+async def ensure_indexes(db):
+    """
+    Creates the indexes listed in `INDEXES` if they do not exist yet, and drops those
+    listed in `OBSOLETE_INDEXES`.
+
+    Creating an existing index and dropping a missing one are no-ops, so this is safe to
+    run on every startup and from several workers. Failures, e.g. duplicate emails that prevent a unique index,
+    are logged rather than stopping the application. If no server can be reached, the
+    remaining collections are skipped instead of each waiting out
+    `MONGODB_SERVER_SELECTION_TIMEOUT_MS`.
+
+    Args:
+        db (AsyncIOMotorDatabase): The application database.
+    """
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except ServerSelectionTimeoutError as e:
+            logger.error("Could not create indexes, the database is unreachable: %s", e)
+            return
+        except PyMongoError as e:
+            logger.error("Could not create indexes on %s: %s", collection, e)
+    for collection, names in OBSOLETE_INDEXES.items():
+        for name in names:
+            try:
+                await db[collection].drop_index(name)
+            except OperationFailure as e:
+                if e.code != INDEX_NOT_FOUND:
+                    logger.error("Could not drop index %s on %s: %s", name, collection, e)
+            except PyMongoError as e:
+                logger.error("Could not drop index %s on %s: %s", name, collection, e)
+
+def get_pool_stats():
+    """
+    Returns the connection pool settings and counters of the shared client.
+
+    Returns:
+        dict: The pool settings, whether the client exists, and the pool event counters.
+    """
+    return {
+        "connected": _client is not None,
+        "max_pool_size": MONGODB_MAX_POOL_SIZE,
+        "min_pool_size": MONGODB_MIN_POOL_SIZE,
+        **pool_stats.snapshot(),
+    }
 
 def get_db():
     """
-    Generator function that yields the database object and handles database connection.
+    Generator function that yields the database object of the shared client.
 
-    This function is typically used in FastAPI as a dependency to provide database access
-    to path operation functions. It yields the database object to the caller and ensures
-    proper handling of the database connection.
+    This function is used in FastAPI as a dependency to provide database access to path
+    operation functions. Connections are borrowed from the shared client's pool for
+    each operation, so nothing needs to be closed when the request ends.
 
     Yields:
         AsyncIOMotorDatabase: An instance of the connected database.
     """
-    db = get_database()
-    try:
-        yield db
-    finally:
-        # Clean up or close database connection if necessary
-        pass
+    yield get_database()
@@ -0,0 +1,48 @@
+import datetime
+from typing import Dict, List, Optional
+from pydantic import BaseModel, constr
+
+class DocumentCreate(BaseModel):
+    """
+    A Pydantic model representing a request to add a saved PDF to the user's documents.
+
+    Attributes:
+        pdf_id (str): The id of the PDF in the PDF store, as returned by `/upload?save=true`.
+        name (constr): The display name of the document. Between 1 and 200 characters.
+    """
+    pdf_id: constr(pattern=r"^[0-9a-f]{64}$")
+    name: constr(min_length=1, max_length=200)
+
+class Document(BaseModel):
+    """
+    A Pydantic model representing a scanned document in the user's catalogue.
+
+    Attributes:
+        id (str): The unique identifier of the document.
+        name (str): The display name of the document.
+        pdf_id (str): The content hash of the PDF, which is also its id in the PDF store.
+        pages (int): The number of pages.
+        size (int): The size of the PDF in bytes.
+        ocr_status (str): "done" if the PDF has a text layer, otherwise "none".
+        thumbnails (Dict[str, str]): The preview URL for each thumbnail size.
+        created_at (datetime.datetime): When the document was added.
+    """
+    id: str
+    name: str
+    pdf_id: str
+    pages: int
+    size: int
+    ocr_status: str
+    thumbnails: Dict[str, str]
+    created_at: datetime.datetime
+
+class DocumentPage(BaseModel):
+    """
+    A Pydantic model representing one page of a document listing.
+
+    Attributes:
+        documents (List[Document]): The documents, newest first.
+        next_cursor (str, optional): The cursor of the next page, or None on the last page.
+    """
+    documents: List[Document]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,80 @@
+import importlib
+import os
+import sys
+import threading
+import time
+import types
+
+# Import every lazy module at startup instead of on first use, e.g. for latency-sensitive workers
+PREWARM_IMPORTS = os.getenv("PREWARM_IMPORTS", "false").lower() == "true"
+
+_lock = threading.RLock()
+_lazy_modules = {}
+
+class LazyModule(types.ModuleType):
+    """
+    A stand-in for a module that imports it when one of its attributes is first used.
+
+    After the import, the module's attributes are copied onto the stand-in, so later
+    uses cost the same as with a regular import. The import is guarded by a lock, so
+    threads that use the module for the first time at once import it only once.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_loaded"] = False
+
+    def __getattr__(self, attribute):
+        self._lazy_load()
+        try:
+            return self.__dict__[attribute]
+        except KeyError:
+            raise AttributeError(f"module {self.__name__!r} has no attribute {attribute!r}") from None
+
+    def _lazy_load(self):
+        if self.__dict__["_lazy_loaded"]:
+            return
+        with _lock:
+            if not self.__dict__["_lazy_loaded"]:
+                module = importlib.import_module(self.__name__)
+                self.__dict__.update({key: value for key, value in vars(module).items() if key != "__name__"})
+                self.__dict__["_lazy_loaded"] = True
+
+def lazy_import(name):
+    """
+    Returns a module that is imported on first use, e.g. `cv2 = lazy_import("cv2")`.
+
+    Modules that are already imported are returned as they are.
+
+    Args:
+        name (str): The absolute module name, e.g. "PIL.Image".
+
+    Returns:
+        ModuleType: The module or its `LazyModule` stand-in.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    with _lock:
+        if name not in _lazy_modules:
+            _lazy_modules[name] = LazyModule(name)
+        return _lazy_modules[name]
+
+def prewarm():
+    """
+    Imports every module registered with `lazy_import`.
+
+    Returns:
+        dict: The time each import took in milliseconds.
+    """
+    timings = {}
+    for name, module in list(_lazy_modules.items()):
+        start = time.perf_counter()
+        module._lazy_load()
+        timings[name] = (time.perf_counter() - start) * 1000
+    return timings
+
+def loaded_modules():
+    """
+    Returns which lazily imported modules have been imported so far.
+    """
+    return {name: module.__dict__["_lazy_loaded"] for name, module in _lazy_modules.items()}
@@ -1,25 +1,84 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .v1.endpoints import users
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
+# Load the environment before the routers read their settings at import time
 load_dotenv()
 
-app = FastAPI()
+from .v1.endpoints import users, search, pdfs, documents, profiles, metrics as metrics_endpoint
+from db import mongodb_utils
+from metrics import METRICS_ENABLED, SERVER_TIMING_ENABLED, MetricsMiddleware
+from profiling import ProfilingMiddleware
+from memory_tracking import MEMORY_TRACKING_RATE, MemoryTrackingMiddleware
+from lazy_imports import PREWARM_IMPORTS, prewarm
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app):
+    # One MongoDB client, and so one connection pool, for the lifetime of the worker
+    index_task = None
+    if mongodb_utils.is_configured():
+        mongodb_utils.connect()
+        # In the background, so that an unreachable cluster does not delay the endpoints that need no database
+        index_task = asyncio.create_task(mongodb_utils.ensure_indexes(mongodb_utils.get_database()))
+    else:
+        logger.warning("MONGODB_URL is not set; the endpoints that need the database will fail")
+    # OpenCV, Pillow, Tesseract and bcrypt are imported on first use unless prewarmed here
+    if PREWARM_IMPORTS:
+        await run_in_threadpool(prewarm)
+    try:
+        yield
+    finally:
+        if index_task is not None and not index_task.done():
+            index_task.cancel()
+        mongodb_utils.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Counts and times every request; stage timers inside the pipelines report through it
+if METRICS_ENABLED or SERVER_TIMING_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+# Traces the memory of a sample of requests when `MEMORY_TRACKING_RATE` is set
+if MEMORY_TRACKING_RATE > 0:
+    app.add_middleware(MemoryTrackingMiddleware)
+# Profiles single requests that carry the `PROFILING_TOKEN`; a no-op without it
+app.add_middleware(ProfilingMiddleware)
 
 app.include_router(users.router)
+app.include_router(search.router)
+app.include_router(pdfs.router)
+app.include_router(documents.router)
+app.include_router(metrics_endpoint.router)
+app.include_router(profiles.router)
 
 """
-This code sets up a FastAPI application and includes a router from a module called 'users'.
+This code sets up a FastAPI application and includes the routers from the 'users', 'search', 'pdfs', 'documents', 'metrics' and 'profiles' modules.
 It also loads environment variables from a .env file.
 
 Usage:
 1. Import FastAPI and other necessary modules.
 2. Load environment variables from a .env file using 'load_dotenv()'.
-3. Create a FastAPI application instance named 'app'.
-4. Include the router defined in the 'users' module using 'app.include_router(users.router)'.
+3. Create a FastAPI application instance named 'app' whose lifespan opens and closes the shared MongoDB client
+   and ensures the database indexes exist in the background. Without 'MONGODB_URL' the application still starts,
+   and only the endpoints that need the database fail. With 'PREWARM_IMPORTS' it also imports the lazily loaded image
+   and OCR libraries before serving, instead of on their first request.
+4. Add the metrics middleware, which sends 'Server-Timing' headers and collects the request metrics, and the
+   profiling middleware, which profiles single requests on demand. With 'MEMORY_TRACKING_RATE' set, the memory
+   tracking middleware records the peak memory and top allocation sites of a sample of requests.
+5. Include the routers defined in the 'users', 'search', 'pdfs', 'documents', 'metrics' and 'profiles' modules using 'app.include_router()'.
 
 Note:
 - This code serves as the main entry point for the FastAPI application.
 - The 'users' router is expected to contain route handlers for user-related endpoints.
+- The 'search' router contains the full-text search endpoints over OCR'd pages.
+- The 'pdfs' router serves PDFs saved in the content-addressed PDF store.
+- The 'documents' router manages each user's catalogue of scanned documents.
+- The 'metrics' router serves request counts, stage timings and image sizes at '/metrics' for Prometheus.
+- The 'profiles' router lists and serves request profiles to holders of the 'PROFILING_TOKEN'.
+- Requests get the database through 'db.mongodb_utils.get_db', which reuses the shared client's connection pool.
 - Environment variables can be accessed after loading them using 'os.getenv("VARIABLE_NAME")'.
 """
@@ -0,0 +1,215 @@
+import logging
+import os
+import random
+import threading
+import tracemalloc
+
+import numpy as np
+
+from metrics import METRICS_ENABLED, Histogram, stage_tracker
+
+# The share of requests whose memory is tracked, e.g. 0.01; 0 turns tracking off
+MEMORY_TRACKING_RATE = float(os.getenv("MEMORY_TRACKING_RATE", 0))
+MEMORY_TRACKING_FRAMES = int(os.getenv("MEMORY_TRACKING_FRAMES", 10))
+MEMORY_TRACKING_TOP = int(os.getenv("MEMORY_TRACKING_TOP", 5))
+# Tracked requests that peak above this are logged as warnings
+MEMORY_TRACKING_WARN_MB = float(os.getenv("MEMORY_TRACKING_WARN_MB", 512))
+
+# 1 MiB to 4 GiB
+MEMORY_BUCKETS = tuple(float(2 ** i * 1024 * 1024) for i in range(13))
+
+# NumPy reports the data buffers of its arrays, including those OpenCV returns, in this domain
+NUMPY_DOMAIN = np.lib.tracemalloc_domain
+
+_APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+_THIS_FILE = os.path.abspath(__file__)
+
+logger = logging.getLogger(__name__)
+
+REQUEST_PEAK_BYTES = Histogram("scanner_request_peak_memory_bytes", "Peak traced memory of sampled requests.",
+                               ("method", "route"), MEMORY_BUCKETS)
+STAGE_PEAK_BYTES = Histogram("scanner_stage_peak_memory_bytes",
+                             "Peak traced memory during each stage of sampled requests.", ("route", "stage"),
+                             MEMORY_BUCKETS)
+
+def _rss():
+    """
+    Returns the resident memory of the process in bytes, or None where /proc is missing.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _site(traceback):
+    """
+    Returns the innermost frame of a traceback in the app's own code, as "file:line".
+
+    Allocations made inside NumPy, OpenCV's bindings or the standard library are
+    attributed to the line of the app that called them.
+    """
+    frames = list(traceback)[::-1]
+    for frame in frames:
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_APP_ROOT + os.sep) and "site-packages" not in filename and filename != _THIS_FILE:
+            return "%s:%d" % (os.path.relpath(filename, _APP_ROOT), frame.lineno)
+    frame = frames[0]
+    return "%s:%d" % (frame.filename, frame.lineno)
+
+class MemoryTracker:
+    """
+    The memory readings of one tracked request.
+
+    Memory is read with `tracemalloc` whenever a `metrics.stage` starts or ends: the
+    peak of every stage, and a snapshot of the live allocations whenever they are the
+    largest seen so far, from which the top allocation sites and the share of NumPy
+    array data are computed. Allocations made outside Python and NumPy, such as
+    OpenCV's internal buffers and Pillow images, are not traced; the growth of the
+    resident memory at the same points covers them, for the whole process.
+
+    Attributes:
+        scope (dict): The ASGI scope of the request.
+        peak (int): The peak traced memory in bytes.
+        stages (dict): The peak traced memory during each stage in bytes.
+        pixels (int): The number of pixels of the images decoded for the request.
+        overlapping (int): The number of requests that started while this one was
+            tracked; their allocations are counted too.
+    """
+
+    def __init__(self, scope, frames=MEMORY_TRACKING_FRAMES):
+        self.scope = scope
+        self.frames = frames
+        self.peak = 0
+        self.stages = {}
+        self.pixels = 0
+        self.overlapping = 0
+        self._snapshot = None
+        self._snapshot_bytes = 0
+        self._rss_start = self._rss_peak = _rss()
+        self._lock = threading.Lock()
+
+    def start(self):
+        tracemalloc.start(self.frames)
+
+    def _checkpoint(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        rss = _rss()
+        if rss is not None and self._rss_peak is not None:
+            self._rss_peak = max(self._rss_peak, rss)
+        if current > self._snapshot_bytes:
+            self._snapshot = tracemalloc.take_snapshot()
+            self._snapshot_bytes = current
+        return peak
+
+    def enter(self, name):
+        with self._lock:
+            if tracemalloc.is_tracing():
+                self._checkpoint()
+                tracemalloc.reset_peak()
+
+    def exit(self, name):
+        with self._lock:
+            if tracemalloc.is_tracing():
+                peak = self._checkpoint()
+                self.stages[name] = max(self.stages.get(name, 0), peak)
+
+    def image(self, width, height):
+        self.pixels += width * height
+
+    def finish(self):
+        """
+        Stops tracing and summarizes the request.
+
+        Returns:
+            dict: The route, the peak traced memory, the NumPy and other bytes at the
+            largest snapshot, the growth of the resident memory, the decoded megapixels,
+            the stage peaks and the top allocation sites, with all sizes in bytes.
+        """
+        with self._lock:
+            self._checkpoint()
+            tracemalloc.stop()
+        sites = {}
+        numpy_bytes = python_bytes = 0
+        for trace in self._snapshot.traces if self._snapshot is not None else ():
+            site = sites.setdefault(_site(trace.traceback), {"bytes": 0, "numpy_bytes": 0, "count": 0})
+            site["bytes"] += trace.size
+            site["count"] += 1
+            if trace.domain == NUMPY_DOMAIN:
+                site["numpy_bytes"] += trace.size
+                numpy_bytes += trace.size
+            else:
+                python_bytes += trace.size
+        top = sorted(sites.items(), key=lambda item: item[1]["bytes"], reverse=True)[:MEMORY_TRACKING_TOP]
+        rss_growth = self._rss_peak - self._rss_start if self._rss_start is not None else None
+        return {
+            "method": self.scope.get("method"),
+            "route": getattr(self.scope.get("route"), "path", "unmatched"),
+            "peak_bytes": self.peak,
+            "numpy_bytes": numpy_bytes,
+            "python_bytes": python_bytes,
+            "rss_growth_bytes": rss_growth,
+            "megapixels": self.pixels / 1e6,
+            "bytes_per_pixel": self.peak / self.pixels if self.pixels else None,
+            "stages": dict(self.stages),
+            "sites": [{"site": name, **site} for name, site in top],
+            "overlapping": self.overlapping,
+        }
+
+def _mib(size):
+    return size / (1024 * 1024)
+
+def log_report(report):
+    """
+    Logs a tracked request, as a warning if it peaked above `MEMORY_TRACKING_WARN_MB`.
+
+    The report is attached to the record as `memory` for structured log handlers.
+    """
+    level = logging.WARNING if _mib(report["peak_bytes"]) > MEMORY_TRACKING_WARN_MB else logging.INFO
+    stages = ", ".join("%s %.1f MiB" % (name, _mib(peak)) for name, peak in report["stages"].items())
+    sites = ", ".join("%s %.1f MiB" % (site["site"], _mib(site["bytes"])) for site in report["sites"])
+    rss = "n/a" if report["rss_growth_bytes"] is None else "+%.1f MiB" % _mib(report["rss_growth_bytes"])
+    logger.log(level, "Memory of %s %s: peak %.1f MiB (NumPy %.1f MiB at the largest snapshot), RSS %s, %.2f MP, "
+               "%d overlapping; stages: %s; top sites: %s", report["method"], report["route"],
+               _mib(report["peak_bytes"]), _mib(report["numpy_bytes"]), rss, report["megapixels"],
+               report["overlapping"], stages or "none", sites or "none", extra={"memory": report})
+
+class MemoryTrackingMiddleware:
+    """
+    ASGI middleware that tracks the memory of a sample of requests.
+
+    Each request is tracked with probability `MEMORY_TRACKING_RATE`, and at most one at
+    a time, since `tracemalloc` traces the whole process. Tracked requests are added to
+    the `scanner_request_peak_memory_bytes` and `scanner_stage_peak_memory_bytes`
+    histograms and logged with their top allocation sites; see `MemoryTracker`.
+    Tracing slows allocations down, so the rate should stay low in production.
+    """
+
+    def __init__(self, app, rate=None):
+        self.app = app
+        self.rate = MEMORY_TRACKING_RATE if rate is None else rate
+        self._tracker = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.rate <= 0:
+            return await self.app(scope, receive, send)
+        if self._tracker is not None:
+            self._tracker.overlapping += 1
+        if self._tracker is not None or tracemalloc.is_tracing() or random.random() >= self.rate:
+            return await self.app(scope, receive, send)
+
+        tracker = self._tracker = MemoryTracker(scope)
+        token = stage_tracker.set(tracker)
+        tracker.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stage_tracker.reset(token)
+            self._tracker = None
+            report = tracker.finish()
+            if METRICS_ENABLED:
+                REQUEST_PEAK_BYTES.observe(report["peak_bytes"], method=report["method"], route=report["route"])
+                for name, peak in report["stages"].items():
+                    STAGE_PEAK_BYTES.observe(peak, route=report["route"], stage=name)
+            log_report(report)
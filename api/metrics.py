@@ -0,0 +1,247 @@
+import bisect
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+# Histograms and counters for `/metrics`; with both settings off the stage timers do nothing
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MEGAPIXEL_BUCKETS = (0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 16.0, 24.0, 50.0)
+
+# The timings and route of the current request, set by `MetricsMiddleware`
+_request = contextvars.ContextVar("request_metrics", default=None)
+# An object told about the stages and images of the current request, e.g. by `memory_tracking`
+stage_tracker = contextvars.ContextVar("stage_tracker", default=None)
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+class Counter:
+    """
+    A Prometheus counter with labels.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labelnames (tuple): The names of the labels passed to `inc`.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """
+        Yields the (name, labels, value) samples of the text exposition format.
+        """
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.labelnames, key)), value
+
+class Histogram:
+    """
+    A Prometheus histogram with labels.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labelnames (tuple): The names of the labels passed to `observe`.
+        buckets (tuple): The upper bounds of the buckets, in increasing order.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield self.name + "_bucket", labels + [("le", "+Inf" if bound == float("inf") else repr(bound))], cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+def render():
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics page.
+    """
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+REQUESTS = Counter("scanner_requests_total", "HTTP requests by route and status code.", ("method", "route", "status"))
+REQUEST_ERRORS = Counter("scanner_request_errors_total", "HTTP requests that failed with a 5xx status or an exception.",
+                         ("method", "route"))
+REQUEST_SECONDS = Histogram("scanner_request_duration_seconds", "Time until the response headers were sent.",
+                            ("method", "route"))
+STAGE_SECONDS = Histogram("scanner_stage_duration_seconds", "Time spent in each stage of the image pipelines.",
+                          ("route", "stage"))
+IMAGE_MEGAPIXELS = Histogram("scanner_image_megapixels", "Size of the images decoded by each route.", ("route",),
+                             MEGAPIXEL_BUCKETS)
+
+def _route():
+    """
+    Returns the path template of the current request's route, for metric labels.
+    """
+    request = _request.get()
+    if request is None:
+        return "none"
+    return getattr(request["scope"].get("route"), "path", "unmatched")
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times a stage of a pipeline, e.g. `with stage("decode"): ...`.
+
+    The duration is added to the `Server-Timing` header of the current request and to
+    the `scanner_stage_duration_seconds` histogram. Stages run in worker threads count
+    if the thread runs in a copy of the request's context, as with `run_in_threadpool`.
+
+    Args:
+        name (str): The stage name; repeated stages of a request are added up.
+    """
+    request = _request.get()
+    tracker = stage_tracker.get()
+    if request is None and tracker is None and not METRICS_ENABLED:
+        yield
+        return
+    if tracker is not None:
+        tracker.enter(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if tracker is not None:
+            tracker.exit(name)
+        if request is not None:
+            request["stages"].append((name, elapsed))
+        if METRICS_ENABLED:
+            STAGE_SECONDS.observe(elapsed, route=_route(), stage=name)
+
+def record_image(width, height):
+    """
+    Records the dimensions of an image decoded for the current request.
+    """
+    tracker = stage_tracker.get()
+    if tracker is not None:
+        tracker.image(width, height)
+    if METRICS_ENABLED:
+        IMAGE_MEGAPIXELS.observe(width * height / 1e6, route=_route())
+
+def server_timing(stages, total=None):
+    """
+    Formats stage timings as a `Server-Timing` header value.
+
+    Args:
+        stages (list): (name, seconds) pairs; repeated names are added up in order of first appearance.
+        total (float, optional): The time of the whole request in seconds. Defaults to None.
+
+    Returns:
+        str: E.g. `decode;dur=12.10, encode;dur=3.40, total;dur=16.00`.
+    """
+    durations = {}
+    for name, elapsed in stages:
+        durations[name] = durations.get(name, 0.0) + elapsed
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in durations.items())
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that counts and times requests and sends their stage timings.
+
+    The `Server-Timing` header is added when the response starts, so for streamed
+    responses it holds the stages finished before the first byte, e.g. the first page
+    of a PDF. Routes are labelled by their path template, so ids in paths do not
+    create new series. Metrics are kept per worker process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request = {"scope": scope, "stages": []}
+        token = _request.set(request)
+        start = time.perf_counter()
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - start
+                if METRICS_ENABLED:
+                    REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=_route())
+                if SERVER_TIMING_ENABLED:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(request["stages"], elapsed).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception:
+            status = status or 500
+            raise
+        finally:
+            if METRICS_ENABLED:
+                route = _route()
+                REQUESTS.inc(method=scope["method"], route=route, status=status or 500)
+                if (status or 500) >= 500:
+                    REQUEST_ERRORS.inc(method=scope["method"], route=route)
+            _request.reset(token)
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from ocr_utils import ocr_image
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "ocr_cache.sqlite3")
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Lookups are counted and their access times kept in memory, and written with the next
+# store, or once this many lookups or seconds have accumulated
+OCR_CACHE_FLUSH_LOOKUPS = int(os.getenv("OCR_CACHE_FLUSH_LOOKUPS", 100))
+OCR_CACHE_FLUSH_SECONDS = float(os.getenv("OCR_CACHE_FLUSH_SECONDS", 30))
+
+# Seconds a write waits for other workers' transactions
+BUSY_TIMEOUT = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ocr_cache_last_access ON ocr_cache (last_access);
+CREATE TABLE IF NOT EXISTS ocr_cache_stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO ocr_cache_stats (name, value) VALUES ('hits', 0), ('misses', 0), ('evictions', 0), ('bytes', 0);
+"""
+
+def make_cache_key(gray, **params):
+    """
+    Builds a cache key from the pixels of a grayscale page and the OCR parameters.
+
+    Args:
+        gray (np.ndarray): The grayscale page image passed to the OCR pipeline.
+        **params: The OCR parameters that affect the result (language, PSM, mode, ...).
+
+    Returns:
+        str: A hex SHA-256 digest identifying the page and parameters.
+    """
+    digest = hashlib.sha256()
+    digest.update(("%s|%s|" % (gray.shape, gray.dtype)).encode("ascii"))
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    digest.update(memoryview(gray if gray.flags.c_contiguous else gray.copy()).cast("B"))
+    return digest.hexdigest()
+
+class OcrCache:
+    """
+    A persistent, size-bounded LRU cache of OCR results stored in SQLite.
+
+    The database runs in WAL mode with a busy timeout, and every write happens in an
+    immediate transaction, so several uvicorn workers can share one cache file.
+    Lookups only read, so they never wait for the write lock: each process keeps the
+    access times of its hits and its hit and miss counts in memory, and writes them in
+    one transaction with its next store, or after `OCR_CACHE_FLUSH_LOOKUPS` lookups or
+    `OCR_CACHE_FLUSH_SECONDS` seconds. The counters live in the same database and
+    therefore cover all workers, up to what each has not written yet.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+        max_bytes (int): The total size of cached results above which the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._pending_lock = threading.Lock()
+        self._accessed = {}
+        self._hits = 0
+        self._misses = 0
+        self._pending_since = None
+
+    def _connect(self):
+        """
+        Returns this thread's connection, creating the database on first use.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _take_pending(self):
+        with self._pending_lock:
+            pending = self._accessed, self._hits, self._misses
+            self._accessed, self._hits, self._misses, self._pending_since = {}, 0, 0, None
+        return pending
+
+    def _restore_pending(self, accessed, hits, misses):
+        with self._pending_lock:
+            for key, accessed_at in accessed.items():
+                self._accessed[key] = max(accessed_at, self._accessed.get(key, 0.0))
+            self._hits += hits
+            self._misses += misses
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+
+    def _write_pending(self, conn, accessed, hits, misses):
+        """
+        Writes the given access times and counters inside the caller's transaction.
+        """
+        conn.executemany("UPDATE ocr_cache SET last_access = MAX(last_access, ?) WHERE key = ?",
+                         [(accessed_at, key) for key, accessed_at in accessed.items()])
+        conn.executemany("UPDATE ocr_cache_stats SET value = value + ? WHERE name = ?",
+                         [(hits, "hits"), (misses, "misses")])
+
+    def flush(self, wait=True):
+        """
+        Writes this process's pending access times and hit and miss counts.
+
+        If the database is busy or unavailable, they are kept for the next attempt.
+
+        Args:
+            wait (bool, optional): Whether to wait for other workers' writes, up to the busy
+                timeout, rather than give up at once. Defaults to True.
+        """
+        pending = self._take_pending()
+        if not pending[0] and not pending[1] and not pending[2]:
+            return
+        try:
+            conn = self._connect()
+            if not wait:
+                conn.execute("PRAGMA busy_timeout = 0")
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._write_pending(conn, *pending)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            finally:
+                if not wait:
+                    conn.execute("PRAGMA busy_timeout = %d" % (BUSY_TIMEOUT * 1000))
+        except sqlite3.Error as e:
+            if wait:
+                logger.warning("OCR cache flush failed: %s", e)
+            self._restore_pending(*pending)
+
+    def get(self, key):
+        """
+        Looks up a cached OCR result and marks it as recently used.
+
+        The lookup only reads; see the class documentation for how the access time and
+        the hit or miss are recorded.
+
+        Args:
+            key (str): The key returned by `make_cache_key`.
+
+        Returns:
+            dict: The cached result, or None on a miss or if the cache is unavailable.
+        """
+        try:
+            row = self._connect().execute("SELECT result FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("OCR cache lookup failed: %s", e)
+            return None
+
+        with self._pending_lock:
+            if row is not None:
+                self._hits += 1
+                self._accessed[key] = time.time()
+            else:
+                self._misses += 1
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            due = (self._hits + self._misses >= OCR_CACHE_FLUSH_LOOKUPS
+                   or time.monotonic() - self._pending_since >= OCR_CACHE_FLUSH_SECONDS)
+        if due:
+            # A lookup never waits for the write lock; if it is taken, a later lookup or store writes these
+            self.flush(wait=False)
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key, result):
+        """
+        Stores an OCR result and evicts least recently used entries beyond `max_bytes`.
+
+        Args:
+            key (str): The key returned by `make_cache_key`.
+            result (dict): The JSON-serializable OCR result.
+        """
+        payload = json.dumps(result)
+        size = len(payload.encode("utf-8"))
+        pending = self._take_pending()
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Before evicting, so that the recent hits of this process count
+                self._write_pending(conn, *pending)
+                old = conn.execute("SELECT size FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+                conn.execute("INSERT OR REPLACE INTO ocr_cache (key, result, size, last_access) VALUES (?, ?, ?, ?)",
+                             (key, payload, size, time.time()))
+                total = conn.execute("UPDATE ocr_cache_stats SET value = value + ? WHERE name = 'bytes' RETURNING value",
+                                     (size - (old[0] if old else 0),)).fetchone()[0]
+                evicted = 0
+                while total > self.max_bytes:
+                    victims = conn.execute("SELECT key, size FROM ocr_cache WHERE key != ? ORDER BY last_access LIMIT 64",
+                                           (key,)).fetchall()
+                    if not victims:
+                        break
+                    for victim_key, victim_size in victims:
+                        if total <= self.max_bytes:
+                            break
+                        conn.execute("DELETE FROM ocr_cache WHERE key = ?", (victim_key,))
+                        total -= victim_size
+                        evicted += 1
+                conn.execute("UPDATE ocr_cache_stats SET value = ? WHERE name = 'bytes'", (total,))
+                conn.execute("UPDATE ocr_cache_stats SET value = value + ? WHERE name = 'evictions'", (evicted,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning("OCR cache store failed: %s", e)
+            self._restore_pending(*pending)
+
+    def stats(self):
+        """
+        Returns the cache statistics shared by all workers.
+
+        This process's pending counts are written first unless another worker is writing;
+        other workers' are not included yet.
+
+        Returns:
+            dict: Hits, misses, hit rate, evictions, entry count and stored bytes, and
+            whether the cache is available; only `available` and `max_bytes` if it is not.
+        """
+        self.flush(wait=False)
+        try:
+            conn = self._connect()
+            counters = dict(conn.execute("SELECT name, value FROM ocr_cache_stats").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning("OCR cache statistics failed: %s", e)
+            return {"available": False, "max_bytes": self.max_bytes}
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "available": True,
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            "evictions": counters["evictions"],
+            "entries": entries,
+            "bytes": counters["bytes"],
+            "max_bytes": self.max_bytes,
+        }
+
+ocr_cache = OcrCache()
+
+def cached_ocr_image(gray, mode="page", lang="eng", psm=3, rescale=True):
+    """
+    Runs `ocr_utils.ocr_image` through the shared OCR cache.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+        mode (str, optional): "page" or "blocks". Defaults to "page".
+        lang (str, optional): The Tesseract language code. Defaults to "eng".
+        psm (int, optional): The Tesseract page segmentation mode. Defaults to 3.
+        rescale (bool, optional): Whether to rescale the page to the target text height. Defaults to True.
+
+    Returns:
+        dict: The OCR result, from the cache when the same page was seen before. The
+        per-block OCR times of "blocks" mode are only reported when the page was just
+        recognized, as they are not cached.
+    """
+    key = make_cache_key(gray, mode=mode, lang=lang, psm=psm, rescale=rescale)
+    result = ocr_cache.get(key)
+    if result is None:
+        result = ocr_image(gray, mode=mode, lang=lang, psm=psm, rescale=rescale)
+        cached = dict(result)
+        if "blocks" in cached:
+            cached["blocks"] = [{name: value for name, value in block.items() if name != "seconds"}
+                                for block in cached["blocks"]]
+        ocr_cache.put(key, cached)
+    return result
@@ -0,0 +1,433 @@
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+import numpy as np
+
+from lazy_imports import lazy_import
+
+cv2 = lazy_import("cv2")
+pytesseract = lazy_import("pytesseract")
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+OCR_TARGET_TEXT_HEIGHT = int(os.getenv("OCR_TARGET_TEXT_HEIGHT", 30))
+# Upscaling for OCR never makes a page larger than this; an A4 page at 300 dpi has 8.7 MP
+OCR_MAX_MEGAPIXELS = float(os.getenv("OCR_MAX_MEGAPIXELS", 9))
+
+_ocr_pool = None
+
+def binarize_page(gray):
+    """
+    Binarizes a grayscale page with Otsu's threshold so that ink pixels are set.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+
+    Returns:
+        np.ndarray: A uint8 mask where ink is 255 and background is 0.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return binary
+
+def clean_text_mask(binary):
+    """
+    Removes specks, rules and page borders from an ink mask using connected components.
+
+    Components that are too small to be glyphs, or that span most of the page width
+    or height (scan borders, table rules), would otherwise bridge the whitespace gaps
+    that the projection analysis relies on.
+
+    Args:
+        binary (np.ndarray): The ink mask returned by `binarize_page`.
+
+    Returns:
+        tuple: The cleaned boolean mask and the median glyph height in pixels.
+    """
+    height, width = binary.shape[:2]
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+
+    w = stats[:, cv2.CC_STAT_WIDTH]
+    h = stats[:, cv2.CC_STAT_HEIGHT]
+    area = stats[:, cv2.CC_STAT_AREA]
+    keep = (area >= 3) & (w < 0.9 * width) & (h < 0.5 * height)
+    keep[0] = False  # Label 0 is the background
+
+    glyph_heights = h[keep]
+    char_height = float(np.median(glyph_heights)) if glyph_heights.size else 0.0
+    return keep[labels], char_height
+
+def _find_gaps(profile, min_gap):
+    """
+    Finds interior runs of empty entries in a projection profile.
+
+    Args:
+        profile (np.ndarray): A boolean profile, True where the row/column holds ink.
+        min_gap (int): The shortest run of empty entries that counts as a gap.
+
+    Returns:
+        list: (start, end) pairs of every gap, excluding leading and trailing margins.
+    """
+    ink = np.flatnonzero(profile)
+    if ink.size < 2:
+        return []
+    steps = np.diff(ink)
+    gap_idx = np.flatnonzero(steps > min_gap)
+    return [(int(ink[i]) + 1, int(ink[i + 1])) for i in gap_idx]
+
+def _xy_cut(mask, x0, y0, min_gap_y, min_gap_x, leaves):
+    """
+    Recursively splits a region at its widest whitespace gap (recursive XY-cut).
+
+    Cutting at the widest gap first separates columns before lines, so the leaves
+    come out in reading order: top to bottom, and left to right within a row.
+
+    Args:
+        mask (np.ndarray): The boolean ink mask of the region.
+        x0 (int): The x offset of the region within the page.
+        y0 (int): The y offset of the region within the page.
+        min_gap_y (int): The minimum height of a horizontal gap between lines.
+        min_gap_x (int): The minimum width of a vertical gap between columns.
+        leaves (list): Output list that receives (x, y, w, h) boxes.
+    """
+    rows = mask.any(axis=1)
+    cols = mask.any(axis=0)
+    if not rows.any():
+        return
+
+    # Trim the region to its ink bounding box
+    top, bottom = np.flatnonzero(rows)[[0, -1]]
+    left, right = np.flatnonzero(cols)[[0, -1]]
+    mask = mask[top:bottom + 1, left:right + 1]
+    x0, y0 = x0 + int(left), y0 + int(top)
+
+    row_gaps = _find_gaps(rows[top:bottom + 1], min_gap_y)
+    col_gaps = _find_gaps(cols[left:right + 1], min_gap_x)
+    best_row = max(row_gaps, key=lambda g: g[1] - g[0], default=None)
+    best_col = max(col_gaps, key=lambda g: g[1] - g[0], default=None)
+
+    if best_col is not None and (best_row is None or best_col[1] - best_col[0] > best_row[1] - best_row[0]):
+        start, end = best_col
+        _xy_cut(mask[:, :start], x0, y0, min_gap_y, min_gap_x, leaves)
+        _xy_cut(mask[:, end:], x0 + end, y0, min_gap_y, min_gap_x, leaves)
+    elif best_row is not None:
+        start, end = best_row
+        _xy_cut(mask[:start], x0, y0, min_gap_y, min_gap_x, leaves)
+        _xy_cut(mask[end:], x0, y0 + end, min_gap_y, min_gap_x, leaves)
+    else:
+        leaves.append((x0, y0, mask.shape[1], mask.shape[0]))
+
+def _overlaps_horizontally(a, b):
+    """
+    Checks whether two boxes share at least half of the narrower box's width.
+
+    Args:
+        a (tuple): The first (x, y, w, h) box.
+        b (tuple): The second (x, y, w, h) box.
+
+    Returns:
+        bool: True if the boxes belong to the same column.
+    """
+    overlap = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    return overlap >= 0.5 * min(a[2], b[2])
+
+def _union(a, b):
+    """
+    Returns the bounding box enclosing two (x, y, w, h) boxes.
+    """
+    x, y = min(a[0], b[0]), min(a[1], b[1])
+    return (x, y, max(a[0] + a[2], b[0] + b[2]) - x, max(a[1] + a[3], b[1] + b[3]) - y)
+
+def segment_text_blocks(gray, target_blocks=None):
+    """
+    Segments a page into text blocks in reading order.
+
+    The page is binarized, cleaned with connected-component statistics and cut into
+    line bands by recursive XY-cut on the projection profiles. Consecutive lines of
+    the same column are then grouped into roughly `target_blocks` blocks, which keeps
+    the per-call Tesseract start-up cost low while still feeding every worker.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+        target_blocks (int, optional): The desired number of blocks. Defaults to twice `OCR_WORKERS`.
+
+    Returns:
+        list: (x, y, w, h) boxes of the text blocks, in reading order.
+    """
+    if target_blocks is None:
+        target_blocks = 2 * OCR_WORKERS
+
+    mask, char_height = clean_text_mask(binarize_page(gray))
+    if char_height == 0:
+        return []
+
+    lines = []
+    min_gap_y = max(1, int(round(0.2 * char_height)))
+    min_gap_x = max(2, int(round(1.5 * char_height)))
+    _xy_cut(mask, 0, 0, min_gap_y, min_gap_x, lines)
+
+    lines_per_block = max(1, -(-len(lines) // max(1, target_blocks)))
+    blocks = []
+    current, line_count = None, 0
+    for line in lines:
+        if current is not None and line_count < lines_per_block and _overlaps_horizontally(current, line):
+            current = _union(current, line)
+            line_count += 1
+        else:
+            if current is not None:
+                blocks.append(current)
+            current, line_count = line, 1
+    if current is not None:
+        blocks.append(current)
+    return blocks
+
+def ocr_pool():
+    """
+    Returns the thread pool shared by all block OCR calls, creating it on first use.
+    """
+    global _ocr_pool
+    if _ocr_pool is None:
+        _ocr_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr-block")
+    return _ocr_pool
+
+def ocr_blocks_parallel(gray, lang="eng", workers=None, ocr_fn=None):
+    """
+    Performs OCR on a page by recognizing its text blocks in parallel.
+
+    Each block is cropped with a small margin and passed to Tesseract as a uniform
+    block of text (`--psm 6`). pytesseract runs Tesseract in a subprocess, so a thread
+    pool is enough to keep every core busy. The blocks of all concurrent calls share
+    the `OCR_WORKERS` threads of `ocr_pool`, and the call blocks until its own blocks
+    are done, so it should run in a worker thread rather than on the event loop.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+        lang (str, optional): The Tesseract language code. Defaults to "eng".
+        workers (int, optional): The number of workers to segment the page for, with two
+            blocks each. Defaults to `OCR_WORKERS`.
+        ocr_fn (callable, optional): The recognizer, called as `ocr_fn(image, lang=..., config=...)`.
+            Defaults to `pytesseract.image_to_string`.
+
+    Returns:
+        tuple: The merged text and a list of per-block dictionaries with
+        the block's bounding box, recognized text and OCR time in seconds.
+    """
+    workers = workers or OCR_WORKERS
+    ocr_fn = ocr_fn or pytesseract.image_to_string
+    blocks = segment_text_blocks(gray, target_blocks=2 * workers)
+    height, width = gray.shape[:2]
+
+    def recognize(box):
+        x, y, w, h = box
+        pad = max(4, h // 10)
+        crop = gray[max(0, y - pad):min(height, y + h + pad), max(0, x - pad):min(width, x + w + pad)]
+        start = time.perf_counter()
+        text = ocr_fn(crop, lang=lang, config="--psm 6")
+        return text, time.perf_counter() - start
+
+    results = list(ocr_pool().map(recognize, blocks))
+
+    texts = [text.strip() for text, _ in results]
+    report = [
+        {"bbox": list(box), "text": text, "seconds": round(seconds, 4)}
+        for box, text, (_, seconds) in zip(blocks, texts, results)
+    ]
+    return "\n".join(text for text in texts if text), report
+
+def glyph_heights(binary, min_height=6):
+    """
+    Returns the heights of the components of an ink mask that are shaped like glyphs.
+
+    Photos of pages hold many more specks of noise, grain and shadow than letters, so
+    only components that are tall enough to be read, small against the page, roughly
+    as wide as tall and filled like ink are counted.
+
+    Args:
+        binary (np.ndarray): The ink mask returned by `binarize_page`.
+        min_height (int, optional): The smallest glyph height in pixels. Defaults to 6.
+
+    Returns:
+        np.ndarray: The heights of the glyph-sized components.
+    """
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    w = stats[1:, cv2.CC_STAT_WIDTH]
+    h = stats[1:, cv2.CC_STAT_HEIGHT]
+    area = stats[1:, cv2.CC_STAT_AREA]
+    glyphs = ((h >= min_height) & (h <= binary.shape[0] / 15)
+              & (w <= 3 * h) & (6 * w >= h)  # Letters and short runs of touching letters, not rules
+              & (area >= 0.15 * w * h))
+    return h[glyphs]
+
+def estimate_text_height(gray, max_side=1200, min_glyphs=30, min_agreement=0.6):
+    """
+    Estimates the dominant character height of a page from connected-component statistics.
+
+    The statistics are computed on a copy downsampled so that its longer side is at
+    most `max_side` pixels, which keeps the estimate cheap on 12 MP photos. The
+    estimate is only trusted if there are at least `min_glyphs` glyph-sized components
+    and at least `min_agreement` of them are within a factor of 1.5 of the median.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+        max_side (int, optional): The longer side of the analysed copy. Defaults to 1200.
+        min_glyphs (int, optional): The number of glyphs needed. Defaults to 30.
+        min_agreement (float, optional): The share of glyphs close to the median. Defaults to 0.6.
+
+    Returns:
+        float: The median glyph height in pixels of the original image, or 0 if it
+        could not be estimated reliably.
+    """
+    scale = min(1.0, max_side / max(gray.shape[:2]))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    heights = glyph_heights(binarize_page(gray))
+    if heights.size < min_glyphs:
+        return 0.0
+    char_height = float(np.median(heights))
+    if np.mean((heights >= char_height / 1.5) & (heights <= char_height * 1.5)) < min_agreement:
+        return 0.0
+    return char_height / scale
+
+def rescale_for_ocr(gray, target_height=None, tolerance=0.25, max_factor=4.0, max_megapixels=None):
+    """
+    Rescales a page so that its dominant character height is close to `target_height`.
+
+    Pages whose text is already within `tolerance` of the target are returned unchanged,
+    so a well-sized scan does not pay for an extra resample, as are pages whose text
+    height cannot be estimated reliably. Upscaling stops at `max_megapixels`, and
+    pages that are already larger are never upscaled.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+        target_height (int, optional): The desired character height in pixels. Defaults to `OCR_TARGET_TEXT_HEIGHT`.
+        tolerance (float, optional): The relative deviation accepted without rescaling. Defaults to 0.25.
+        max_factor (float, optional): The largest upscaling factor applied. Defaults to 4.0.
+        max_megapixels (float, optional): The largest upscaled size. Defaults to `OCR_MAX_MEGAPIXELS`.
+
+    Returns:
+        tuple: The rescaled image and the applied scale factor.
+    """
+    target_height = target_height or OCR_TARGET_TEXT_HEIGHT
+    max_megapixels = max_megapixels or OCR_MAX_MEGAPIXELS
+    char_height = estimate_text_height(gray)
+    if char_height == 0:
+        return gray, 1.0
+
+    factor = min(target_height / char_height, max_factor)
+    if factor > 1.0:
+        height, width = gray.shape[:2]
+        factor = max(1.0, min(factor, (max_megapixels * 1e6 / (height * width)) ** 0.5))
+    if abs(factor - 1.0) <= tolerance:
+        return gray, 1.0
+
+    interpolation = cv2.INTER_AREA if factor < 1.0 else cv2.INTER_CUBIC
+    return cv2.resize(gray, None, fx=factor, fy=factor, interpolation=interpolation), factor
+
+def ocr_image(gray, mode="page", lang="eng", psm=3, rescale=True, ocr_fn=None):
+    """
+    Runs the OCR pipeline used by the `/ocr/` endpoint on a grayscale page.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+        mode (str, optional): "page" for a single Tesseract call or "blocks" for parallel block OCR. Defaults to "page".
+        lang (str, optional): The Tesseract language code. Defaults to "eng".
+        psm (int, optional): The Tesseract page segmentation mode used in "page" mode. Defaults to 3.
+        rescale (bool, optional): Whether to rescale the page to the target text height first. Defaults to True.
+        ocr_fn (callable, optional): The recognizer, called as `ocr_fn(image, lang=..., config=...)`.
+            Defaults to `pytesseract.image_to_string`.
+
+    Returns:
+        dict: The recognized text, the applied scale factor and, in "blocks" mode,
+        the per-block report with bounding boxes in original image coordinates.
+    """
+    factor = 1.0
+    if rescale:
+        gray, factor = rescale_for_ocr(gray)
+
+    if mode == "blocks":
+        text, blocks = ocr_blocks_parallel(gray, lang=lang, ocr_fn=ocr_fn)
+        for block in blocks:
+            block["bbox"] = [int(round(v / factor)) for v in block["bbox"]]
+        return {"text": text, "scale": factor, "blocks": blocks}
+
+    text = (ocr_fn or pytesseract.image_to_string)(gray, lang=lang, config=f"--psm {psm}")
+    return {"text": text, "scale": factor}
+
+class _HocrWordParser(HTMLParser):
+    """
+    Collects the text and bounding box of every `ocrx_word` element of an hOCR document.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.words = []
+        self._depth = 0
+        self._bbox = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._bbox is not None:
+            self._depth += 1
+            return
+        attrs = dict(attrs)
+        if "ocrx_word" in (attrs.get("class") or "").split():
+            match = re.search(r"bbox (\d+) (\d+) (\d+) (\d+)", attrs.get("title") or "")
+            if match:
+                self._bbox = tuple(int(v) for v in match.groups())
+                self._depth = 1
+                self._text = []
+
+    def handle_endtag(self, tag):
+        if self._bbox is None:
+            return
+        self._depth -= 1
+        if self._depth == 0:
+            text = "".join(self._text).strip()
+            if text:
+                self.words.append((text, self._bbox))
+            self._bbox = None
+
+    def handle_data(self, data):
+        if self._bbox is not None:
+            self._text.append(data)
+
+def parse_hocr_words(hocr):
+    """
+    Extracts the recognized words and their bounding boxes from Tesseract's hOCR output.
+
+    Args:
+        hocr (bytes or str): The hOCR document.
+
+    Returns:
+        list: (text, (x0, y0, x1, y1)) tuples in pixel coordinates, in reading order.
+    """
+    if isinstance(hocr, bytes):
+        hocr = hocr.decode("utf-8")
+    parser = _HocrWordParser()
+    parser.feed(hocr)
+    parser.close()
+    return parser.words
+
+def ocr_page_words(gray, lang="eng", rescale=True, hocr_fn=None):
+    """
+    Recognizes the words of a page, with their positions, in a single Tesseract pass.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+        lang (str, optional): The Tesseract language code. Defaults to "eng".
+        rescale (bool, optional): Whether to rescale the page to the target text height first. Defaults to True.
+        hocr_fn (callable, optional): The hOCR renderer, called as `hocr_fn(image, lang=..., extension="hocr")`.
+            Defaults to `pytesseract.image_to_pdf_or_hocr`.
+
+    Returns:
+        list: (text, (x0, y0, x1, y1)) tuples in the page's original pixel coordinates.
+    """
+    factor = 1.0
+    if rescale:
+        gray, factor = rescale_for_ocr(gray)
+    hocr_fn = hocr_fn or pytesseract.image_to_pdf_or_hocr
+    words = parse_hocr_words(hocr_fn(gray, lang=lang, extension="hocr"))
+    if factor != 1.0:
+        words = [(text, tuple(v / factor for v in bbox)) for text, bbox in words]
+    return words
@@ -0,0 +1,50 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy_imports import lazy_import
+
+# Only the password endpoints need bcrypt
+bcrypt = lazy_import("bcrypt")
+
+# bcrypt releases the GIL, so each worker thread hashes on its own core. The pool is
+# kept smaller than the core count so that a burst of logins cannot starve image processing.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+_hash_pool = None
+
+def hash_pool():
+    """
+    Returns the thread pool dedicated to password hashing, creating it on first use.
+    """
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _hash_pool
+
+async def hash_password(password):
+    """
+    Hashes a password with bcrypt without blocking the event loop.
+
+    Args:
+        password (str): The plain-text password.
+
+    Returns:
+        bytes: The bcrypt hash, including its salt and cost.
+    """
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return await asyncio.get_running_loop().run_in_executor(hash_pool(), bcrypt.hashpw, password.encode("utf-8"), salt)
+
+async def verify_password(password, hashed):
+    """
+    Checks a password against a bcrypt hash without blocking the event loop.
+
+    Args:
+        password (str): The plain-text password.
+        hashed (bytes): The stored bcrypt hash.
+
+    Returns:
+        bool: True if the password matches.
+    """
+    return await asyncio.get_running_loop().run_in_executor(hash_pool(), bcrypt.checkpw, password.encode("utf-8"), hashed)
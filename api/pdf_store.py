@@ -0,0 +1,189 @@
+import hashlib
+import os
+import re
+import time
+
+from blob_store import ConcatenatedReader, make_blob_store
+
+PDF_STORE_PATH = os.getenv("PDF_STORE_PATH", "saved_pdfs")
+# The longest chain of updates read on top of a whole file; the next update rewrites the whole PDF
+PDF_STORE_MAX_UPDATES = int(os.getenv("PDF_STORE_MAX_UPDATES", 16))
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+def etag_matches(if_none_match, etag):
+    """
+    Checks an `If-None-Match` request header against a strong entity tag.
+
+    Args:
+        if_none_match (str): The header value, e.g. `"abc", W/"def"` or `*`; may be None.
+        etag (str): The quoted entity tag of the current representation.
+
+    Returns:
+        bool: True if the client already has the representation (weak comparison, RFC 9110).
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+class PdfStore:
+    """
+    Content-addressed storage of generated PDFs.
+
+    A PDF is stored once under a SHA-256 id, so identical documents are deduplicated
+    and a stored document never changes. That makes the id a strong ETag and lets
+    downloads be cached forever. For a whole file the id is the SHA-256 of its bytes.
+    A PDF made by appending an incremental update to a stored one is kept as just the
+    update's bytes, linked to its base through the `base` metadata field, and is read
+    as the base followed by the update. Its id is the SHA-256 of the base's id
+    followed by the update's bytes: as unique and immutable as a file hash, but not
+    the hash of the file, so the same PDF saved in one piece gets a different id.
+    Updates on top of updates form a chain of at most `PDF_STORE_MAX_UPDATES`; the
+    next update is saved as a whole file, with a file hash id, which starts a new
+    chain. The bytes live in a blob store: files on
+    the local disk (`ab/abcd....pdf` with a JSON metadata file next to each) or a
+    GridFS bucket, as selected by `blob_store.BLOB_BACKEND`. Both are written and
+    read chunk by chunk, so no PDF is ever held in memory.
+
+    Attributes:
+        blobs (LocalBlobStore | GridFSBlobStore): The blob store holding the PDFs.
+    """
+
+    def __init__(self, root=PDF_STORE_PATH, blobs=None):
+        self.blobs = blobs if blobs is not None else make_blob_store(root, ".pdf")
+
+    def local_path(self, digest):
+        """
+        Returns the file of a stored PDF, if the blob store keeps it on the local disk.
+
+        For a PDF stored as an update, the file holds only the update's bytes.
+
+        Args:
+            digest (str): The document id, a hex SHA-256 digest.
+
+        Raises:
+            ValueError: If `digest` is not a hex SHA-256 digest.
+
+        Returns:
+            str: The file path, or None for blob stores without local files.
+        """
+        if not _DIGEST.fullmatch(digest):
+            raise ValueError("Invalid document id")
+        return self.blobs.local_path(digest)
+
+    async def save(self, chunks, base=None, **metadata):
+        """
+        Stores a PDF produced chunk by chunk, e.g. by `pdf_utils.stream_pdf`.
+
+        The chunks are hashed while they are written, so the PDF is never held in memory.
+        If the same PDF is already stored, the new copy is discarded. With `base`, the
+        chunks are an incremental update that follows a stored PDF: only they are
+        written, so the cost does not depend on the size of the base, unless the base
+        is already at the end of `PDF_STORE_MAX_UPDATES` updates and the whole PDF is
+        written instead.
+
+        Args:
+            chunks (AsyncIterable[bytes]): The PDF bytes, or the update's bytes with `base`.
+            base (str, optional): The id of a stored PDF that the chunks follow. Defaults to None.
+            **metadata: JSON-serializable fields stored with a new document, such as the page count.
+
+        Raises:
+            ValueError: If `base` is not a stored PDF.
+
+        Returns:
+            dict: The document's metadata, including its `id`, `size` and `created_at`,
+            and whether it was `deduplicated` against an existing copy. Updates also
+            have their `base`, the `update_size` of their own bytes and their `depth`
+            in the chain of updates.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        extra = {}
+        if base is not None:
+            base_metadata = await self.metadata(base)
+            if base_metadata is None:
+                raise ValueError("Document not found")
+            depth = base_metadata.get("depth", 0) + 1
+            if depth > PDF_STORE_MAX_UPDATES:
+                return await self.save(self._followed_by(base, chunks), **metadata)
+            digest.update(base.encode())
+            size = base_metadata["size"]
+            extra = {"base": base, "depth": depth}
+        writer = await self.blobs.create()
+        update_size = 0
+        try:
+            async for chunk in chunks:
+                await writer.write(chunk)
+                digest.update(chunk)
+                update_size += len(chunk)
+            record = {"id": digest.hexdigest(), "size": size + update_size, "created_at": time.time(), **metadata}
+            if base is not None:
+                record.update(extra, update_size=update_size)
+            created = await writer.commit(record["id"], record)
+        except BaseException:
+            await writer.abort()
+            raise
+        if not created:
+            return {**await self.metadata(record["id"]), "deduplicated": True}
+        return {**record, "deduplicated": False}
+
+    async def _followed_by(self, base, chunks):
+        """
+        Yields the bytes of a stored PDF and then `chunks`.
+        """
+        reader = await self.open(base)
+        if reader is None:
+            raise ValueError("Document not found")
+        try:
+            async for chunk in reader.chunks():
+                yield chunk
+        finally:
+            reader.close()
+        async for chunk in chunks:
+            yield chunk
+
+    async def open(self, digest):
+        """
+        Opens a stored PDF for reading.
+
+        Args:
+            digest (str): The document id.
+
+        Returns:
+            BlobReader: A reader that streams the PDF chunk by chunk and must be closed,
+            or None if the id is invalid or unknown. A PDF stored as an update is read
+            as the whole file its chain starts from followed by each update in turn.
+        """
+        readers = []
+        while digest is not None:
+            metadata = await self.metadata(digest)
+            reader = await self.blobs.open(digest) if metadata is not None else None
+            if reader is None:
+                for opened in readers:
+                    opened.close()
+                return None
+            readers.append(reader)
+            digest = metadata.get("base")
+        if len(readers) == 1:
+            return readers[0]
+        return ConcatenatedReader(readers[::-1])
+
+    async def metadata(self, digest):
+        """
+        Returns the metadata of a stored PDF.
+
+        Args:
+            digest (str): The document id.
+
+        Returns:
+            dict: The stored metadata, or None if the id is invalid or unknown.
+        """
+        if not _DIGEST.fullmatch(digest):
+            return None
+        return await self.blobs.metadata(digest)
+
+pdf_store = PdfStore()
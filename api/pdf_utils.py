@@ -0,0 +1,867 @@
+import asyncio
+import contextvars
+import functools
+import itertools
+import os
+import re
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+from lazy_imports import lazy_import
+from metrics import record_image, stage
+from ocr_utils import ocr_page_words
+
+cv2 = lazy_import("cv2")
+Image = lazy_import("PIL.Image")
+features = lazy_import("PIL.features")
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+_page_pool = None
+
+# A4 in points; pages keep their image's aspect ratio and fit inside it
+A4_SHORT_SIDE = 595.28
+A4_LONG_SIDE = 841.89
+
+# Courier glyphs are all 600/1000 em wide, which makes the horizontal scaling
+# needed to stretch a word over its bounding box exact.
+TEXT_LAYER_FONT = "Courier"
+COURIER_GLYPH_WIDTH = 0.6
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Baseline, extended and progressive Huffman-coded DCT, which PDF readers decode; lossless,
+# hierarchical and arithmetic-coded JPEGs are decoded and re-encoded instead
+JPEG_PASSTHROUGH_MARKERS = {0xC0, 0xC1, 0xC2}
+COLOR_SPACES = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}
+
+def jpeg_image(data):
+    """
+    Describes a JPEG file so it can be embedded as-is as a DCTDecode image.
+
+    Only the marker segments up to the frame header are parsed; the compressed data
+    is never decoded or copied. Only the coding processes of `JPEG_PASSTHROUGH_MARKERS`
+    are accepted, since PDF readers cannot render the others.
+
+    Args:
+        data (bytes): The JPEG file contents.
+
+    Raises:
+        ValueError: If the data is not a JPEG file with a supported frame header.
+
+    Returns:
+        dict: The image dictionary used by `PdfWriter.add_page`.
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
+
+    adobe = False
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Corrupt JPEG marker")
+        marker = data[pos + 1]
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker == 0xEE and data[pos + 4:pos + 9] == b"Adobe":
+            adobe = True
+        if marker in JPEG_SOF_MARKERS:
+            if marker not in JPEG_PASSTHROUGH_MARKERS:
+                raise ValueError("Unsupported JPEG coding process: SOF%d" % (marker - 0xC0))
+            bits, height, width, components = struct.unpack(">BHHB", data[pos + 4:pos + 10])
+            if components not in COLOR_SPACES:
+                raise ValueError("Unsupported number of JPEG components: %d" % components)
+            image = {
+                "width": width,
+                "height": height,
+                "color_space": COLOR_SPACES[components],
+                "bits": bits,
+                "filter": "/DCTDecode",
+                "data": data,
+            }
+            if components == 4 and adobe:
+                # Adobe CMYK JPEGs are stored inverted
+                image["decode"] = "[1 0 1 0 1 0 1 0]"
+            return image
+        pos += 2 + length
+    raise ValueError("JPEG frame header not found")
+
+def png_image(data):
+    """
+    Describes a PNG file so its compressed pixel data can be embedded without decoding.
+
+    PDF's Flate filter understands PNG row predictors, so the concatenated IDAT chunks
+    of a non-interlaced grayscale or RGB PNG are a valid PDF image stream. PNGs with
+    alpha, palettes or interlacing are not supported here.
+
+    Args:
+        data (bytes): The PNG file contents.
+
+    Raises:
+        ValueError: If the PNG cannot be passed through.
+
+    Returns:
+        dict: The image dictionary used by `PdfWriter.add_page`.
+    """
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+
+    width, height, bits, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data[16:29])
+    colors = {0: 1, 2: 3}.get(color_type)
+    if colors is None or interlace or bits == 16 or (colors == 3 and bits != 8):
+        raise ValueError("PNG cannot be passed through")
+
+    idat = []
+    pos = 8
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        if kind == b"IDAT":
+            idat.append(data[pos + 8:pos + 8 + length])
+        elif kind == b"IEND":
+            break
+        pos += 12 + length
+
+    return {
+        "width": width,
+        "height": height,
+        "color_space": COLOR_SPACES[colors],
+        "bits": bits,
+        "filter": "/FlateDecode",
+        "decode_parms": "<< /Predictor 15 /Colors %d /BitsPerComponent %d /Columns %d >>" % (colors, bits, width),
+        "data": b"".join(idat),
+    }
+
+def array_image(array, level=6):
+    """
+    Describes a decoded image as a Flate-compressed PDF image.
+
+    Args:
+        array (np.ndarray): A grayscale, BGR or BGRA uint8 image, as produced by OpenCV.
+        level (int, optional): The zlib compression level. Defaults to 6.
+
+    Returns:
+        dict: The image dictionary used by `PdfWriter.add_page`.
+    """
+    if array.dtype != np.uint8:
+        array = cv2.convertScaleAbs(array, alpha=255.0 / max(np.iinfo(array.dtype).max, 1))
+    if array.ndim == 3 and array.shape[2] == 4:
+        array = cv2.cvtColor(array, cv2.COLOR_BGRA2BGR)
+    if array.ndim == 3 and array.shape[2] == 1:
+        array = array[:, :, 0]
+    if array.ndim == 3:
+        array = cv2.cvtColor(array, cv2.COLOR_BGR2RGB)
+
+    return {
+        "width": array.shape[1],
+        "height": array.shape[0],
+        "color_space": COLOR_SPACES[1 if array.ndim == 2 else 3],
+        "bits": 8,
+        "filter": "/FlateDecode",
+        "data": zlib.compress(np.ascontiguousarray(array), level),
+    }
+
+def load_page_image(contents):
+    """
+    Prepares an uploaded image file for embedding in a PDF page.
+
+    JPEG files and simple PNG files are embedded without re-encoding; anything else is
+    decoded with OpenCV and Flate-compressed.
+
+    Args:
+        contents (bytes): The uploaded file contents.
+
+    Raises:
+        ValueError: If the file is not a readable image.
+
+    Returns:
+        dict: The image dictionary used by `PdfWriter.add_page`.
+    """
+    try:
+        if contents[:2] == b"\xff\xd8":
+            return jpeg_image(contents)
+        if contents[:8] == PNG_SIGNATURE:
+            return png_image(contents)
+    except (ValueError, struct.error):
+        # Truncated headers fail to unpack; OpenCV then reports the file as unreadable
+        pass
+
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Invalid image")
+    return array_image(image)
+
+def is_bilevel(gray, ratio=0.9):
+    """
+    Checks whether a grayscale page is essentially black and white.
+
+    Thresholded scans from `process_image` are slightly blurred, so pixels only need
+    to be close to black or white rather than exactly 0 or 255.
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+        ratio (float, optional): The fraction of near-black or near-white pixels required. Defaults to 0.9.
+
+    Returns:
+        bool: True if the page can be stored with one bit per pixel.
+    """
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    return (hist[:48].sum() + hist[208:].sum()) >= ratio * gray.size
+
+def _ccitt_g4(ink):
+    """
+    Encodes a boolean ink mask as CCITT Group 4 data, or returns None if unavailable.
+
+    Pillow's libtiff writer is used to produce a single-strip Group 4 TIFF, and the
+    strip is extracted as-is. The set (ink) pixels are encoded as black runs.
+    """
+    if not features.check("libtiff"):
+        return None
+    buffer = BytesIO()
+    Image.fromarray(ink).save(buffer, format="TIFF", compression="group4", strip_size=2 ** 30)
+    with Image.open(BytesIO(buffer.getvalue())) as tiff:
+        offsets, counts = tiff.tag_v2.get(273), tiff.tag_v2.get(279)
+    if offsets is None or len(offsets) != 1:
+        return None
+    return buffer.getvalue()[offsets[0]:offsets[0] + counts[0]]
+
+def _one_bit_image(ink, image_mask=False):
+    """
+    Encodes a boolean ink mask as the smaller of CCITT G4 and 1-bit Flate image data.
+
+    In the decoded image, ink pixels are 0 (black, or painted for a stencil mask).
+    """
+    height, width = ink.shape
+    image = {"width": width, "height": height, "bits": 1}
+    if image_mask:
+        image["image_mask"] = True
+    else:
+        image["color_space"] = "/DeviceGray"
+
+    flate = zlib.compress(np.packbits(~ink, axis=1), 9)
+    g4 = _ccitt_g4(ink)
+    if g4 is not None and len(g4) < len(flate):
+        image.update(filter="/CCITTFaxDecode", data=g4,
+                     decode_parms="<< /K -1 /Columns %d /Rows %d >>" % (width, height))
+    else:
+        image.update(filter="/FlateDecode", data=flate)
+    return image
+
+def bilevel_image(gray):
+    """
+    Describes a black-and-white page as a 1-bit image (CCITT G4 or Flate, whichever is smaller).
+
+    Args:
+        gray (np.ndarray): The grayscale page image.
+
+    Returns:
+        dict: The image dictionary used by `PdfWriter.add_page`.
+    """
+    return _one_bit_image(gray < 128)
+
+def mixed_raster_image(image, background_scale=1/3, quality=60):
+    """
+    Describes a page with mixed raster content: a 1-bit text mask over a low-resolution background.
+
+    Text is found with adaptive thresholding and stored at full resolution as a stencil
+    mask painted in the average text colour. The background is downscaled, has the
+    text removed by a morphological closing, and is stored as a low-quality JPEG.
+
+    Args:
+        image (np.ndarray): The page image in BGR or grayscale format.
+        background_scale (float, optional): The background resolution relative to the page. Defaults to 1/3.
+        quality (int, optional): The JPEG quality of the background. Defaults to 60.
+
+    Returns:
+        dict: The background image dictionary with the text layer under its "mask" key.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (3, 3), 0)
+    ink = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 31, 15) > 0
+
+    background = cv2.resize(image, None, fx=background_scale, fy=background_scale, interpolation=cv2.INTER_AREA)
+    background = cv2.morphologyEx(background, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5)))
+    success, encoded = cv2.imencode(".jpg", background, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise ValueError("Failed to encode background")
+
+    page = jpeg_image(encoded.tobytes())
+    page["mask"] = _one_bit_image(ink, image_mask=True)
+    ink_pixels = image[ink]
+    color = ink_pixels.mean(axis=0) / 255.0 if ink_pixels.size else np.zeros(3)
+    color = np.atleast_1d(color)
+    page["mask"]["color"] = tuple(float(c) for c in (np.repeat(color, 3) if color.size == 1 else color[::-1]))
+    return page
+
+def _image_size(image):
+    """
+    Returns the number of bytes an image dictionary adds to the PDF.
+    """
+    return len(image["data"]) + (len(image["mask"]["data"]) if "mask" in image else 0)
+
+def compact_image(image, original):
+    """
+    Re-encodes a decoded page with the compact encodings if that makes it smaller.
+
+    Black-and-white pages become 1-bit images and other pages use mixed raster content.
+
+    Args:
+        image (np.ndarray): The decoded page in BGR format.
+        original (dict): The image dictionary of the page without compact encoding.
+
+    Returns:
+        dict: The smaller of the compact and the original image dictionaries.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    channels_differ = cv2.absdiff(image, cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)).max() > 16
+
+    if not channels_differ and is_bilevel(gray):
+        compact = bilevel_image(gray)
+    else:
+        compact = mixed_raster_image(gray if not channels_differ else image)
+    return compact if _image_size(compact) < _image_size(original) else original
+
+def prepare_page_image(contents, compact=False, max_side=None):
+    """
+    Prepares an uploaded image for a PDF page.
+
+    Without options, the upload is embedded as-is where possible (see `load_page_image`).
+    Pages whose longer side exceeds `max_side` are decoded once, downscaled and
+    re-encoded (as JPEG if the upload was a JPEG). With `compact`, the decoded page is
+    also offered to `compact_image`.
+
+    Args:
+        contents (bytes): The uploaded file contents.
+        compact (bool, optional): Whether to try the compact encodings. Defaults to False.
+        max_side (int, optional): The maximum length of the longer side in pixels. Defaults to None.
+
+    Raises:
+        ValueError: If the file is not a readable image.
+
+    Returns:
+        dict: The image dictionary used by `PdfWriter.add_page`.
+    """
+    if not compact and not max_side:
+        return load_page_image(contents)
+
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Invalid image")
+
+    if max_side and max(image.shape[:2]) > max_side:
+        scale = max_side / max(image.shape[:2])
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if contents[:2] == b"\xff\xd8":
+            original = jpeg_image(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+        else:
+            original = array_image(image)
+    else:
+        original = load_page_image(contents)
+
+    if not compact:
+        return original
+    if image.dtype != np.uint8:
+        image = cv2.convertScaleAbs(image, alpha=255.0 / max(np.iinfo(image.dtype).max, 1))
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    elif image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return compact_image(image, original)
+
+def compact_page_image(contents):
+    """
+    Prepares an uploaded image for a compact PDF; see `prepare_page_image`.
+
+    Args:
+        contents (bytes): The uploaded file contents.
+
+    Raises:
+        ValueError: If the file is not a readable image.
+
+    Returns:
+        dict: The image dictionary used by `PdfWriter.add_page`.
+    """
+    return prepare_page_image(contents, compact=True)
+
+def page_pixel_size(image):
+    """
+    Returns the (width, height) of the pixel grid a page image is drawn on.
+
+    Args:
+        image (dict): An image dictionary accepted by `PdfWriter.add_page`.
+
+    Returns:
+        tuple: The width and height in pixels; a mixed raster page uses its mask's size.
+    """
+    grid = image.get("mask") or image
+    return grid["width"], grid["height"]
+
+def prepare_page(contents, compact=False, max_side=None, searchable=False, lang="eng"):
+    """
+    Prepares one page for `PdfWriter.add_page`: image encoding and, optionally, OCR.
+
+    This is the unit of work that `prepare_pages` runs in the page worker pool.
+
+    Args:
+        contents (bytes): The uploaded file contents.
+        compact (bool, optional): Whether to try the compact encodings. Defaults to False.
+        max_side (int, optional): The maximum length of the longer side in pixels. Defaults to None.
+        searchable (bool, optional): Whether to recognize the page's words. Defaults to False.
+        lang (str, optional): The Tesseract language code. Defaults to "eng".
+
+    Raises:
+        ValueError: If the file is not a readable image.
+
+    Returns:
+        tuple: The image dictionary and the OCR words in page pixels, or None.
+    """
+    with stage("page_image"):
+        image = prepare_page_image(contents, compact=compact, max_side=max_side)
+    record_image(*page_pixel_size(image))
+    if not searchable:
+        return image, None
+
+    with stage("page_ocr"):
+        # The page image is embedded as stored, so OCR must not apply the EXIF orientation either
+        gray = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION)
+        words = ocr_page_words(gray, lang=lang)
+    scale = page_pixel_size(image)[0] / gray.shape[1]
+    if scale != 1.0:
+        words = [(text, tuple(v * scale for v in bbox)) for text, bbox in words]
+    return image, words
+
+def page_pool():
+    """
+    Returns the shared thread pool that prepares PDF pages, creating it on first use.
+
+    Decoding, colour conversion, resizing and compression in OpenCV, zlib and Pillow
+    release the GIL, and Tesseract runs in a subprocess, so threads scale with cores.
+    """
+    global _page_pool
+    if _page_pool is None:
+        _page_pool = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf-page")
+    return _page_pool
+
+async def prepare_pages(files, workers=None, **options):
+    """
+    Prepares uploaded pages in parallel and yields them in their original order.
+
+    At most `workers` pages are read and prepared ahead of the consumer, which bounds
+    memory use while keeping the worker pool busy. Only the ordered hand-off to the
+    consumer is serial.
+
+    Args:
+        files (list): Objects with an async `read()` method and a `filename`, such as `UploadFile`.
+        workers (int, optional): The number of pages prepared concurrently, capped at `PDF_WORKERS`. Defaults to `PDF_WORKERS`.
+        **options: Keyword arguments passed on to `prepare_page`.
+
+    Raises:
+        ValueError: If a file is not a readable image; the message names the file.
+
+    Yields:
+        tuple: (image, words) pairs for `PdfWriter.add_page`.
+    """
+    loop = asyncio.get_running_loop()
+    pool = page_pool()
+
+    async def prepare(file):
+        contents = await file.read()
+        try:
+            # In the request's context, so that the page's stage timings reach its metrics
+            return await loop.run_in_executor(pool, contextvars.copy_context().run,
+                                              functools.partial(prepare_page, contents, **options))
+        except ValueError as e:
+            raise ValueError(f"{file.filename}: {str(e)}")
+
+    window = max(1, min(workers or PDF_WORKERS, PDF_WORKERS))
+    pending = deque(asyncio.ensure_future(prepare(file)) for file in files[:window])
+    remaining = iter(files[window:])
+    try:
+        while pending:
+            page = await pending.popleft()
+            for file in itertools.islice(remaining, 1):
+                pending.append(asyncio.ensure_future(prepare(file)))
+            yield page
+    finally:
+        for task in pending:
+            task.cancel()
+
+def fit_page_size(width, height):
+    """
+    Computes a page size with the image's aspect ratio that fits on an A4 sheet.
+
+    Args:
+        width (int): The image width in pixels.
+        height (int): The image height in pixels.
+
+    Returns:
+        tuple: The page width and height in points.
+    """
+    box_w, box_h = (A4_SHORT_SIDE, A4_LONG_SIDE) if height >= width else (A4_LONG_SIDE, A4_SHORT_SIDE)
+    scale = min(box_w / width, box_h / height)
+    return width * scale, height * scale
+
+def _pdf_string(text):
+    """
+    Encodes text as a PDF literal string in WinAnsiEncoding.
+    """
+    data = text.encode("cp1252", "replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+def text_layer(words, scale, page_height):
+    """
+    Builds content stream operators that draw OCR words as invisible, selectable text.
+
+    The words use text rendering mode 3 (neither fill nor stroke), so they can be
+    searched and copied without changing how the page looks. Each word is sized to
+    the height of its bounding box and horizontally scaled to its width.
+
+    Args:
+        words (list): (text, (x0, y0, x1, y1)) tuples in image pixel coordinates.
+        scale (float): Points per image pixel.
+        page_height (float): The page height in points.
+
+    Returns:
+        bytes: The content stream operators, empty if there are no words.
+    """
+    ops = []
+    for text, (x0, y0, x1, y1) in words:
+        font_size = max((y1 - y0) * scale, 1.0)
+        natural_width = len(text) * COURIER_GLYPH_WIDTH * font_size
+        ops.append(b"BT 3 Tr /F1 %.2f Tf %.2f Tz 1 0 0 1 %.2f %.2f Tm %s Tj ET" % (
+            font_size, 100 * (x1 - x0) * scale / natural_width, x0 * scale, page_height - y1 * scale, _pdf_string(text)))
+    return b"\n".join(ops)
+
+class PdfWriter:
+    """
+    Writes an image-per-page PDF sequentially through a `write` callable.
+
+    Every object is written once, as soon as it is complete, and only the byte offsets
+    needed for the cross-reference table are kept. The catalog (object 1), the page
+    tree (object 2) and the text-layer font (object 3) are written by `close`.
+
+    Attributes:
+        write (callable): Receives each chunk of the PDF file in order.
+        offset (int): The number of bytes written so far.
+        page_ids (list): The object numbers of the pages written so far.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    FONT_ID = 3
+
+    def __init__(self, write):
+        self.write = write
+        self.offset = 0
+        self.page_ids = []
+        self._offsets = {}
+        self._next_id = 4
+        self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _emit(self, data):
+        self.write(data)
+        self.offset += len(data)
+
+    def _object(self, obj_id, body, stream=None):
+        """
+        Writes one indirect object, with an optional stream after its dictionary.
+        """
+        self._offsets[obj_id] = self.offset
+        if stream is None:
+            self._emit(b"%d 0 obj\n%s\nendobj\n" % (obj_id, body))
+        else:
+            self._emit(b"%d 0 obj\n%s\nstream\n" % (obj_id, body))
+            self._emit(stream)
+            self._emit(b"\nendstream\nendobj\n")
+
+    def _allocate(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _image_object(self, image):
+        """
+        Writes an image XObject and returns its object number.
+        """
+        obj_id = self._allocate()
+        header = b"<< /Type /XObject /Subtype /Image /Width %d /Height %d" % (image["width"], image["height"])
+        if image.get("image_mask"):
+            header += b" /ImageMask true"
+        else:
+            header += b" /ColorSpace " + image["color_space"].encode()
+        header += b" /BitsPerComponent %d /Filter %s" % (image["bits"], image["filter"].encode())
+        if "decode_parms" in image:
+            header += b" /DecodeParms " + image["decode_parms"].encode()
+        if "decode" in image:
+            header += b" /Decode " + image["decode"].encode()
+        header += b" /Length %d >>" % len(image["data"])
+        self._object(obj_id, header, image["data"])
+        return obj_id
+
+    def add_page(self, image, words=None):
+        """
+        Writes a page showing one image scaled to the page, with an optional text layer.
+
+        If the image dictionary has a "mask" entry (see `mixed_raster_image`), the mask
+        is painted over the image in its foreground colour, and the mask's resolution
+        defines the page's pixel grid.
+
+        Args:
+            image (dict): An image dictionary from `load_page_image`, `jpeg_image`, `png_image`,
+                `array_image`, `bilevel_image` or `mixed_raster_image`.
+            words (list, optional): OCR words as (text, (x0, y0, x1, y1)) tuples in image pixels.
+        """
+        mask = image.get("mask")
+        width, height = (mask or image)["width"], (mask or image)["height"]
+        page_w, page_h = fit_page_size(width, height)
+
+        xobjects = [self._image_object(image)]
+        content = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (page_w, page_h)
+        if mask:
+            xobjects.append(self._image_object(mask))
+            content += b"\nq %.3f %.3f %.3f rg %.2f 0 0 %.2f 0 0 cm /Im1 Do Q" % (mask["color"] + (page_w, page_h))
+        if words:
+            content += b"\n" + text_layer(words, page_w / width, page_h)
+
+        content_id, page_id = self._allocate(), self._allocate()
+        content = zlib.compress(content)
+        self._object(content_id, b"<< /Filter /FlateDecode /Length %d >>" % len(content), content)
+
+        resources = b" ".join(b"/Im%d %d 0 R" % (i, obj_id) for i, obj_id in enumerate(xobjects))
+        self._object(page_id, (
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] "
+            b"/Resources << /XObject << %s >> /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>") % (
+            self.PAGES_ID, page_w, page_h, resources, self.FONT_ID, content_id))
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """
+        Writes the page tree, catalog, font, cross-reference table and trailer.
+        """
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.page_ids)
+        self._object(self.PAGES_ID, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)))
+        self._object(self.CATALOG_ID, b"<< /Type /Catalog /Pages %d 0 R >>" % self.PAGES_ID)
+        self._object(self.FONT_ID, b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % (
+            TEXT_LAYER_FONT.encode()))
+
+        xref_offset = self.offset
+        entries = [b"0000000000 65535 f \n"]
+        entries += [b"%010d 00000 n \n" % self._offsets[obj_id] for obj_id in range(1, self._next_id)]
+        self._emit(b"xref\n0 %d\n%s" % (self._next_id, b"".join(entries)))
+        self._emit(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+            self._next_id, self.CATALOG_ID, xref_offset))
+
+def _read_object(f, offset):
+    """
+    Reads the body of the indirect object starting at `offset`, up to `endobj`.
+    """
+    f.seek(offset)
+    data = b""
+    while b"endobj" not in data:
+        chunk = f.read(4096)
+        if not chunk:
+            raise ValueError("Truncated PDF object")
+        data += chunk
+    return data[:data.index(b"endobj")]
+
+def read_pdf_structure(f):
+    """
+    Reads what an incremental update needs to know about a PDF written by `PdfWriter`.
+
+    Only the trailers, cross-reference sections, catalog and page tree are read, so the
+    cost does not depend on the size of the page images. Earlier incremental updates
+    are followed through their `/Prev` links.
+
+    Args:
+        f (BinaryIO): The PDF file, opened for reading in binary mode.
+
+    Raises:
+        ValueError: If the file is not a PDF with classic cross-reference tables.
+
+    Returns:
+        dict: The file `length`, the trailer's `size` and `root`, the `startxref` offset,
+        the current object `offsets`, the page tree's object number (`pages_id`) and the
+        page object numbers (`page_ids`).
+    """
+    f.seek(0, os.SEEK_END)
+    length = f.tell()
+    f.seek(max(0, length - 1024))
+    found = re.findall(rb"startxref\s+(\d+)\s+%%EOF", f.read())
+    if not found:
+        raise ValueError("Not a PDF file")
+
+    offsets = {}
+    structure = {"length": length, "startxref": int(found[-1]), "offsets": offsets}
+    xref = structure["startxref"]
+    while xref is not None:
+        f.seek(xref)
+        if f.readline().strip() != b"xref":
+            raise ValueError("Unsupported cross-reference section")
+        line = f.readline().strip()
+        while not line.startswith(b"trailer"):
+            start, count = map(int, line.split())
+            for obj_id in range(start, start + count):
+                entry = f.read(20)
+                if entry[17:18] == b"n":
+                    offsets.setdefault(obj_id, int(entry[:10]))
+            line = f.readline().strip()
+        trailer = line + f.read(256)
+        if "size" not in structure:
+            structure["size"] = int(re.search(rb"/Size (\d+)", trailer).group(1))
+            structure["root"] = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+        prev = re.search(rb"/Prev (\d+)", trailer[:trailer.index(b">>")])
+        xref = int(prev.group(1)) if prev else None
+
+    try:
+        catalog = _read_object(f, offsets[structure["root"]])
+        structure["pages_id"] = int(re.search(rb"/Pages (\d+) 0 R", catalog).group(1))
+        pages = _read_object(f, offsets[structure["pages_id"]])
+        kids = re.search(rb"/Kids \[([^\]]*)\]", pages).group(1)
+    except (KeyError, AttributeError):
+        raise ValueError("Unsupported page tree")
+    structure["page_ids"] = [int(obj_id) for obj_id in re.findall(rb"(\d+) 0 R", kids)]
+    return structure
+
+def _read_stream(f, offset):
+    """
+    Reads the dictionary and the raw stream data of the indirect object at `offset`.
+    """
+    f.seek(offset)
+    head = b""
+    while b"stream" not in head:
+        chunk = f.read(4096)
+        if not chunk:
+            raise ValueError("Truncated PDF stream")
+        head += chunk
+    dictionary = head[:head.index(b"stream")]
+    f.seek(offset + head.index(b"stream") + len(b"stream\n"))
+    return dictionary, f.read(int(re.search(rb"/Length (\d+)", dictionary).group(1)))
+
+def read_page_image(f, structure, index=0):
+    """
+    Reads back the image dictionary of a page written by `PdfWriter`.
+
+    This is the inverse of `PdfWriter.add_page` for the page's pixels: the image data
+    is returned still encoded, so callers decide how much of it to decode.
+
+    Args:
+        f (BinaryIO): The PDF file, opened for reading in binary mode.
+        structure (dict): The PDF as returned by `read_pdf_structure`.
+        index (int, optional): The 0-based page index. Defaults to 0.
+
+    Raises:
+        ValueError: If the page does not hold an image written by `PdfWriter`.
+
+    Returns:
+        dict: The image dictionary, with a mixed raster page's stencil mask and its
+        colour under the "mask" key.
+    """
+    offsets = structure["offsets"]
+    page = _read_object(f, offsets[structure["page_ids"][index]])
+    xobjects = dict(re.findall(rb"/(Im\d) (\d+) 0 R", page))
+    if b"Im0" not in xobjects:
+        raise ValueError("Page has no image")
+
+    def image(obj_id):
+        dictionary, data = _read_stream(f, offsets[int(obj_id)])
+        fields = {"data": data}
+        for key, name, pattern in (("width", b"Width", rb"(\d+)"), ("height", b"Height", rb"(\d+)"),
+                                   ("bits", b"BitsPerComponent", rb"(\d+)"), ("filter", b"Filter", rb"(/\w+)"),
+                                   ("color_space", b"ColorSpace", rb"(/\w+)"),
+                                   ("decode_parms", b"DecodeParms", rb"(<<[^>]*>>)")):
+            match = re.search(rb"/" + name + rb" " + pattern, dictionary)
+            if match:
+                fields[key] = int(match.group(1)) if pattern == rb"(\d+)" else match.group(1).decode()
+        if b"/ImageMask true" in dictionary:
+            fields["image_mask"] = True
+        return fields
+
+    result = image(xobjects[b"Im0"])
+    if b"Im1" in xobjects:
+        result["mask"] = image(xobjects[b"Im1"])
+        _, content = _read_stream(f, offsets[int(re.search(rb"/Contents (\d+) 0 R", page).group(1))])
+        color = re.search(rb"([\d.]+) ([\d.]+) ([\d.]+) rg", zlib.decompress(content))
+        result["mask"]["color"] = tuple(float(c) for c in color.groups()) if color else (0.0, 0.0, 0.0)
+    return result
+
+class PdfUpdater(PdfWriter):
+    """
+    Adds pages to an existing PDF with an incremental update.
+
+    The new page objects, a new version of the page tree and a cross-reference
+    section for just those objects are appended after the existing bytes, which are
+    never rewritten. The cost of adding pages is therefore independent of the size of
+    the document. The existing PDF must have been written by `PdfWriter`, whose
+    text-layer font the new pages share.
+
+    Attributes:
+        structure (dict): The existing PDF as returned by `read_pdf_structure`.
+        at (int): The index at which the new pages are inserted; None appends them.
+    """
+
+    def __init__(self, write, structure, at=None):
+        self.write = write
+        self.offset = structure["length"]
+        self.page_ids = []
+        self.structure = structure
+        self.at = at
+        self.PAGES_ID = structure["pages_id"]
+        self._offsets = {}
+        self._next_id = structure["size"]
+
+    def close(self):
+        """
+        Writes the updated page tree, the cross-reference section and the trailer.
+        """
+        page_ids = list(self.structure["page_ids"])
+        at = len(page_ids) if self.at is None else self.at
+        page_ids[at:at] = self.page_ids
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+        self._object(self.PAGES_ID, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids)))
+
+        xref_offset = self.offset
+        # Repeating the free-list head keeps readers that expect subsection 0 first happy
+        sections = [b"0 1\n0000000000 65535 f \n",
+                    b"%d 1\n%010d 00000 n \n" % (self.PAGES_ID, self._offsets[self.PAGES_ID])]
+        new_ids = range(self.structure["size"], self._next_id)
+        if new_ids:
+            sections.append(b"%d %d\n" % (new_ids.start, len(new_ids)))
+            sections += [b"%010d 00000 n \n" % self._offsets[obj_id] for obj_id in new_ids]
+        self._emit(b"xref\n%s" % b"".join(sections))
+        self._emit(b"trailer\n<< /Size %d /Root %d 0 R /Prev %d >>\nstartxref\n%d\n%%%%EOF\n" % (
+            self._next_id, self.structure["root"], self.structure["startxref"], xref_offset))
+
+async def stream_pdf(pages, make_writer=PdfWriter):
+    """
+    Writes a PDF page by page and yields its bytes as soon as each page is written.
+
+    Only the current page's data is held at any time, so peak memory does not grow
+    with the number of pages, and the header is sent before the first page is ready.
+
+    Args:
+        pages (AsyncIterable): Yields (image, words) pairs as accepted by `PdfWriter.add_page`.
+        make_writer (callable, optional): Creates the writer from a `write` callable, e.g. a
+            `functools.partial` of `PdfUpdater`. Defaults to `PdfWriter`.
+
+    Yields:
+        bytes: Consecutive chunks of the PDF file.
+    """
+    chunks = []
+    writer = make_writer(chunks.append)
+    yield b"".join(chunks)
+    chunks.clear()
+
+    async for image, words in pages:
+        with stage("pdf_write"):
+            writer.add_page(image, words)
+        for chunk in chunks:
+            yield chunk
+        chunks.clear()
+
+    writer.close()
+    yield b"".join(chunks)
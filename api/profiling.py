@@ -0,0 +1,267 @@
+import cProfile
+import collections
+import fcntl
+import hmac
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+
+# Requests are only profiled when they carry this secret; unset, profiling is off
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_PATH = os.getenv("PROFILING_PATH", "profiles")
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", 50))
+# At most one profile per interval across all workers sharing `PROFILING_PATH`
+PROFILING_MIN_INTERVAL = float(os.getenv("PROFILING_MIN_INTERVAL", 60))
+PROFILING_SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", 0.005))
+
+PROFILE_MODES = {"sample": ".collapsed", "cprofile": ".pstats"}
+
+_PROFILE_NAME = re.compile(r"\d{8}-\d{6}-[0-9a-f]{8}-[a-z0-9_-]{0,64}\.(collapsed|pstats)")
+
+def check_token(token):
+    """
+    Checks a profiling token against `PROFILING_TOKEN` in constant time.
+
+    Returns:
+        bool: True if profiling is enabled and the token matches.
+    """
+    return bool(PROFILING_TOKEN) and token is not None and hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+class StackSampler:
+    """
+    A sampling profiler that records the Python stacks of every thread of the process.
+
+    A background thread takes a sample every `interval` seconds, so work done for a
+    request in thread pools, such as image decoding and OCR, is included, as is work
+    for concurrent requests. The overhead is one stack walk per thread and sample,
+    independent of how many calls the profiled code makes.
+
+    Attributes:
+        interval (float): The time between samples in seconds.
+        samples (int): The number of samples taken.
+    """
+
+    def __init__(self, interval=PROFILING_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread-%d" % ident))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """
+        Returns the samples in the collapsed stack format of flamegraph.pl, inferno and speedscope.
+
+        Returns:
+            str: One `thread;outer;...;inner count` line per distinct stack.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self._stacks.items()))
+
+class ProfileStore:
+    """
+    A directory of request profiles that keeps only the newest `max_files`.
+
+    Profiles are named after their time, a random id and the request path, and the
+    oldest are removed whenever a new one is written.
+
+    Attributes:
+        root (str): The profile directory.
+        max_files (int): The number of profiles kept.
+        min_interval (float): The minimum time between two profiles in seconds.
+    """
+
+    def __init__(self, root=PROFILING_PATH, max_files=PROFILING_MAX_FILES, min_interval=PROFILING_MIN_INTERVAL):
+        self.root = root
+        self.max_files = max_files
+        self.min_interval = min_interval
+
+    def acquire(self):
+        """
+        Takes the global profiling slot if the last profile is at least `min_interval` old.
+
+        The time of the last profile is kept in a file under an exclusive lock, so the
+        limit holds across all workers sharing the directory.
+
+        Returns:
+            bool: True if a profile may be taken now.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".last-profile"), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                last = float(f.read() or 0)
+            except ValueError:
+                last = 0.0
+            now = time.time()
+            if now - last < self.min_interval:
+                return False
+            f.seek(0)
+            f.truncate()
+            f.write(repr(now))
+            return True
+
+    def new_name(self, path, mode):
+        """
+        Returns the file name of a new profile of a request to `path`.
+        """
+        label = re.sub(r"[^a-z0-9_-]+", "-", path.lower()).strip("-")[:64]
+        return "%s-%s-%s%s" % (time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:8], label, PROFILE_MODES[mode])
+
+    def path(self, name):
+        """
+        Returns the location of a profile.
+
+        Raises:
+            ValueError: If `name` is not a profile file name.
+        """
+        if not _PROFILE_NAME.fullmatch(name):
+            raise ValueError("Invalid profile name")
+        return os.path.join(self.root, name)
+
+    def write(self, name, write):
+        """
+        Writes a profile and removes the oldest ones beyond `max_files`.
+
+        Args:
+            name (str): The name from `new_name`.
+            write (callable): Called with the path of a temporary file to write the profile to.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=self.root)
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, self.path(name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        for old in self.list()[self.max_files:]:
+            try:
+                os.unlink(self.path(old["name"]))
+            except FileNotFoundError:
+                pass
+
+    def list(self):
+        """
+        Lists the stored profiles, newest first.
+
+        Returns:
+            list: Dicts with each profile's `name`, `size` and `created_at`.
+        """
+        try:
+            entries = [entry for entry in os.scandir(self.root) if _PROFILE_NAME.fullmatch(entry.name)]
+        except FileNotFoundError:
+            return []
+        profiles = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            profiles.append({"name": entry.name, "size": stat.st_size, "created_at": stat.st_mtime})
+        return sorted(profiles, key=lambda profile: (profile["created_at"], profile["name"]), reverse=True)
+
+profile_store = ProfileStore()
+
+def _write_text(text):
+    def write(path):
+        with open(path, "w") as f:
+            f.write(text)
+    return write
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles single requests on demand.
+
+    A request is profiled when its `X-Profile-Token` header, or `profile_token` query
+    parameter, matches `PROFILING_TOKEN` and no profile was taken in the last
+    `PROFILING_MIN_INTERVAL` seconds. `X-Profile-Mode` (or `profile_mode`) selects
+    "sample", the default, which writes collapsed stacks for flame graphs, or
+    "cprofile", which writes deterministic `pstats` data of the event loop thread.
+    The response carries the profile's name in `X-Profile-Id`, or `X-Profile-Status:
+    rate-limited`. Profiles are listed and downloaded through `/profiles`. The rate
+    limit's file lock and the profile writes run in the threadpool, so they do not
+    hold up the other requests of the worker.
+    """
+
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store or profile_store
+
+    def _options(self, scope):
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        query = dict(urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        return (headers.get("x-profile-token", query.get("profile_token")),
+                headers.get("x-profile-mode", query.get("profile_mode", "sample")))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILING_TOKEN:
+            return await self.app(scope, receive, send)
+        token, mode = self._options(scope)
+        if not check_token(token) or mode not in PROFILE_MODES:
+            return await self.app(scope, receive, send)
+
+        if not await run_in_threadpool(self.store.acquire):
+            async def send_rate_limited(message):
+                if message["type"] == "http.response.start":
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-status", b"rate-limited")]}
+                await send(message)
+            return await self.app(scope, receive, send_rate_limited)
+
+        name = self.store.new_name(scope["path"], mode)
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", name.encode("latin-1"))]}
+            await send(message)
+
+        if mode == "sample":
+            profiler = StackSampler()
+            profiler.start()
+            try:
+                await self.app(scope, receive, send_with_profile)
+            finally:
+                def finish():
+                    profiler.stop()
+                    self.store.write(name, _write_text(profiler.collapsed()))
+                await run_in_threadpool(finish)
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_profile)
+            finally:
+                profiler.disable()
+                await run_in_threadpool(self.store.write, name, profiler.dump_stats)
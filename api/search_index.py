@@ -0,0 +1,151 @@
+import os
+import re
+import sqlite3
+import threading
+
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search_index.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (user_id, document_id, page)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+    user_id, text,
+    content='pages', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS pages_ai AFTER INSERT ON pages BEGIN
+    INSERT INTO pages_fts (rowid, user_id, text) VALUES (new.id, new.user_id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS pages_ad AFTER DELETE ON pages BEGIN
+    INSERT INTO pages_fts (pages_fts, rowid, user_id, text) VALUES ('delete', old.id, old.user_id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS pages_au AFTER UPDATE ON pages BEGIN
+    INSERT INTO pages_fts (pages_fts, rowid, user_id, text) VALUES ('delete', old.id, old.user_id, old.text);
+    INSERT INTO pages_fts (rowid, user_id, text) VALUES (new.id, new.user_id, new.text);
+END;
+"""
+
+def build_match_query(user_id, query):
+    """
+    Converts a user search query into an FTS5 MATCH expression restricted to one user.
+
+    Every word of the query must match. A word ending in `*` matches as a prefix, so
+    "inv*" finds "invoice" and "inventory". Any other FTS5 syntax is neutralized by
+    quoting each word.
+
+    Args:
+        user_id (str): The owner of the documents to search.
+        query (str): The raw search query.
+
+    Returns:
+        str: The MATCH expression, or None if the query contains no searchable words.
+    """
+    terms = []
+    for word, star in re.findall(r"(\w+)(\*?)", query):
+        terms.append('"%s"%s' % (word, star))
+    if not terms:
+        return None
+    return 'user_id : "%s" AND text : (%s)' % (user_id.replace('"', '""'), " AND ".join(terms))
+
+class SearchIndex:
+    """
+    A per-user full-text index of OCR'd pages backed by SQLite FTS5.
+
+    Page text is stored in a regular table and mirrored into an FTS5 inverted index by
+    triggers. The owner's id is indexed as its own column, so a search intersects the
+    owner's postings with the query terms instead of filtering every user's matches.
+    Results are ranked with BM25.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+    """
+
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        """
+        Returns this thread's connection, creating the database on first use.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def index_page(self, user_id, document_id, page, text):
+        """
+        Adds or replaces the text of one page of a user's document.
+
+        Args:
+            user_id (str): The owner of the document.
+            document_id (str): The identifier of the document.
+            page (int): The page number within the document.
+            text (str): The OCR text of the page.
+        """
+        self._connect().execute(
+            "INSERT INTO pages (user_id, document_id, page, text) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (user_id, document_id, page) DO UPDATE SET text = excluded.text",
+            (user_id, document_id, page, text))
+
+    def delete_document(self, user_id, document_id):
+        """
+        Removes every page of a user's document from the index.
+
+        Args:
+            user_id (str): The owner of the document.
+            document_id (str): The identifier of the document.
+
+        Returns:
+            int: The number of pages removed.
+        """
+        cursor = self._connect().execute(
+            "DELETE FROM pages WHERE user_id = ? AND document_id = ?", (user_id, document_id))
+        return cursor.rowcount
+
+    def search(self, user_id, query, limit=20, offset=0):
+        """
+        Searches a user's pages and returns one page of ranked results.
+
+        Args:
+            user_id (str): The owner of the documents to search.
+            query (str): The search query; words ending in `*` match as prefixes.
+            limit (int, optional): The maximum number of results. Defaults to 20.
+            offset (int, optional): The number of results to skip. Defaults to 0.
+
+        Returns:
+            dict: The total number of matching pages and the requested results, each
+            with the document id, page number, relevance score and a highlighted snippet.
+        """
+        match = build_match_query(user_id, query)
+        if match is None:
+            return {"total": 0, "results": []}
+
+        conn = self._connect()
+        total = conn.execute("SELECT COUNT(*) FROM pages_fts WHERE pages_fts MATCH ?", (match,)).fetchone()[0]
+        rows = conn.execute(
+            "SELECT pages.document_id, pages.page, bm25(pages_fts, 0.0, 1.0) AS rank, "
+            "snippet(pages_fts, 1, '[', ']', '...', 12) "
+            "FROM pages_fts JOIN pages ON pages.id = pages_fts.rowid "
+            "WHERE pages_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+            (match, limit, offset)).fetchall()
+        return {
+            "total": total,
+            "results": [
+                {"document_id": document_id, "page": page, "score": -rank, "snippet": snippet}
+                for document_id, page, rank, snippet in rows
+            ],
+        }
+
+search_index = SearchIndex()
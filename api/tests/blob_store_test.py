@@ -0,0 +1,108 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from blob_store import LocalBlobStore, byte_range, check_name
+
+
+class TestLocalBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = LocalBlobStore(self.tmpdir, ".bin", chunk_size=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, *parts, **metadata):
+        async def write():
+            writer = await self.store.create()
+            for part in parts:
+                await writer.write(part)
+            return await writer.commit(name, metadata)
+        return asyncio.run(write())
+
+    def read(self, name, start=0, end=None):
+        async def read():
+            reader = await self.store.open(name)
+            try:
+                return [chunk async for chunk in reader.chunks(start, end)]
+            finally:
+                reader.close()
+        return asyncio.run(read())
+
+    def test_blobs_are_streamed_in_chunks(self):
+        self.assertTrue(self.write("abc", b"0123", b"456789", size=10))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, "ab", "abc.bin")))
+        self.assertEqual(self.read("abc"), [b"0123", b"4567", b"89"])
+        self.assertEqual(self.read("abc", 3, 8), [b"3456", b"78"])
+        self.assertEqual(asyncio.run(self.store.metadata("abc")), {"size": 10})
+
+    def test_existing_blobs_are_kept(self):
+        self.assertTrue(self.write("abc", b"first", version=1))
+        self.assertFalse(self.write("abc", b"second", version=2))
+        self.assertEqual(b"".join(self.read("abc")), b"first")
+        self.assertEqual(asyncio.run(self.store.metadata("abc")), {"version": 1})
+        self.assertEqual([name for name in os.listdir(self.tmpdir) if name.startswith(".tmp-")], [])
+
+    def test_aborted_writes_leave_nothing(self):
+        async def abort():
+            writer = await self.store.create()
+            await writer.write(b"partial")
+            await writer.abort()
+        asyncio.run(abort())
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        self.assertIsNone(asyncio.run(self.store.open("abc")))
+        self.assertIsNone(asyncio.run(self.store.metadata("abc")))
+
+    def test_file_operations_run_in_worker_threads(self):
+        threads = []
+
+        def in_thread(method):
+            def call(*args):
+                threads.append(threading.current_thread())
+                return method(*args)
+            return call
+
+        async def write_and_read():
+            writer = await self.store.create()
+            writer.file = mock.Mock(wraps=writer.file, write=in_thread(writer.file.write))
+            await writer.write(b"0123456789")
+            await writer.commit("abc", {})
+            reader = await self.store.open("abc")
+            reader.file = mock.Mock(wraps=reader.file, read=in_thread(reader.file.read))
+            try:
+                return await reader.read(4)
+            finally:
+                reader.close()
+
+        self.assertEqual(asyncio.run(write_and_read()), b"0123")
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    def test_names_are_validated(self):
+        self.assertEqual(check_name("ab_12-x"), "ab_12-x")
+        for name in ("../etc", "a/b", "", "a.b"):
+            with self.assertRaises(ValueError):
+                self.store.path(name)
+
+
+class TestByteRange(unittest.TestCase):
+
+    def test_byte_range(self):
+        self.assertEqual(byte_range("bytes=0-499", 1000), (0, 499))
+        self.assertEqual(byte_range("bytes=500-", 1000), (500, 999))
+        self.assertEqual(byte_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(byte_range("bytes=900-5000", 1000), (900, 999))
+        self.assertIsNone(byte_range(None, 1000))
+        self.assertIsNone(byte_range("bytes=0-1,5-6", 1000))
+        self.assertIsNone(byte_range("items=0-1", 1000))
+        with self.assertRaises(ValueError):
+            byte_range("bytes=1000-", 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
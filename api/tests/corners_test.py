@@ -0,0 +1,74 @@
+import itertools
+import unittest
+import numpy as np
+import corners
+from helpers import clockwise_order
+from utils import reorder
+from v1.endpoints.users import order_points
+
+
+def rotated_page(angle, width=300, height=400, center=(500, 500)):
+    theta = np.radians(angle)
+    rotation = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    page = np.array([[-width, -height], [width, -height], [width, height], [-width, height]]) / 2
+    return np.round(page @ rotation.T + center)
+
+
+class TestCorners(unittest.TestCase):
+
+    def test_every_input_order_gives_the_same_outline(self):
+        page = rotated_page(20)
+        quads = np.array([page[list(p)] for p in itertools.permutations(range(4))])
+        ordered, convex = corners.clockwise_order(quads)
+        self.assertTrue(convex.all())
+        start = np.argmin(np.hypot(page[:, 0], page[:, 1]))
+        np.testing.assert_array_equal(ordered, np.broadcast_to(np.roll(page, -start, axis=0), quads.shape))
+
+    def test_order_points(self):
+        square = np.array([[10, 10], [90, 12], [88, 95], [8, 90]], np.float32)
+        quads = np.array([square[[2, 0, 3, 1]], square[[3, 2, 1, 0]]])
+        result = corners.order_points(quads)
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_array_equal(result, [square, square])
+        np.testing.assert_array_equal(order_points(square[[1, 3, 0, 2]]), square)
+
+    def test_order_points_stays_clockwise_for_rotated_pages(self):
+        # The previous implementation returned 351,674 623,350 509,275 478,715 here, which crosses itself
+        quad = np.array([[478, 715], [351, 674], [623, 350], [509, 275]], np.float32)
+        ordered = order_points(quad)
+        np.testing.assert_array_equal(ordered, [[351, 674], [509, 275], [623, 350], [478, 715]])
+        self.assertTrue(corners.is_convex(ordered[np.newaxis])[0])
+
+    def test_reorder(self):
+        page = np.array([[[12.7, 10.2]], [[8.1, 90.9]], [[88.0, 95.0]], [[90.0, 12.0]]])
+        result = corners.reorder(page[np.newaxis])
+        self.assertEqual((result.dtype, result.shape), (np.int32, (1, 4, 1, 2)))
+        np.testing.assert_array_equal(result[0, :, 0], [[12, 10], [90, 12], [8, 90], [88, 95]])
+        np.testing.assert_array_equal(reorder(page), result[0])
+
+    def test_degenerate_quads(self):
+        quads = np.array([[[0, 0], [5, 5], [0, 0], [10, 0]],  # A repeated corner
+                          [[0, 0], [10, 0], [5, 0], [20, 0]],  # Collinear
+                          [[0, 0], [10, 0], [3, 2], [0, 10]]])  # Concave
+        ordered, convex = corners.clockwise_order(quads)
+        self.assertEqual(convex.tolist(), [False, False, False])
+        for quad, result in zip(quads, ordered):
+            self.assertEqual(sorted(map(tuple, quad)), sorted(map(tuple, result)))
+        np.testing.assert_array_equal(corners.clockwise_order(quads)[0], ordered)
+        self.assertEqual(clockwise_order(quads[2].tolist()), [])
+        # Each corner is used once, where sums and differences alone pick (10, 0) twice for the concave quad
+        for quad, result in zip(quads, corners.reorder(quads)):
+            self.assertEqual(sorted(map(tuple, quad)), sorted(map(tuple, result[:, 0])))
+
+    def test_shapes(self):
+        self.assertEqual(corners.order_points(np.zeros((0, 4, 2))).shape, (0, 4, 2))
+        contours = rotated_page(10).reshape(1, 4, 1, 2).astype(np.int32)
+        np.testing.assert_array_equal(corners.order_points(contours), corners.order_points(contours[:, :, 0]))
+        with self.assertRaises(ValueError):
+            corners.order_points(np.zeros((2, 3, 2)))
+        with self.assertRaises(ValueError):
+            corners.reorder(np.zeros((4, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
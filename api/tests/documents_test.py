@@ -0,0 +1,48 @@
+import datetime
+import unittest
+from bson import ObjectId
+from v1.endpoints.documents import encode_cursor, decode_cursor, keyset_filter
+
+
+def matches(document, query):
+    # Evaluates the filters built by keyset_filter
+    if document["user_id"] != query["user_id"]:
+        return False
+    if "$or" not in query:
+        return True
+    older, same_time = query["$or"]
+    return (document["created_at"] < older["created_at"]["$lt"] or
+            (document["created_at"] == same_time["created_at"] and document["_id"] < same_time["_id"]["$lt"]))
+
+
+class TestKeysetPagination(unittest.TestCase):
+
+    def setUp(self):
+        start = datetime.datetime(2024, 1, 1)
+        # Pairs of documents share a creation time, so the _id tie-breaker matters
+        self.documents = [{"_id": ObjectId(), "user_id": "alice", "created_at": start + datetime.timedelta(seconds=i // 2)}
+                          for i in range(7)]
+        self.documents.append({"_id": ObjectId(), "user_id": "bob", "created_at": start})
+
+    def test_cursor_round_trip(self):
+        document = self.documents[3]
+        self.assertEqual(decode_cursor(encode_cursor(document)), (document["created_at"], document["_id"]))
+        with self.assertRaises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    def test_pages_cover_each_document_once(self):
+        ordered = sorted((d for d in self.documents if d["user_id"] == "alice"),
+                         key=lambda d: (d["created_at"], d["_id"]), reverse=True)
+        seen, cursor = [], None
+        while True:
+            query = keyset_filter("alice", cursor)
+            page = [d for d in ordered if matches(d, query)][:3]
+            seen += page
+            if len(page) < 3:
+                break
+            cursor = encode_cursor(page[-1])
+        self.assertEqual(seen, ordered)
+
+
+if __name__ == '__main__':
+    unittest.main()
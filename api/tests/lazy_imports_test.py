@@ -0,0 +1,75 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import lazy_imports
+from benchmarks.import_time import parse_importtime, summarize
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.directory.name, "lazy_sample.py"), "w") as f:
+            f.write("import threading\nIMPORTS = threading.local\nVALUE = 42\ndef double(x):\n    return 2 * x\n")
+        sys.path.insert(0, self.directory.name)
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(sys.path.remove, self.directory.name)
+        self.addCleanup(sys.modules.pop, "lazy_sample", None)
+        self.addCleanup(lazy_imports._lazy_modules.pop, "lazy_sample", None)
+
+    def test_imports_on_first_attribute_access(self):
+        module = lazy_imports.lazy_import("lazy_sample")
+        self.assertNotIn("lazy_sample", sys.modules)
+        self.assertFalse(lazy_imports.loaded_modules()["lazy_sample"])
+        self.assertIs(lazy_imports.lazy_import("lazy_sample"), module)
+
+        self.assertEqual(module.double(module.VALUE), 84)
+        self.assertIn("lazy_sample", sys.modules)
+        self.assertTrue(lazy_imports.loaded_modules()["lazy_sample"])
+        self.assertIs(module.double, sys.modules["lazy_sample"].double)
+        with self.assertRaises(AttributeError):
+            module.missing
+
+    def test_imported_modules_are_returned_as_they_are(self):
+        self.assertIs(lazy_imports.lazy_import("threading"), threading)
+
+    def test_concurrent_first_use(self):
+        module = lazy_imports.lazy_import("lazy_sample")
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(module.VALUE)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [42] * 8)
+
+    def test_prewarm(self):
+        lazy_imports.lazy_import("lazy_sample")
+        timings = lazy_imports.prewarm()
+        self.assertGreaterEqual(timings["lazy_sample"], 0)
+        self.assertIn("lazy_sample", sys.modules)
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_summarize(self):
+        output = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       100 |        100 |     numpy.core\n"
+                  "import time:       200 |        300 |   numpy\n"
+                  "import time:        50 |         50 |   api.helpers\n"
+                  "import time:        10 |        360 | api.main\n")
+        modules = parse_importtime(output)
+        self.assertEqual(modules[0], ("numpy.core", 100, 100, 2))
+        summary = summarize(modules, "api.main")
+        self.assertEqual(summary["total_ms"], 0.36)
+        self.assertEqual(summary["packages_ms"], {"numpy": 0.3, "api": 0.06})
+        self.assertEqual(list(summary["slowest_ms"])[:2], ["api.main", "numpy"])
+        self.assertEqual(summary["imported"], ["api", "numpy"])
+        with self.assertRaises(ValueError):
+            summarize(modules, "other")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import tracemalloc
+import unittest
+from unittest import mock
+import numpy as np
+from fastapi import APIRouter, FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+import memory_tracking
+import metrics
+from memory_tracking import MemoryTrackingMiddleware
+from metrics import record_image, stage
+
+
+class TestMemoryTracking(unittest.TestCase):
+
+    def setUp(self):
+        router = APIRouter()
+
+        def blur(image):
+            with stage("blur"):
+                blurred = np.empty((2048, 1024), np.float64)  # 16 MiB, freed after the stage
+                blurred[:] = np.vstack([image, image])
+                return float(blurred.mean())
+
+        @router.get("/images/{image_id}")
+        async def process(image_id: int):
+            with stage("decode"):
+                image = np.ones((1024, 1024), np.uint8)  # 1 MiB, alive until the end
+                record_image(1024, 1024)
+            await run_in_threadpool(blur, image)
+            return {}
+
+        @router.get("/plain")
+        async def plain():
+            return {}
+
+        app = FastAPI()
+        app.include_router(router)
+        self.middleware = None
+
+        def build(app):
+            self.middleware = MemoryTrackingMiddleware(app, rate=1.0)
+            return self.middleware
+
+        app.add_middleware(build)
+        self.client = TestClient(app)
+
+    def test_tracked_request_is_logged_and_measured(self):
+        with self.assertLogs("memory_tracking", "INFO") as logs:
+            self.assertEqual(self.client.get("/images/3").status_code, 200)
+        self.assertFalse(tracemalloc.is_tracing())
+        report = logs.records[0].memory
+        self.assertEqual(report["route"], "/images/{image_id}")
+        self.assertGreaterEqual(report["peak_bytes"], 17 * 2 ** 20)
+        self.assertGreaterEqual(report["stages"]["blur"], 17 * 2 ** 20)
+        self.assertLess(report["stages"]["decode"], 4 * 2 ** 20)
+        self.assertEqual(report["megapixels"], 1024 * 1024 / 1e6)
+        # The largest snapshot was taken while the blurred copy was alive, and both arrays are NumPy data
+        self.assertGreaterEqual(report["numpy_bytes"], 17 * 2 ** 20)
+        self.assertRegex(report["sites"][0]["site"], r"memory_tracking_test\.py:\d+")
+        self.assertEqual(report["sites"][0]["numpy_bytes"], 16 * 2 ** 20)
+
+        text = metrics.render()
+        self.assertIn('scanner_request_peak_memory_bytes_count{method="GET",route="/images/{image_id}"} ', text)
+        self.assertIn('scanner_stage_peak_memory_bytes_count{route="/images/{image_id}",stage="blur"} ', text)
+
+    def test_large_peaks_are_warnings(self):
+        with mock.patch.object(memory_tracking, "MEMORY_TRACKING_WARN_MB", 8):
+            with self.assertLogs("memory_tracking", "INFO") as logs:
+                self.client.get("/images/3")
+        self.assertEqual(logs.records[0].levelname, "WARNING")
+
+    def test_requests_without_stages(self):
+        with self.assertLogs("memory_tracking", "INFO") as logs:
+            self.client.get("/plain")
+        report = logs.records[0].memory
+        self.assertEqual((report["stages"], report["megapixels"], report["bytes_per_pixel"]), ({}, 0.0, None))
+
+    def test_sampling(self):
+        self.client.get("/plain")
+        self.middleware.rate = 0
+        with mock.patch.object(memory_tracking.logger, "log") as log:
+            self.client.get("/plain")
+        log.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import contextvars
+import unittest
+from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+import metrics
+from metrics import Counter, Histogram, MetricsMiddleware, server_timing, stage
+
+
+def sample_lines(text, prefix):
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, route="/a")
+        self.assertEqual(sample_lines(metrics.render(), "test_seconds"), [
+            'test_seconds_bucket{route="/a",le="0.1"} 1',
+            'test_seconds_bucket{route="/a",le="1.0"} 3',
+            'test_seconds_bucket{route="/a",le="+Inf"} 4',
+            'test_seconds_sum{route="/a"} 6.05',
+            'test_seconds_count{route="/a"} 4',
+        ])
+
+    def test_counter_labels_are_escaped(self):
+        counter = Counter("test_total", "Test.", ("path",))
+        counter.inc(path='a"b')
+        counter.inc(2, path='a"b')
+        self.assertEqual(sample_lines(metrics.render(), "test_total"), ['test_total{path="a\\"b"} 3'])
+
+    def test_server_timing_adds_up_repeated_stages(self):
+        self.assertEqual(server_timing([("decode", 0.01), ("ocr", 0.5), ("decode", 0.002)], total=0.6),
+                         "decode;dur=12.00, ocr;dur=500.00, total;dur=600.00")
+
+
+class TestMetricsMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        router = APIRouter()
+
+        def work():
+            with stage("threaded"):
+                pass
+
+        @router.get("/items/{item_id}")
+        async def read_item(item_id: int):
+            with stage("decode"):
+                pass
+            await run_in_threadpool(work)
+            await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, work)
+            return {}
+
+        @router.get("/fail")
+        async def fail():
+            raise HTTPException(status_code=503)
+
+        app = FastAPI()
+        app.include_router(router)
+        app.add_middleware(MetricsMiddleware)
+        self.client = TestClient(app)
+
+    def test_stage_timings_are_sent_and_aggregated(self):
+        response = self.client.get("/items/7")
+        names = [part.split(";")[0] for part in response.headers["server-timing"].split(", ")]
+        self.assertEqual(names, ["decode", "threaded", "total"])
+
+        self.client.get("/items/8")
+        text = metrics.render()
+        self.assertIn('scanner_requests_total{method="GET",route="/items/{item_id}",status="200"}', text)
+        self.assertIn('scanner_stage_duration_seconds_count{route="/items/{item_id}",stage="threaded"}', text)
+
+    def test_errors_are_counted(self):
+        self.assertEqual(self.client.get("/fail").status_code, 503)
+        self.assertIn('scanner_request_errors_total{method="GET",route="/fail"}', metrics.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+from pymongo.errors import OperationFailure, PyMongoError, ServerSelectionTimeoutError
+from db import mongodb_utils
+from db.mongodb_utils import PoolStats
+
+
+class TestSharedClient(unittest.TestCase):
+
+    def tearDown(self):
+        mongodb_utils.close()
+
+    @mock.patch.dict(os.environ, {"MONGODB_URL": "mongodb://user:<password>@localhost:27017", "MONGODB_PASSWORD": "pw"})
+    def test_client_is_shared_and_closed(self):
+        self.assertEqual(mongodb_utils.connection_string(), "mongodb://user:pw@localhost:27017")
+        first = next(mongodb_utils.get_db())
+        second = next(mongodb_utils.get_db())
+        self.assertIs(first.client, second.client)
+        self.assertEqual(first.name, "document_scanner")
+        self.assertEqual(first.client.options.pool_options.max_pool_size, mongodb_utils.MONGODB_MAX_POOL_SIZE)
+        self.assertTrue(mongodb_utils.get_pool_stats()["connected"])
+
+        mongodb_utils.close()
+        self.assertFalse(mongodb_utils.get_pool_stats()["connected"])
+        self.assertIsNot(next(mongodb_utils.get_db()).client, first.client)
+
+    @mock.patch.dict(os.environ, {"MONGODB_URL": ""})
+    def test_missing_url_is_reported(self):
+        self.assertFalse(mongodb_utils.is_configured())
+        with self.assertRaisesRegex(RuntimeError, "MONGODB_URL"):
+            mongodb_utils.connect()
+
+    def test_pool_stats_counts_events(self):
+        stats = PoolStats()
+        stats.connection_created(None)
+        stats.connection_created(None)
+        stats.connection_checked_out(None)
+        stats.connection_checked_out(None)
+        stats.connection_checked_in(None)
+        stats.connection_closed(None)
+        stats.connection_check_out_failed(None)
+        counters = stats.snapshot()
+        self.assertEqual((counters["open_connections"], counters["checked_out"], counters["checkouts"]), (1, 1, 2))
+        self.assertEqual(counters["checkout_failures"], 1)
+
+
+class TestIndexes(unittest.TestCase):
+
+    def test_ensure_indexes_creates_unique_email_index(self):
+        collection = mock.Mock(create_indexes=mock.AsyncMock(), drop_index=mock.AsyncMock())
+        db = mock.MagicMock()
+        db.__getitem__.return_value = collection
+        asyncio.run(mongodb_utils.ensure_indexes(db))
+        db.__getitem__.assert_any_call("users")
+        index = collection.create_indexes.call_args_list[0].args[0][0].document
+        self.assertEqual((index["key"], index["unique"]), ({"email": 1}, True))
+
+    def test_index_errors_do_not_stop_startup(self):
+        collection = mock.Mock(create_indexes=mock.AsyncMock(side_effect=PyMongoError("duplicate key")),
+                               drop_index=mock.AsyncMock())
+        db = mock.MagicMock()
+        db.__getitem__.return_value = collection
+        with self.assertLogs("db.mongodb_utils", level="ERROR"):
+            asyncio.run(mongodb_utils.ensure_indexes(db))
+
+    def test_obsolete_indexes_are_dropped(self):
+        missing = OperationFailure("index not found", code=mongodb_utils.INDEX_NOT_FOUND)
+        collection = mock.Mock(create_indexes=mock.AsyncMock(), drop_index=mock.AsyncMock(side_effect=missing))
+        db = mock.MagicMock()
+        db.__getitem__.return_value = collection
+        with self.assertNoLogs("db.mongodb_utils", level="ERROR"):
+            asyncio.run(mongodb_utils.ensure_indexes(db))
+        collection.drop_index.assert_awaited_once_with("user_pdf")
+        names = [index.document["name"] for call in collection.create_indexes.call_args_list for index in call.args[0]]
+        self.assertNotIn("user_pdf", names)
+
+    def test_unreachable_database_is_tried_once(self):
+        collection = mock.Mock(create_indexes=mock.AsyncMock(side_effect=ServerSelectionTimeoutError("timed out")))
+        db = mock.MagicMock()
+        db.__getitem__.return_value = collection
+        with self.assertLogs("db.mongodb_utils", level="ERROR"):
+            asyncio.run(mongodb_utils.ensure_indexes(db))
+        self.assertEqual(collection.create_indexes.await_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+import numpy as np
+import ocr_cache
+from ocr_cache import OcrCache, make_cache_key, cached_ocr_image
+
+
+class TestOcrCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = OcrCache(os.path.join(self.tmpdir, "cache.sqlite3"), max_bytes=250)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_make_cache_key_depends_on_pixels_and_params(self):
+        page = np.zeros((10, 10), dtype=np.uint8)
+        key = make_cache_key(page, lang="eng", psm=3)
+        self.assertEqual(key, make_cache_key(page.copy(), psm=3, lang="eng"))
+        self.assertNotEqual(key, make_cache_key(page, lang="deu", psm=3))
+        changed = page.copy()
+        changed[5, 5] = 1
+        self.assertNotEqual(key, make_cache_key(changed, lang="eng", psm=3))
+        self.assertNotEqual(key, make_cache_key(page.reshape(5, 20), lang="eng", psm=3))
+
+    def test_miss_then_hit(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", {"text": "hello"})
+        self.assertEqual(self.cache.get("a"), {"text": "hello"})
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_lru_eviction_by_size(self):
+        for key in "abc":
+            self.cache.put(key, {"text": "x" * 60})
+        self.cache.get("a")  # "b" is now the least recently used entry
+        self.cache.put("d", {"text": "x" * 60})
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        stats = self.cache.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertLessEqual(stats["bytes"], 250)
+
+    def test_replacing_an_entry_keeps_size_accounting(self):
+        self.cache.put("a", {"text": "x" * 60})
+        self.cache.put("a", {"text": "y"})
+        self.assertEqual(self.cache.stats()["bytes"], len('{"text": "y"}'))
+
+    def test_shared_between_instances(self):
+        self.cache.put("a", {"text": "hello"})
+        other = OcrCache(self.cache.path)
+        self.assertEqual(other.get("a"), {"text": "hello"})
+        self.assertEqual(self.cache.stats()["hits"], 0)
+        other.flush()
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_lookups_do_not_wait_for_writers(self):
+        self.cache.put("a", {"text": "hello"})
+        writer = sqlite3.connect(self.cache.path, isolation_level=None)
+        writer.execute("BEGIN IMMEDIATE")
+        try:
+            with mock.patch.object(ocr_cache, "OCR_CACHE_FLUSH_LOOKUPS", 2):
+                self.assertEqual(self.cache.get("a"), {"text": "hello"})
+                started = time.monotonic()
+                self.assertIsNone(self.cache.get("b"))  # The flush is due but the database is locked
+                self.assertLess(time.monotonic() - started, 1.0)
+        finally:
+            writer.execute("ROLLBACK")
+            writer.close()
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_stats_of_an_unreadable_cache(self):
+        cache = OcrCache(self.tmpdir)  # A directory cannot be opened as a database
+        with self.assertLogs("ocr_cache", "WARNING"):
+            self.assertEqual(cache.stats(), {"available": False, "max_bytes": cache.max_bytes})
+
+    def test_block_timings_are_not_cached(self):
+        result = {"text": "a", "scale": 1.0, "blocks": [{"bbox": [0, 0, 5, 5], "text": "a", "seconds": 0.5}]}
+        page = np.zeros((10, 10), dtype=np.uint8)
+        with mock.patch.object(ocr_cache, "ocr_cache", self.cache), \
+                mock.patch.object(ocr_cache, "ocr_image", return_value=result) as ocr_image:
+            self.assertEqual(cached_ocr_image(page, mode="blocks"), result)
+            self.assertEqual(cached_ocr_image(page, mode="blocks")["blocks"], [{"bbox": [0, 0, 5, 5], "text": "a"}])
+        ocr_image.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
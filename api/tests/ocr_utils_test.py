@@ -0,0 +1,150 @@
+import os
+import threading
+import unittest
+import numpy as np
+import cv2
+from ocr_utils import binarize_page, clean_text_mask, segment_text_blocks, ocr_blocks_parallel, ocr_pool, estimate_text_height, rescale_for_ocr, ocr_image, parse_hocr_words, ocr_page_words, OCR_MAX_MEGAPIXELS, OCR_WORKERS
+
+
+def make_page(columns=2, lines=6):
+    # White page with `lines` lines of text in each of `columns` columns
+    page = np.full((600, 800), 255, dtype=np.uint8)
+    column_width = 800 // columns
+    for c in range(columns):
+        for l in range(lines):
+            cv2.putText(page, "col%d line%d" % (c, l), (20 + c * column_width, 60 + l * 40),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+    return page
+
+
+class TestTextBlocks(unittest.TestCase):
+
+    def test_binarize_page(self):
+        binary = binarize_page(make_page())
+        self.assertEqual(binary.dtype, np.uint8)
+        self.assertTrue(0 < np.count_nonzero(binary) < binary.size // 2)  # Ink is the minority
+
+    def test_clean_text_mask_removes_border(self):
+        page = make_page()
+        cv2.rectangle(page, (2, 2), (797, 597), 0, 2)
+        mask, char_height = clean_text_mask(binarize_page(page))
+        self.assertFalse(mask[2, 400])  # Border pixel removed
+        self.assertTrue(10 < char_height < 40)
+
+    def test_blank_page_has_no_blocks(self):
+        self.assertEqual(segment_text_blocks(np.full((100, 100), 255, dtype=np.uint8)), [])
+
+    def test_blocks_follow_column_reading_order(self):
+        blocks = segment_text_blocks(make_page(), target_blocks=4)
+        self.assertEqual(len(blocks), 4)
+        # The left column is read completely before the right column
+        self.assertTrue(all(x < 400 for x, _, _, _ in blocks[:2]))
+        self.assertTrue(all(x >= 400 for x, _, _, _ in blocks[2:]))
+        self.assertLess(blocks[0][1], blocks[1][1])
+
+    def test_ocr_blocks_parallel_merges_in_order(self):
+        page = make_page()
+
+        def fake_ocr(image, lang, config):
+            self.assertEqual(config, "--psm 6")
+            return "%dx%d\n" % image.shape[::-1]
+
+        text, report = ocr_blocks_parallel(page, workers=2, ocr_fn=fake_ocr)
+        self.assertEqual(text.split("\n"), [block["text"] for block in report])
+        self.assertTrue(all(block["seconds"] >= 0 for block in report))
+
+    def test_ocr_blocks_parallel_reuses_one_pool(self):
+        threads = set()
+
+        def fake_ocr(image, lang, config):
+            threads.add(threading.current_thread().name)
+            return "text"
+
+        for _ in range(3):
+            ocr_blocks_parallel(make_page(), workers=2, ocr_fn=fake_ocr)
+        self.assertTrue(all(name.startswith("ocr-block") for name in threads))
+        self.assertLessEqual(len(threads), OCR_WORKERS)
+        self.assertIs(ocr_pool(), ocr_pool())
+
+
+class TestOcrRescaling(unittest.TestCase):
+
+    def test_estimate_text_height_is_scale_invariant(self):
+        page = make_page()
+        height = estimate_text_height(page)
+        large = cv2.resize(page, None, fx=3, fy=3, interpolation=cv2.INTER_NEAREST)
+        self.assertAlmostEqual(estimate_text_height(large, max_side=800), 3 * height, delta=0.3 * 3 * height)
+
+    def test_rescale_for_ocr_reaches_target(self):
+        page = cv2.resize(make_page(), None, fx=4, fy=4, interpolation=cv2.INTER_NEAREST)
+        rescaled, factor = rescale_for_ocr(page, target_height=30)
+        self.assertLess(factor, 1.0)
+        self.assertAlmostEqual(estimate_text_height(rescaled), 30, delta=8)
+
+    def test_rescale_for_ocr_keeps_blank_page(self):
+        page = np.full((50, 50), 255, dtype=np.uint8)
+        rescaled, factor = rescale_for_ocr(page)
+        self.assertIs(rescaled, page)
+        self.assertEqual(factor, 1.0)
+
+    def test_noise_has_no_text_height(self):
+        rng = np.random.default_rng(0)
+        noise = np.where(rng.random((600, 800)) < 0.02, 0, 255).astype(np.uint8)
+        self.assertEqual(estimate_text_height(noise), 0)
+        rescaled, factor = rescale_for_ocr(noise)
+        self.assertIs(rescaled, noise)
+        self.assertEqual(factor, 1.0)
+
+    def test_rescale_for_ocr_caps_the_size(self):
+        page = cv2.resize(make_page(), None, fx=0.4, fy=0.4, interpolation=cv2.INTER_AREA)  # 7 px glyphs
+        rescaled, factor = rescale_for_ocr(page, max_megapixels=0.2)
+        self.assertGreater(factor, 1.0)
+        self.assertLessEqual(rescaled.shape[0] * rescaled.shape[1], 0.2e6)
+        # Pages already above the limit are not upscaled
+        self.assertIs(rescale_for_ocr(page, max_megapixels=0.05)[0], page)
+
+    def test_photo_stays_within_the_size_limit(self):
+        photo = cv2.imread(os.path.join(os.path.dirname(__file__), "..", "test.jpeg"), cv2.IMREAD_GRAYSCALE)
+        rescaled, factor = rescale_for_ocr(photo)
+        self.assertLessEqual(factor, 4.0)
+        self.assertLessEqual(rescaled.shape[0] * rescaled.shape[1], OCR_MAX_MEGAPIXELS * 1e6)
+
+    def test_ocr_image_maps_blocks_to_original_coordinates(self):
+        page = cv2.resize(make_page(), None, fx=4, fy=4, interpolation=cv2.INTER_NEAREST)
+        result = ocr_image(page, mode="blocks", ocr_fn=lambda image, lang, config: "text")
+        self.assertLess(result["scale"], 1.0)
+        self.assertTrue(all(block["bbox"][0] + block["bbox"][2] <= page.shape[1] + 1 for block in result["blocks"]))
+        self.assertTrue(any(block["bbox"][0] >= page.shape[1] // 2 for block in result["blocks"]))
+
+
+HOCR = b"""<?xml version="1.0" encoding="UTF-8"?>
+<html><body><div class='ocr_page' title='bbox 0 0 800 600'>
+ <span class='ocr_line' title='bbox 10 20 200 50'>
+  <span class='ocrx_word' id='word_1_1' title='bbox 10 20 90 50; x_wconf 96'>Hello</span>
+  <span class='ocrx_word' id='word_1_2' title='bbox 100 20 200 50; x_wconf 91'><strong>w&ouml;rld</strong></span>
+  <span class='ocrx_word' id='word_1_3' title='bbox 210 20 220 50; x_wconf 10'> </span>
+ </span>
+</div></body></html>"""
+
+
+class TestHocr(unittest.TestCase):
+
+    def test_parse_hocr_words(self):
+        words = parse_hocr_words(HOCR)
+        self.assertEqual(words, [("Hello", (10, 20, 90, 50)), ("w\u00f6rld", (100, 20, 200, 50))])
+
+    def test_ocr_page_words_uses_original_coordinates(self):
+        page = cv2.resize(make_page(), None, fx=4, fy=4, interpolation=cv2.INTER_NEAREST)
+        seen = []
+
+        def fake_hocr(image, lang, extension):
+            seen.append(image.shape)
+            return HOCR
+
+        words = ocr_page_words(page, hocr_fn=fake_hocr)
+        self.assertLess(seen[0][0], page.shape[0])  # Tesseract saw the downscaled page
+        self.assertGreater(words[0][1][2], 90)  # ...but boxes are mapped back
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import asyncio
+import unittest
+from unittest import mock
+import passwords
+
+
+class TestPasswords(unittest.TestCase):
+
+    def test_hash_and_verify(self):
+        async def check():
+            hashed = await passwords.hash_password("s3cret!")
+            return hashed, await passwords.verify_password("s3cret!", hashed), await passwords.verify_password("wrong", hashed)
+
+        with mock.patch.object(passwords, "BCRYPT_ROUNDS", 4):
+            hashed, good, bad = asyncio.run(check())
+        self.assertTrue(hashed.startswith(b"$2b$04$"))
+        self.assertTrue(good)
+        self.assertFalse(bad)
+
+    def test_event_loop_keeps_running_while_hashing(self):
+        async def check():
+            ticks = 0
+            hashing = asyncio.ensure_future(passwords.hash_password("s3cret!"))
+            while not hashing.done():
+                ticks += 1
+                await asyncio.sleep(0.001)
+            await hashing
+            return ticks
+
+        with mock.patch.object(passwords, "BCRYPT_ROUNDS", 10):
+            self.assertGreater(asyncio.run(check()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
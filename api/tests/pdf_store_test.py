@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import pdf_store
+from pdf_store import PdfStore, etag_matches
+
+
+async def chunks_of(*parts):
+    for part in parts:
+        yield part
+
+
+class TestPdfStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = PdfStore(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_is_content_addressed_and_deduplicated(self):
+        first = asyncio.run(self.store.save(chunks_of(b"%PDF-1.4\n", b"body"), pages=1))
+        digest = hashlib.sha256(b"%PDF-1.4\nbody").hexdigest()
+        self.assertEqual((first["id"], first["size"], first["pages"], first["deduplicated"]), (digest, 13, 1, False))
+        with open(self.store.local_path(digest), "rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.4\nbody")
+
+        second = asyncio.run(self.store.save(chunks_of(b"%PDF-1.4\nbody"), pages=2))
+        self.assertTrue(second["deduplicated"])
+        self.assertEqual(second["pages"], 1)  # The first copy's metadata is kept
+        self.assertEqual(asyncio.run(self.store.metadata(digest))["created_at"], first["created_at"])
+        leftovers = [name for name in os.listdir(self.tmpdir) if name.startswith(".tmp-")]
+        self.assertEqual(leftovers, [])
+
+    def test_failed_save_leaves_nothing(self):
+        async def failing():
+            yield b"%PDF-1.4\n"
+            raise ValueError("bad page")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(self.store.save(failing()))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_save_on_base_stores_only_the_update(self):
+        base = asyncio.run(self.store.save(chunks_of(b"%PDF-1.4\n")))
+        update = asyncio.run(self.store.save(chunks_of(b"update"), base=base["id"]))
+        self.assertEqual(update["id"], hashlib.sha256(base["id"].encode() + b"update").hexdigest())
+        self.assertEqual((update["size"], update["update_size"], update["base"], update["depth"]), (15, 6, base["id"], 1))
+        with open(self.store.local_path(update["id"]), "rb") as f:
+            self.assertEqual(f.read(), b"update")
+        second = asyncio.run(self.store.save(chunks_of(b" again"), base=update["id"]))
+        self.assertEqual(second["size"], 21)
+
+        async def read(digest):
+            reader = await self.store.open(digest)
+            try:
+                return b"".join([chunk async for chunk in reader.chunks()])
+            finally:
+                reader.close()
+
+        self.assertEqual(asyncio.run(read(base["id"])), b"%PDF-1.4\n")
+        self.assertEqual(asyncio.run(read(update["id"])), b"%PDF-1.4\nupdate")
+        self.assertEqual(asyncio.run(read(second["id"])), b"%PDF-1.4\nupdate again")
+        self.assertTrue(asyncio.run(self.store.save(chunks_of(b"update"), base=base["id"]))["deduplicated"])
+
+        async def read_lines(digest):
+            reader = await self.store.open(digest)
+            try:
+                reader.seek(5)
+                head = await reader.read(6)
+                reader.seek(-9, os.SEEK_END)
+                return head, await reader.readline(), await reader.readline(), await reader.read(), reader.tell()
+            finally:
+                reader.close()
+
+        # Reads and lines that run across the base's end
+        self.assertEqual(asyncio.run(read_lines(second["id"])), (b"1.4\nup", b"ate again", b"", b"", 21))
+        with self.assertRaises(ValueError):
+            asyncio.run(self.store.save(chunks_of(b"update"), base="0" * 64))
+
+    def test_long_update_chains_are_rewritten(self):
+        async def append_and_read():
+            document = await self.store.save(chunks_of(b"%PDF-1.4\n"))
+            chain = []
+            for i in range(4):
+                document = await self.store.save(chunks_of(b"%d" % i), base=document["id"])
+                chain.append(document)
+            reader = await self.store.open(chain[1]["id"])
+            try:
+                parts = len(reader.readers)
+            finally:
+                reader.close()
+            reader = await self.store.open(document["id"])
+            try:
+                return chain, parts, b"".join([chunk async for chunk in reader.chunks()])
+            finally:
+                reader.close()
+
+        with mock.patch.object(pdf_store, "PDF_STORE_MAX_UPDATES", 2):
+            chain, parts, data = asyncio.run(append_and_read())
+        self.assertEqual([document.get("depth") for document in chain], [1, 2, None, 1])
+        self.assertEqual(parts, 3)  # The whole file and both updates, without nesting
+        # The third update is saved as the whole PDF, under its file hash
+        self.assertEqual(chain[2]["id"], hashlib.sha256(b"%PDF-1.4\n012").hexdigest())
+        self.assertNotIn("base", chain[2])
+        self.assertEqual((chain[3]["base"], chain[3]["size"]), (chain[2]["id"], 13))
+        self.assertEqual(data, b"%PDF-1.4\n0123")
+
+    def test_invalid_ids_are_rejected(self):
+        self.assertIsNone(asyncio.run(self.store.metadata("../../etc/passwd")))
+        self.assertIsNone(asyncio.run(self.store.metadata("0" * 64)))
+        self.assertIsNone(asyncio.run(self.store.open("../../etc/passwd")))
+        with self.assertRaises(ValueError):
+            self.store.local_path("A" * 64)
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"abc"', '"abc"'))
+        self.assertTrue(etag_matches('"x", W/"abc"', '"abc"'))
+        self.assertTrue(etag_matches("*", '"abc"'))
+        self.assertFalse(etag_matches('"abd"', '"abc"'))
+        self.assertFalse(etag_matches(None, '"abc"'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,281 @@
+import asyncio
+import io
+import re
+import unittest
+import zlib
+from unittest import mock
+import numpy as np
+import cv2
+from PIL import Image
+from pdf_utils import PdfWriter, jpeg_image, png_image, array_image, load_page_image, fit_page_size, text_layer, stream_pdf, is_bilevel, bilevel_image, mixed_raster_image, compact_page_image, prepare_page_image, prepare_page, prepare_pages, PdfUpdater, read_pdf_structure
+
+
+def build_pdf(pages):
+    chunks = []
+    writer = PdfWriter(chunks.append)
+    for image, words in pages:
+        writer.add_page(image, words)
+    writer.close()
+    return b"".join(chunks)
+
+
+class TestPageImages(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.color = (np.random.rand(40, 30, 3) * 255).astype(np.uint8)
+        cls.gray = (np.random.rand(40, 30) * 255).astype(np.uint8)
+
+    def test_jpeg_is_passed_through(self):
+        data = cv2.imencode('.jpg', self.color)[1].tobytes()
+        image = jpeg_image(data)
+        self.assertIs(image["data"], data)
+        self.assertEqual((image["width"], image["height"], image["color_space"]), (30, 40, "/DeviceRGB"))
+        self.assertEqual(jpeg_image(cv2.imencode('.jpg', self.gray)[1].tobytes())["color_space"], "/DeviceGray")
+
+    def test_only_huffman_dct_jpegs_are_passed_through(self):
+        data = cv2.imencode('.jpg', self.color)[1].tobytes()
+        sof = data.index(b"\xff\xc0")
+        for marker, name in ((0xC3, "lossless"), (0xC9, "arithmetic")):
+            with self.subTest(name):
+                changed = data[:sof + 1] + bytes([marker]) + data[sof + 2:]
+                with self.assertRaisesRegex(ValueError, "Unsupported JPEG coding process"):
+                    jpeg_image(changed)
+                try:
+                    image = load_page_image(changed)
+                except ValueError:
+                    continue
+                self.assertEqual(image["filter"], "/FlateDecode")
+
+    def test_png_data_is_passed_through(self):
+        data = cv2.imencode('.png', self.gray)[1].tobytes()
+        image = png_image(data)
+        self.assertEqual((image["width"], image["height"], image["color_space"]), (30, 40, "/DeviceGray"))
+        # The IDAT stream inflates to predictor-prefixed rows of the original pixels
+        rows = np.frombuffer(zlib.decompress(image["data"]), np.uint8).reshape(40, 31)
+        self.assertEqual(rows.shape, (40, 31))
+
+    def test_png_with_alpha_is_reencoded(self):
+        data = cv2.imencode('.png', cv2.cvtColor(self.color, cv2.COLOR_BGR2BGRA))[1].tobytes()
+        with self.assertRaises(ValueError):
+            png_image(data)
+        image = load_page_image(data)
+        self.assertEqual(image["color_space"], "/DeviceRGB")
+        pixels = np.frombuffer(zlib.decompress(image["data"]), np.uint8).reshape(40, 30, 3)
+        np.testing.assert_array_equal(pixels, self.color[:, :, ::-1])
+
+    def test_array_image(self):
+        image = array_image(self.gray)
+        np.testing.assert_array_equal(np.frombuffer(zlib.decompress(image["data"]), np.uint8).reshape(40, 30), self.gray)
+
+    def test_invalid_upload(self):
+        with self.assertRaises(ValueError):
+            load_page_image(b"not an image")
+
+    def test_fit_page_size_keeps_aspect_ratio(self):
+        width, height = fit_page_size(1000, 2000)
+        self.assertAlmostEqual(width / height, 0.5)
+        self.assertLessEqual(height, 841.89 + 1e-6)
+        width, height = fit_page_size(4000, 3000)
+        self.assertGreater(width, height)
+
+
+def make_text_page():
+    page = np.full((400, 300), 255, dtype=np.uint8)
+    for line in range(10):
+        cv2.putText(page, "Scanned text %d" % line, (10, 30 + line * 36), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+    return page
+
+
+class TestCompactImages(unittest.TestCase):
+
+    def test_is_bilevel(self):
+        page = make_text_page()
+        self.assertTrue(is_bilevel(cv2.GaussianBlur(page, (3, 3), 0)))
+        self.assertFalse(is_bilevel(np.full((10, 10), 128, np.uint8)))
+
+    def test_bilevel_image_round_trip(self):
+        page = make_text_page()
+        image = bilevel_image(page)
+        self.assertEqual(image["bits"], 1)
+        if image["filter"] == "/FlateDecode":
+            bits = np.unpackbits(np.frombuffer(zlib.decompress(image["data"]), np.uint8)).reshape(400, -1)[:, :300]
+            np.testing.assert_array_equal(bits == 0, page < 128)  # Ink decodes to black
+
+    def test_mixed_raster_image(self):
+        page = cv2.cvtColor(make_text_page(), cv2.COLOR_GRAY2BGR)
+        page[:, :, 0] = 200  # Tinted paper
+        image = mixed_raster_image(page)
+        self.assertEqual((image["width"], image["height"]), (100, 133))
+        self.assertEqual((image["mask"]["width"], image["mask"]["height"]), (300, 400))
+        self.assertTrue(image["mask"]["image_mask"])
+        self.assertEqual(len(image["mask"]["color"]), 3)
+
+    def test_compact_page_image_is_never_larger(self):
+        bilevel = cv2.imencode('.png', make_text_page())[1].tobytes()
+        self.assertEqual(compact_page_image(bilevel)["bits"], 1)
+        for _ in range(3):
+            noise = cv2.imencode('.jpg', (np.random.rand(40, 30, 3) * 255).astype(np.uint8))[1].tobytes()
+            image = compact_page_image(noise)
+            size = len(image["data"]) + (len(image["mask"]["data"]) if "mask" in image else 0)
+            self.assertLessEqual(size, len(noise))
+
+
+class TestPdfWriter(unittest.TestCase):
+
+    def test_xref_offsets_point_at_objects(self):
+        jpeg = cv2.imencode('.jpg', np.zeros((20, 10, 3), np.uint8))[1].tobytes()
+        pdf = build_pdf([(jpeg_image(jpeg), None), (array_image(np.zeros((10, 20), np.uint8)), None)])
+        self.assertTrue(pdf.startswith(b"%PDF-1.4"))
+        self.assertTrue(pdf.endswith(b"%%EOF\n"))
+        self.assertIn(jpeg, pdf)  # Embedded byte for byte
+
+        startxref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+        self.assertTrue(pdf[startxref:].startswith(b"xref\n0 10\n"))
+        entries = pdf[startxref:].split(b"\n")[3:12]
+        for obj_id, entry in enumerate(entries, start=1):
+            offset = int(entry[:10])
+            self.assertTrue(pdf[offset:].startswith(b"%d 0 obj" % obj_id))
+        self.assertIn(b"/Count 2", pdf)
+
+    def test_mask_is_painted_over_background(self):
+        page = cv2.cvtColor(make_text_page(), cv2.COLOR_GRAY2BGR)
+        pdf = build_pdf([(mixed_raster_image(page), None)])
+        self.assertIn(b"/ImageMask true", pdf)
+        self.assertIn(b"/MediaBox [0 0 595.28 793.71]", pdf)  # Sized from the 300x400 mask
+
+    def test_text_layer(self):
+        ops = text_layer([("Hello", (10, 20, 90, 50)), ("(café)", (100, 20, 200, 50))], scale=0.5, page_height=100)
+        self.assertIn(b"3 Tr /F1 15.00 Tf", ops)
+        # 80 px at 0.5 pt/px over 5 Courier glyphs of a 15 pt font
+        self.assertIn(b"%.2f Tz 1 0 0 1 5.00 75.00 Tm (Hello) Tj" % (100 * 40 / (5 * 0.6 * 15)), ops)
+        self.assertIn(b"(\\(caf\xe9\\)) Tj", ops)
+        self.assertEqual(text_layer([], scale=1, page_height=100), b"")
+
+
+class TestStreamPdf(unittest.TestCase):
+
+    def test_stream_matches_writer_and_starts_before_pages(self):
+        pages = [(array_image(np.full((10, 10), v, np.uint8)), None) for v in (0, 128, 255)]
+        produced = []
+
+        async def page_source():
+            for page in pages:
+                produced.append(page)
+                yield page
+
+        async def collect():
+            chunks = []
+            async for chunk in stream_pdf(page_source()):
+                if not chunks:
+                    self.assertEqual(produced, [])  # Header is sent before any page is prepared
+                chunks.append(chunk)
+            return chunks
+
+        chunks = asyncio.run(collect())
+        self.assertEqual(b"".join(chunks), build_pdf(pages))
+
+
+class TestIncrementalUpdate(unittest.TestCase):
+
+    def update(self, pdf, pages, at=None):
+        structure = read_pdf_structure(io.BytesIO(pdf))
+        chunks = [pdf]
+        updater = PdfUpdater(chunks.append, structure, at=at)
+        for image in pages:
+            updater.add_page(image)
+        updater.close()
+        return b"".join(chunks)
+
+    def test_pages_are_inserted_without_rewriting(self):
+        pages = [array_image(np.full((10, 10 + i), 0, np.uint8)) for i in range(3)]
+        original = build_pdf([(page, None) for page in pages[:2]])
+        structure = read_pdf_structure(io.BytesIO(original))
+        self.assertEqual((structure["size"], structure["root"], structure["pages_id"]), (10, 1, 2))
+        self.assertEqual(structure["page_ids"], [6, 9])
+
+        updated = self.update(original, [pages[2]], at=1)
+        self.assertTrue(updated.startswith(original))
+        structure = read_pdf_structure(io.BytesIO(updated))
+        self.assertEqual(structure["page_ids"], [6, 12, 9])
+        self.assertEqual(structure["size"], 13)
+        self.assertIn(b"/Prev %d" % read_pdf_structure(io.BytesIO(original))["startxref"], updated)
+
+        twice = self.update(updated, [pages[0]])
+        self.assertEqual(read_pdf_structure(io.BytesIO(twice))["page_ids"], [6, 12, 9, 15])
+        self.assertIn(b"/Count 4", twice)
+
+    def test_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            read_pdf_structure(io.BytesIO(b"not a pdf"))
+
+
+class FakeUpload:
+
+    def __init__(self, filename, contents):
+        self.filename = filename
+        self.contents = contents
+
+    async def read(self):
+        return self.contents
+
+
+class TestPreparePages(unittest.TestCase):
+
+    def test_prepare_page_image_downscales(self):
+        jpeg = cv2.imencode('.jpg', np.full((400, 200, 3), 128, np.uint8))[1].tobytes()
+        image = prepare_page_image(jpeg, max_side=100)
+        self.assertEqual((image["width"], image["height"], image["filter"]), (50, 100, "/DCTDecode"))
+        self.assertIs(prepare_page_image(jpeg, max_side=400)["data"], jpeg)  # Small enough already
+
+        png = cv2.imencode('.png', np.full((400, 200), 128, np.uint8))[1].tobytes()
+        image = prepare_page_image(png, max_side=100)
+        self.assertEqual((image["width"], image["height"], image["color_space"]), (50, 100, "/DeviceGray"))
+
+    def test_ocr_uses_the_embedded_orientation(self):
+        # A phone photo stored landscape with an EXIF tag that says to show it rotated
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        Image.fromarray(np.full((200, 400), 128, np.uint8)).save(buffer, "JPEG", exif=exif)
+        self.assertEqual(cv2.imdecode(np.frombuffer(buffer.getvalue(), np.uint8), cv2.IMREAD_GRAYSCALE).shape,
+                         (400, 200))
+
+        def fake_words(gray, lang):
+            self.assertEqual(gray.shape, (200, 400))
+            return [("word", (40, 20, 360, 60))]
+
+        with mock.patch("pdf_utils.ocr_page_words", fake_words):
+            image, words = prepare_page(buffer.getvalue(), searchable=True)
+        self.assertEqual((image["width"], image["height"]), (400, 200))
+        self.assertEqual(words, [("word", (40, 20, 360, 60))])
+
+    def test_pages_keep_upload_order(self):
+        sizes = [(10 + i, 20) for i in range(7)]
+        files = [FakeUpload("%d.png" % i, cv2.imencode('.png', np.zeros((h, w), np.uint8))[1].tobytes())
+                 for i, (w, h) in enumerate(sizes)]
+
+        async def collect():
+            return [image async for image, words in prepare_pages(files, workers=3)]
+
+        images = asyncio.run(collect())
+        self.assertEqual([(image["width"], image["height"]) for image in images], sizes)
+
+    def test_invalid_page_names_the_file(self):
+        files = [FakeUpload("ok.png", cv2.imencode('.png', np.zeros((5, 5), np.uint8))[1].tobytes()),
+                 FakeUpload("bad.png", b"not an image")]
+
+        async def collect():
+            return [page async for page in prepare_pages(files, workers=2)]
+
+        with self.assertRaisesRegex(ValueError, "bad.png"):
+            asyncio.run(collect())
+
+    def test_truncated_headers_are_invalid_images(self):
+        for contents in (b"\x89PNG\r\n\x1a\nbad", b"\xff\xd8\xff\xc0\x00\x11\x08"):
+            with self.assertRaisesRegex(ValueError, "Invalid image"):
+                prepare_page(contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
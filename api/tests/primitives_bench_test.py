@@ -0,0 +1,31 @@
+import unittest
+import numpy as np
+from benchmarks.primitives_bench import compare, make_scene, measure
+
+
+class TestPrimitivesBench(unittest.TestCase):
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        baseline = {"a@3MP": {"time_ms": 10.0, "peak_kb": 1000.0}, "b@3MP": {"time_ms": 10.0, "peak_kb": 1000.0},
+                    "c@quad": {"time_ms": 0.01, "peak_kb": 4.0}}
+        results = {"a@3MP": {"time_ms": 11.0, "peak_kb": 1050.0},  # Within 20% and 10%
+                   "b@3MP": {"time_ms": 10.0, "peak_kb": 1200.0},  # Memory regressed
+                   "c@quad": {"time_ms": 0.03, "peak_kb": 8.0},  # Slower, but below the noise floor
+                   "d@500px": {"time_ms": 1.0, "peak_kb": 1.0}}
+        report = compare(results, baseline, tolerance=0.2, memory_tolerance=0.1)
+        self.assertEqual({key: case["status"] for key, case in report.items()},
+                         {"a@3MP": "ok", "b@3MP": "regressed", "c@quad": "ok", "d@500px": "new"})
+        self.assertAlmostEqual(report["a@3MP"]["time_ratio"], 1.1)
+        results["a@3MP"]["time_ms"] = 12.5
+        self.assertEqual(compare(results, baseline, 0.2, 0.1)["a@3MP"]["status"], "regressed")
+
+    def test_measure(self):
+        image, corners = make_scene(200, 150)
+        self.assertEqual((image.shape, corners.shape), ((150, 200, 3), (4, 2)))
+        result = measure(np.zeros, (256, 1024), repeat=1)
+        self.assertGreater(result["time_ms"], 0)
+        self.assertGreaterEqual(result["peak_kb"], 2048)  # The float64 array is traced
+
+
+if __name__ == '__main__':
+    unittest.main()
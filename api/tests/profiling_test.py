@@ -0,0 +1,136 @@
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+import profiling
+from profiling import PROFILE_MODES, ProfileStore, ProfilingMiddleware, StackSampler
+from v1.endpoints import profiles
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestStackSampler(unittest.TestCase):
+
+    def test_samples_other_threads(self):
+        sampler = StackSampler(interval=0.001)
+        sampler.start()
+        worker = threading.Thread(target=busy_loop, args=(0.1,), name="busy")
+        worker.start()
+        worker.join()
+        sampler.stop()
+        busy = [line for line in sampler.collapsed().splitlines() if line.startswith("busy;")]
+        self.assertTrue(busy)
+        self.assertTrue(all("busy_loop (profiling_test.py:" in line for line in busy))
+        self.assertGreater(sampler.samples, 0)
+
+
+class TestProfileStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = ProfileStore(self.tmpdir, max_files=2, min_interval=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_only_the_newest_profiles_are_kept(self):
+        names = []
+        for i in range(3):
+            name = self.store.new_name("/process-image/", "sample")
+            self.store.write(name, profiling._write_text("a;b %d\n" % i))
+            os.utime(self.store.path(name), (1000 + i, 1000 + i))
+            names.append(name)
+        self.store.write(self.store.new_name("/ocr/", "sample"), profiling._write_text("c 1\n"))
+        self.assertEqual(len(self.store.list()), 2)
+        self.assertNotIn(names[0], [profile["name"] for profile in self.store.list()])
+
+    def test_rate_limit_is_shared_through_the_directory(self):
+        self.assertTrue(self.store.acquire())
+        self.assertFalse(ProfileStore(self.tmpdir, min_interval=60).acquire())
+        self.assertTrue(ProfileStore(self.tmpdir, min_interval=0).acquire())
+
+    def test_names_are_validated(self):
+        self.assertTrue(self.store.new_name("/pdfs/{id}/pages", "cprofile").endswith("-pdfs-id-pages.pstats"))
+        with self.assertRaises(ValueError):
+            self.store.path("../secret.collapsed")
+
+
+@mock.patch.object(profiling, "PROFILING_TOKEN", "secret")
+class TestProfilingMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = ProfileStore(self.tmpdir, max_files=5, min_interval=60)
+        app = FastAPI()
+
+        self.loop_threads = set()
+
+        @app.get("/work")
+        async def work():
+            self.loop_threads.add(threading.get_ident())
+            await run_in_threadpool(busy_loop, 0.05)
+            return {}
+
+        app.include_router(profiles.router)
+        app.add_middleware(ProfilingMiddleware, store=self.store)
+        self.client = TestClient(app)
+        self.patch = mock.patch.object(profiles, "profile_store", self.store)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_profiles_requests_with_the_token(self):
+        self.assertNotIn("x-profile-id", self.client.get("/work", headers={"X-Profile-Token": "wrong"}).headers)
+        self.assertEqual(self.store.list(), [])
+
+        response = self.client.get("/work", headers={"X-Profile-Token": "secret"})
+        name = response.headers["x-profile-id"]
+        self.assertTrue(name.endswith("-work.collapsed"))
+        profile = self.client.get(f"/profiles/{name}", headers={"X-Profile-Token": "secret"}).text
+        self.assertIn("busy_loop", profile)
+
+        # Rate limited until `min_interval` has passed
+        response = self.client.get("/work?profile_token=secret")
+        self.assertEqual(response.headers["x-profile-status"], "rate-limited")
+        self.assertEqual(len(self.store.list()), 1)
+
+    def test_cprofile_mode(self):
+        response = self.client.get("/work", headers={"X-Profile-Token": "secret", "X-Profile-Mode": "cprofile"})
+        stats = pstats.Stats(self.store.path(response.headers["x-profile-id"]))
+        self.assertTrue(any(func[2] == "work" for func in stats.stats))
+
+    def test_lock_and_writes_stay_off_the_event_loop(self):
+        threads = []
+        for method in ("acquire", "write"):
+            original = getattr(self.store, method)
+            def record(*args, original=original):
+                threads.append(threading.get_ident())
+                return original(*args)
+            setattr(self.store, method, record)
+        for mode in PROFILE_MODES:
+            self.store.min_interval = 0
+            self.client.get("/work", headers={"X-Profile-Token": "secret", "X-Profile-Mode": mode})
+        self.assertEqual(len(threads), 4)
+        self.assertFalse(self.loop_threads & set(threads))
+
+    def test_profiles_require_the_token(self):
+        self.assertEqual(self.client.get("/profiles").status_code, 403)
+        self.assertEqual(self.client.get("/profiles", headers={"X-Profile-Token": "secret"}).json(), [])
+        self.assertEqual(self.client.get("/profiles/x.collapsed", headers={"X-Profile-Token": "secret"}).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+from search_index import SearchIndex, build_match_query
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = SearchIndex(os.path.join(self.tmpdir, "index.sqlite3"))
+        self.index.index_page("alice", "doc1", 0, "Invoice number 42 for office supplies")
+        self.index.index_page("alice", "doc1", 1, "Payment terms: thirty days")
+        self.index.index_page("alice", "doc2", 0, "Inventory of the office, inventory list")
+        self.index.index_page("bob", "doc3", 0, "Invoice for bob")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_build_match_query_quotes_words(self):
+        self.assertEqual(build_match_query("u1", 'inv* "office" OR -x'),
+                         'user_id : "u1" AND text : ("inv"* AND "office" AND "OR" AND "x")')
+        self.assertIsNone(build_match_query("u1", " ** "))
+
+    def test_search_is_scoped_to_user(self):
+        result = self.index.search("alice", "invoice")
+        self.assertEqual(result["total"], 1)
+        self.assertEqual(result["results"][0]["document_id"], "doc1")
+        self.assertIn("[Invoice]", result["results"][0]["snippet"])
+        self.assertEqual(self.index.search("bob", "office")["total"], 0)
+
+    def test_prefix_query_and_ranking(self):
+        result = self.index.search("alice", "inv*")
+        self.assertEqual(result["total"], 2)
+        # "inventory" occurs twice on doc2, so it ranks first
+        self.assertEqual([r["document_id"] for r in result["results"]], ["doc2", "doc1"])
+        self.assertGreater(result["results"][0]["score"], result["results"][1]["score"])
+
+    def test_pagination(self):
+        first = self.index.search("alice", "inv*", limit=1, offset=0)
+        second = self.index.search("alice", "inv*", limit=1, offset=1)
+        self.assertEqual(first["total"], 2)
+        self.assertNotEqual(first["results"][0]["document_id"], second["results"][0]["document_id"])
+
+    def test_reindex_and_delete(self):
+        self.index.index_page("alice", "doc1", 0, "Receipt")
+        self.assertEqual(self.index.search("alice", "invoice")["total"], 0)
+        self.assertEqual(self.index.search("alice", "receipt")["total"], 1)
+        self.assertEqual(self.index.delete_document("alice", "doc1"), 2)
+        self.assertEqual(self.index.search("alice", "receipt")["total"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+import cv2
+from pdf_utils import array_image, png_image, bilevel_image, mixed_raster_image
+from thumbnails import decode_reduced, make_thumbnail, decode_pdf_image, render_page_thumbnail, ThumbnailCache
+
+
+def make_page():
+    page = np.full((400, 300, 3), 255, np.uint8)
+    page[:, :, 0] = 200  # Tinted paper
+    cv2.putText(page, "Hello", (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 120), 6)
+    return page
+
+
+class TestThumbnails(unittest.TestCase):
+
+    def test_jpeg_is_decoded_reduced(self):
+        jpeg = cv2.imencode('.jpg', np.full((1600, 1200, 3), 90, np.uint8))[1].tobytes()
+        self.assertEqual(decode_reduced(jpeg, 128).shape, (200, 150, 3))  # 1/8 still covers 128 px
+        self.assertEqual(decode_reduced(jpeg, 512).shape, (800, 600, 3))
+        thumbnail = cv2.imdecode(np.frombuffer(make_thumbnail(jpeg, 256), np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(thumbnail.shape, (256, 192, 3))
+        with self.assertRaises(ValueError):
+            make_thumbnail(b"not an image", 128)
+
+    def test_decode_pdf_images(self):
+        page = make_page()
+        gray = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY)
+        np.testing.assert_array_equal(decode_pdf_image(array_image(page), 128), page)
+        np.testing.assert_array_equal(decode_pdf_image(png_image(cv2.imencode('.png', page)[1].tobytes()), 128), page)
+        ink = decode_pdf_image(bilevel_image(gray), 128) == 0
+        np.testing.assert_array_equal(ink, gray < 128)
+
+    def test_mixed_raster_thumbnail_shows_text(self):
+        page = make_page()
+        thumbnail = cv2.imdecode(np.frombuffer(render_page_thumbnail(mixed_raster_image(page), 128), np.uint8),
+                                 cv2.IMREAD_COLOR)
+        expected = cv2.resize(page, (96, 128), interpolation=cv2.INTER_AREA)
+        self.assertEqual(thumbnail.shape, expected.shape)
+        self.assertLess(np.abs(thumbnail.astype(int) - expected).mean(), 5)
+
+
+class TestThumbnailCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ThumbnailCache(self.tmpdir, max_bytes=250)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_least_recently_read_is_evicted(self):
+        self.assertIsNone(self.cache.get("aa" * 8, 128))
+        self.cache.put("aa" * 8, 128, b"a" * 100)
+        self.cache.put("bb" * 8, 128, b"b" * 100)
+        past = time.time() - 60
+        os.utime(self.cache.path("aa" * 8, 128), (past, past))
+        os.utime(self.cache.path("bb" * 8, 128), (past - 60, past - 60))
+        self.assertEqual(self.cache.get("bb" * 8, 128), b"b" * 100)  # Refreshes bb
+        self.cache.put("cc" * 8, 128, b"c" * 100)
+        self.assertIsNone(self.cache.get("aa" * 8, 128))
+        self.assertIsNotNone(self.cache.get("bb" * 8, 128))
+        self.assertIsNotNone(self.cache.get("cc" * 8, 128))
+
+    def test_keys_are_validated(self):
+        with self.assertRaises(ValueError):
+            self.cache.path("../etc/passwd", 128)
+        self.assertTrue(self.cache.path("ab" * 32 + ".3", 512).endswith(".3-512.jpg"))
+
+
+if __name__ == '__main__':
+    unittest.main()
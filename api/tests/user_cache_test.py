@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from user_cache import MemoryUserCache, SqliteUserCache, make_user_cache
+
+ALICE = {"id": "u1", "email": "alice@example.com", "username": "alice", "token": None}
+BOB = {"id": "u2", "email": "bob@example.com", "username": "bob", "token": None}
+
+
+class UserCacheTests:
+
+    def test_get_put_and_invalidate(self):
+        self.assertIsNone(self.cache.get("t1"))
+        self.cache.put("t1", ALICE)
+        self.cache.put("t2", ALICE)
+        self.cache.put("t3", BOB)
+        self.assertEqual(self.cache.get("t1"), ALICE)
+
+        self.cache.invalidate_user("u1")
+        self.assertIsNone(self.cache.get("t1"))
+        self.assertIsNone(self.cache.get("t2"))
+        self.assertEqual(self.cache.get("t3"), BOB)
+
+    def test_entries_expire_with_the_token(self):
+        self.cache.put("t1", ALICE, expires_at=time.time() - 1)
+        self.assertIsNone(self.cache.get("t1"))
+
+    def test_size_is_bounded(self):
+        for i in range(5):
+            self.cache.put("t%d" % i, ALICE)
+        self.assertIsNone(self.cache.get("t0"))
+        self.assertEqual(self.cache.get("t4"), ALICE)
+
+
+class TestMemoryUserCache(UserCacheTests, unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MemoryUserCache(ttl=60, max_entries=3)
+
+
+class TestSqliteUserCache(UserCacheTests, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = SqliteUserCache(os.path.join(self.tmpdir, "users.sqlite3"), ttl=60, max_entries=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_invalidation_is_shared(self):
+        other_worker = SqliteUserCache(self.cache.path, ttl=60)
+        self.cache.put("t1", ALICE)
+        self.assertEqual(other_worker.get("t1"), ALICE)
+        other_worker.invalidate_user("u1")
+        self.assertIsNone(self.cache.get("t1"))
+
+
+class TestMakeUserCache(unittest.TestCase):
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            make_user_cache("redis")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
+import asyncio
+import os
 import unittest
+from unittest import mock
 import numpy as np
 import cv2
-from v1.endpoints.users import apply_grayscale, apply_sepia, apply_invert, bgr_to_grayscale, read_image_with_pil, bilinear_interpolate, gaussian_kernel, vectorized_gaussian_blur, draw_contours, draw_line, enhance_image_cv, rotate_image_cv, four_point_transform, pre_process
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+import passwords
+from db.schemas.user_schema import UserCreate
+from v1.endpoints.users import create_user, read_user, apply_grayscale, apply_sepia, apply_invert, bgr_to_grayscale, read_image_with_pil, bilinear_interpolate, gaussian_kernel, vectorized_gaussian_blur, draw_contours, draw_line, enhance_image_cv, rotate_image_cv, four_point_transform, pre_process
 
 
 class TestImageProcessing(unittest.TestCase):
@@ -95,5 +103,58 @@ class TestImageProcessing(unittest.TestCase):
         self.assertEqual(rotated_image.shape, self.sample_image.shape)  # Rotated image should maintain the same size and number of channels
 
 
+class FakeUsers:
+    # Records every call as one database round trip and enforces the unique email index
+    def __init__(self):
+        self.documents = []
+        self.calls = []
+
+    async def insert_one(self, document):
+        self.calls.append("insert_one")
+        if any(doc["email"] == document["email"] for doc in self.documents):
+            raise DuplicateKeyError("E11000 duplicate key error")
+        document = dict(document, _id=ObjectId())
+        self.documents.append(document)
+        return mock.Mock(inserted_id=document["_id"])
+
+    async def find_one(self, query, projection=None):
+        self.calls.append(("find_one", projection))
+        doc = next((doc for doc in self.documents if all(doc.get(k) == v for k, v in query.items())), None)
+        if doc is None or projection is None:
+            return doc
+        return {k: v for k, v in doc.items() if k == "_id" or projection.get(k)}
+
+
+@mock.patch.object(passwords, "BCRYPT_ROUNDS", 4)
+@mock.patch.dict(os.environ, {"JWT_SECRET": "test-secret-with-enough-length-for-hs256"})
+class TestUserQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.users = FakeUsers()
+        self.db = {"users": self.users}
+
+    def test_signup_is_one_round_trip(self):
+        user = asyncio.run(create_user(UserCreate(email="a@example.com", password="secret", username="a"), db=self.db))
+        self.assertEqual(self.users.calls, ["insert_one"])
+        self.assertEqual((user.email, user.username), ("a@example.com", "a"))
+        self.assertEqual(user.id, str(self.users.documents[0]["_id"]))
+        self.assertTrue(user.token)
+
+    def test_duplicate_signup_is_rejected(self):
+        request = UserCreate(email="a@example.com", password="secret", username="a")
+        asyncio.run(create_user(request, db=self.db))
+        with self.assertRaises(HTTPException) as raised:
+            asyncio.run(create_user(request, db=self.db))
+        self.assertEqual(raised.exception.status_code, 400)
+
+    def test_read_user_does_not_fetch_password(self):
+        created = asyncio.run(create_user(UserCreate(email="a@example.com", password="secret", username="a"), db=self.db))
+        user = asyncio.run(read_user(created.id, db=self.db))
+        self.assertEqual(user.email, "a@example.com")
+        self.assertNotIn("password", self.users.calls[-1][1])
+        with self.assertRaises(HTTPException):
+            asyncio.run(read_user("not-an-id", db=self.db))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,283 @@
+import os
+import re
+import struct
+import tempfile
+import zlib
+from io import BytesIO
+
+import numpy as np
+
+from lazy_imports import lazy_import
+from pdf_utils import PNG_SIGNATURE, jpeg_image
+
+cv2 = lazy_import("cv2")
+Image = lazy_import("PIL.Image")
+
+THUMBNAIL_SIZES = (128, 256, 512)
+THUMBNAIL_CACHE_PATH = os.getenv("THUMBNAIL_CACHE_PATH", "thumbnail_cache")
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+THUMBNAIL_QUALITY = 80
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 of the size by skipping DCT coefficients
+_REDUCED_FLAGS = ((8, "IMREAD_REDUCED_COLOR_8"), (4, "IMREAD_REDUCED_COLOR_4"), (2, "IMREAD_REDUCED_COLOR_2"))
+
+def decode_reduced(contents, size):
+    """
+    Decodes an image at the smallest resolution that still covers `size` pixels.
+
+    JPEG files are decoded with DCT scaling, which is several times faster than a
+    full decode: a 12 MP photo decoded for a 256 px preview only produces 500x375
+    pixels. Other formats are decoded in full.
+
+    Args:
+        contents (bytes): The encoded image.
+        size (int): The longer side the image will be resized to.
+
+    Raises:
+        ValueError: If the data is not a readable image.
+
+    Returns:
+        np.ndarray: The decoded image in BGR format.
+    """
+    flags = cv2.IMREAD_COLOR
+    if contents[:2] == b"\xff\xd8":
+        try:
+            info = jpeg_image(contents)
+        except ValueError:
+            info = None
+        if info is not None:
+            longer = max(info["width"], info["height"])
+            flags = next((getattr(cv2, flag) for factor, flag in _REDUCED_FLAGS if longer / factor >= size), flags)
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), flags)
+    if image is None:
+        raise ValueError("Invalid image")
+    return image
+
+def fit_thumbnail(image, size):
+    """
+    Shrinks an image so that its longer side is at most `size` pixels.
+
+    Args:
+        image (np.ndarray): The image.
+        size (int): The maximum length of the longer side.
+
+    Returns:
+        np.ndarray: The shrunk image, or the image itself if it is small enough.
+    """
+    scale = size / max(image.shape[:2])
+    if scale >= 1:
+        return image
+    width, height = max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale))
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+def encode_thumbnail(image):
+    """
+    Encodes a thumbnail as a JPEG file.
+    """
+    success, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    if not success:
+        raise ValueError("Failed to encode thumbnail")
+    return encoded.tobytes()
+
+def make_thumbnail(contents, size):
+    """
+    Creates a JPEG preview of an uploaded image.
+
+    Args:
+        contents (bytes): The encoded image.
+        size (int): The longer side of the preview in pixels.
+
+    Raises:
+        ValueError: If the data is not a readable image.
+
+    Returns:
+        bytes: The JPEG preview.
+    """
+    return encode_thumbnail(fit_thumbnail(decode_reduced(contents, size), size))
+
+def _g4_tiff(data, width, height):
+    """
+    Wraps a CCITT Group 4 strip in a minimal TIFF file so that Pillow can decode it.
+    """
+    entries = [(256, 4, width), (257, 4, height), (258, 3, 1), (259, 3, 4), (262, 3, 0),
+               (273, 4, 8 + 2 + 12 * 9 + 4), (277, 3, 1), (278, 4, height), (279, 4, len(data))]
+    ifd = struct.pack("<H", len(entries))
+    ifd += b"".join(struct.pack("<HHII", tag, kind, 1, value) for tag, kind, value in entries)
+    return b"II*\x00" + struct.pack("<I", 8) + ifd + struct.pack("<I", 0) + data
+
+def decode_pdf_image(image, size):
+    """
+    Decodes an image dictionary read back from a PDF with `pdf_utils.read_page_image`.
+
+    Args:
+        image (dict): The image dictionary.
+        size (int): The longer side the image will be resized to, for reduced JPEG decoding.
+
+    Raises:
+        ValueError: If the image uses an encoding `PdfWriter` does not produce.
+
+    Returns:
+        np.ndarray: A BGR or grayscale image. For 1-bit images, 0 bits are 0 and 1 bits are 255.
+    """
+    width, height = image["width"], image["height"]
+    if image["filter"] == "/DCTDecode":
+        return decode_reduced(image["data"], size)
+    if image["filter"] == "/CCITTFaxDecode":
+        with Image.open(BytesIO(_g4_tiff(image["data"], width, height))) as tiff:
+            return np.asarray(tiff.convert("L"))
+    if image["filter"] != "/FlateDecode":
+        raise ValueError("Unsupported image filter %s" % image["filter"])
+
+    colors = 1 if image.get("image_mask") or image.get("color_space") == "/DeviceGray" else 3
+    if "Predictor" in image.get("decode_parms", ""):
+        # The data is a PNG IDAT stream; give it back its PNG header
+        color_type = 0 if colors == 1 else 2
+        ihdr = struct.pack(">IIBBBBB", width, height, image["bits"], color_type, 0, 0, 0)
+        chunks = [(b"IHDR", ihdr), (b"IDAT", image["data"]), (b"IEND", b"")]
+        png = PNG_SIGNATURE + b"".join(
+            struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body)) for kind, body in chunks)
+        decoded = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_UNCHANGED)
+        if decoded is None:
+            raise ValueError("Invalid PNG image data")
+        return decoded
+
+    raw = np.frombuffer(zlib.decompress(image["data"]), np.uint8)
+    if image["bits"] == 1:
+        return np.unpackbits(raw.reshape(height, -1), axis=1)[:, :width] * np.uint8(255)
+    pixels = raw.reshape(height, width, colors)
+    return pixels[:, :, 0] if colors == 1 else cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+
+def render_page_thumbnail(image, size):
+    """
+    Renders a JPEG preview of a PDF page from its image dictionary.
+
+    Mixed raster pages are composited: the stencil mask is shrunk to ink coverage and
+    painted in its colour over the background, as a PDF viewer would.
+
+    Args:
+        image (dict): The page's image dictionary from `pdf_utils.read_page_image`.
+        size (int): The longer side of the preview in pixels.
+
+    Returns:
+        bytes: The JPEG preview.
+    """
+    grid = image.get("mask") or image
+    scale = min(1.0, size / max(grid["width"], grid["height"]))
+    target = (max(1, round(grid["width"] * scale)), max(1, round(grid["height"] * scale)))
+
+    page = decode_pdf_image(image, size)
+    if page.ndim == 2:
+        page = cv2.cvtColor(page, cv2.COLOR_GRAY2BGR)
+    page = cv2.resize(page, target, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    mask = image.get("mask")
+    if mask:
+        coverage = 1.0 - cv2.resize(decode_pdf_image(mask, size), target, interpolation=cv2.INTER_AREA) / 255.0
+        color = np.array(mask["color"][::-1], np.float32) * 255.0
+        page = page * (1.0 - coverage[:, :, None]) + color * coverage[:, :, None]
+    return encode_thumbnail(np.clip(page, 0, 255).astype(np.uint8))
+
+class ThumbnailCache:
+    """
+    A size-bounded on-disk cache of thumbnails keyed by the content hash of their source.
+
+    Sources are identified by content, so a cached thumbnail never goes stale and can
+    be served with long-lived cache headers. Reading a thumbnail refreshes its
+    modification time; when the cache grows beyond `max_bytes`, the files that were
+    read least recently are removed. Several workers can share the directory.
+
+    Attributes:
+        root (str): The cache directory.
+        max_bytes (int): The total size of thumbnails above which old ones are evicted.
+    """
+
+    def __init__(self, root=THUMBNAIL_CACHE_PATH, max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._bytes = None
+
+    def path(self, key, size):
+        """
+        Returns the cache file of the thumbnail of `key` at `size` pixels.
+
+        Raises:
+            ValueError: If `key` is not a hex digest, optionally followed by "." and a page number.
+        """
+        if not re.fullmatch(r"[0-9a-f]{16,128}(\.\d+)?", key):
+            raise ValueError("Invalid thumbnail key")
+        return os.path.join(self.root, "%s-%d.jpg" % (key, size))
+
+    def get(self, key, size):
+        """
+        Looks up a cached thumbnail and marks it as recently used.
+
+        Args:
+            key (str): The hex content hash of the source image or document.
+            size (int): The thumbnail size.
+
+        Returns:
+            bytes: The JPEG thumbnail, or None on a miss.
+        """
+        path = self.path(key, size)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, size, data):
+        """
+        Stores a thumbnail and evicts least recently used ones beyond `max_bytes`.
+
+        Args:
+            key (str): The hex content hash of the source image or document.
+            size (int): The thumbnail size.
+            data (bytes): The JPEG thumbnail.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(key, size)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".jpg", dir=self.root)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        if self._bytes is None:
+            self._bytes = sum(entry[1] for entry in self._entries())
+        else:
+            self._bytes += len(data)
+        if self._bytes > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        """
+        Lists the cached files as (path, size, mtime) tuples.
+        """
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".jpg") and not entry.name.startswith("."):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        """
+        Removes the least recently used thumbnails until the cache fits in `max_bytes`.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._bytes = total
+
+thumbnail_cache = ThumbnailCache()
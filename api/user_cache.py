@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# "memory" keeps the cache in each worker; "sqlite" shares it between the workers of a host
+USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "memory")
+USER_CACHE_PATH = os.getenv("USER_CACHE_PATH", "user_cache.sqlite3")
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000))
+
+def token_key(token):
+    """
+    Returns the cache key of a bearer token, so that raw tokens are never stored.
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+class MemoryUserCache:
+    """
+    A bounded in-process cache of verified tokens and the users they belong to.
+
+    Entries expire after `ttl` seconds, or earlier when the token does, and the least
+    recently used entries are dropped beyond `max_entries`. An index from user id to
+    tokens lets all of a user's entries be invalidated at once. Invalidation only
+    reaches the current worker; other workers pick up changes within `ttl` seconds.
+
+    Attributes:
+        ttl (float): The maximum age of an entry in seconds.
+        max_entries (int): The maximum number of cached tokens.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """
+        Returns the cached user of a token.
+
+        Args:
+            token (str): The bearer token.
+
+        Returns:
+            dict: The user's fields, or None on a miss or if the entry expired.
+        """
+        key = token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def put(self, token, user, expires_at=None):
+        """
+        Caches the user a verified token belongs to.
+
+        Args:
+            token (str): The bearer token.
+            user (dict): The user's fields, including its "id".
+            expires_at (float, optional): The token's own expiry as a UNIX timestamp. Defaults to None.
+        """
+        key = token_key(token)
+        expires_at = min(time.time() + self.ttl, expires_at or float("inf"))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (user, expires_at)
+            self._by_user.setdefault(user["id"], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """
+        Drops every cached token of a user, e.g. after the user's data changed.
+
+        Args:
+            user_id (str): The user's id.
+        """
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_user.get(entry[0]["id"])
+            keys.discard(key)
+            if not keys:
+                del self._by_user[entry[0]["id"]]
+
+class SqliteUserCache:
+    """
+    A user cache shared by the workers of one host through a SQLite database.
+
+    It has the same interface and expiry rules as `MemoryUserCache`, and invalidating
+    a user in one worker takes effect in all of them. Lookups ignore expired entries,
+    which are purged whenever the cache grows beyond `max_entries`.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+        ttl (float): The maximum age of an entry in seconds.
+        max_entries (int): The number of entries above which expired and old entries are purged.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS user_cache (
+        key TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        user TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS user_cache_user_id ON user_cache (user_id);
+    CREATE INDEX IF NOT EXISTS user_cache_expires_at ON user_cache (expires_at);
+    """
+
+    def __init__(self, path=USER_CACHE_PATH, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connect(self):
+        """
+        Returns this thread's connection, creating the database on first use.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self._SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, token):
+        row = self._connect().execute("SELECT user FROM user_cache WHERE key = ? AND expires_at > ?",
+                                      (token_key(token), time.time())).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, token, user, expires_at=None):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO user_cache (key, user_id, user, expires_at) VALUES (?, ?, ?, ?)",
+                     (token_key(token), user["id"], json.dumps(user), min(now + self.ttl, expires_at or float("inf"))))
+        if conn.execute("SELECT COUNT(*) FROM user_cache").fetchone()[0] > self.max_entries:
+            conn.execute("DELETE FROM user_cache WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM user_cache WHERE key IN (SELECT key FROM user_cache ORDER BY expires_at "
+                         "LIMIT max(0, (SELECT COUNT(*) FROM user_cache) - ?))", (self.max_entries,))
+
+    def invalidate_user(self, user_id):
+        self._connect().execute("DELETE FROM user_cache WHERE user_id = ?", (user_id,))
+
+def make_user_cache(backend=USER_CACHE_BACKEND):
+    """
+    Creates the user cache selected by `USER_CACHE_BACKEND`.
+
+    Args:
+        backend (str, optional): "memory" or "sqlite". Defaults to `USER_CACHE_BACKEND`.
+
+    Raises:
+        ValueError: If the backend is unknown.
+
+    Returns:
+        MemoryUserCache | SqliteUserCache: The cache.
+    """
+    if backend == "memory":
+        return MemoryUserCache()
+    if backend == "sqlite":
+        return SqliteUserCache()
+    raise ValueError("Unknown user cache backend: %s" % backend)
+
+user_cache = make_user_cache()
@@ -1,5 +1,7 @@
 import cv2
 import numpy as np
+
+import corners
  
 ## TO STACK ALL THE IMAGES IN ONE WINDOW
 def stackImages(imgArray,scale,lables=[]):
@@ -39,18 +41,8 @@ def stackImages(imgArray,scale,lables=[]):
     return ver
  
 def reorder(myPoints):
- 
-    myPoints = myPoints.reshape((4, 2))
-    myPointsNew = np.zeros((4, 1, 2), dtype=np.int32)
-    add = myPoints.sum(1)
- 
-    myPointsNew[0] = myPoints[np.argmin(add)]
-    myPointsNew[3] =myPoints[np.argmax(add)]
-    diff = np.diff(myPoints, axis=1)
-    myPointsNew[1] =myPoints[np.argmin(diff)]
-    myPointsNew[2] = myPoints[np.argmax(diff)]
- 
-    return myPointsNew
+    # Top-left, top-right, bottom-left, bottom-right as int32 (4, 1, 2)
+    return corners.reorder(myPoints.reshape((1, 4, 2)))[0]
  
  
 def biggestContour(contours):
@@ -0,0 +1,199 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from bson import ObjectId
+import base64
+import datetime
+import json
+from db.mongodb_utils import get_db
+from db.schemas.document_schema import Document, DocumentCreate, DocumentPage
+from db.schemas.user_schema import User
+from pdf_store import pdf_store
+from thumbnails import THUMBNAIL_SIZES
+from .users import get_current_user
+
+router = APIRouter()
+
+# The fields returned by the listing; `user_id` is implied by the query
+DOCUMENT_FIELDS = {"name": 1, "pdf_id": 1, "pages": 1, "size": 1, "ocr_status": 1, "thumbnails": 1, "created_at": 1}
+
+# The listing order; it matches the `user_created` index in `db.mongodb_utils.INDEXES`
+DOCUMENT_SORT = [("created_at", -1), ("_id", -1)]
+
+def encode_cursor(document):
+    """
+    Encodes the sort key of the last document of a page as an opaque cursor.
+
+    Args:
+        document (dict): The document as read from MongoDB.
+
+    Returns:
+        str: A URL-safe cursor.
+    """
+    key = {"t": document["created_at"].isoformat(), "i": str(document["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor from `encode_cursor`.
+
+    Args:
+        cursor (str): The cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+
+    Returns:
+        tuple: The creation time and id of the last document of the previous page.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.datetime.fromisoformat(key["t"]), ObjectId(key["i"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def keyset_filter(user_id, cursor=None):
+    """
+    Builds the query of one page of a user's documents, newest first.
+
+    Instead of skipping the documents of earlier pages, the query starts right after
+    the last document of the previous page. With the `(user_id, created_at, _id)`
+    index every page is a single index range scan, so page 500 is as fast as page 1.
+
+    Args:
+        user_id (str): The owner of the documents.
+        cursor (str, optional): The cursor of the previous page. Defaults to None for the first page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+
+    Returns:
+        dict: The MongoDB filter.
+    """
+    query = {"user_id": user_id}
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}},
+        ]
+    return query
+
+def to_document(document):
+    """
+    Converts a MongoDB document to the `Document` response model.
+    """
+    return Document(id=str(document["_id"]), **{k: v for k, v in document.items() if k != "_id"})
+
+@router.post("/documents/", response_model=Document)
+async def create_document(request: DocumentCreate, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    """
+    Adds a saved PDF to the user's document catalogue.
+
+    The page count, size and OCR status are taken from the PDF store, and thumbnail
+    URLs are recorded for each preview size.
+
+    Args:
+        request (DocumentCreate): The PDF id and the document name.
+        current_user (User): The currently authenticated user, obtained through dependency.
+        db: Database dependency, injected by FastAPI.
+
+    Raises:
+        HTTPException: If the PDF does not exist.
+
+    Returns:
+        Document: The new catalogue entry.
+    """
+    metadata = await pdf_store.metadata(request.pdf_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="PDF not found")
+
+    # MongoDB stores milliseconds; truncating here keeps cursors exact
+    now = datetime.datetime.utcnow()
+    document = {
+        "user_id": current_user.id,
+        "name": request.name,
+        "pdf_id": request.pdf_id,
+        "pages": metadata["pages"],
+        "size": metadata["size"],
+        "ocr_status": "done" if metadata.get("searchable") else "none",
+        "thumbnails": {str(size): f"/pdfs/{request.pdf_id}/thumbnail?size={size}" for size in THUMBNAIL_SIZES},
+        "created_at": now.replace(microsecond=now.microsecond // 1000 * 1000),
+    }
+    result = await db["documents"].insert_one(document)
+    document["_id"] = result.inserted_id
+    return to_document(document)
+
+@router.get("/documents/", response_model=DocumentPage)
+async def list_documents(cursor: str = Query(default=None), limit: int = Query(default=20, ge=1, le=100), current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    """
+    Lists the user's documents, newest first, one page at a time.
+
+    Pages are addressed by cursor rather than by offset: pass the `next_cursor` of a
+    response to get the following page.
+
+    Args:
+        cursor (str): The `next_cursor` of the previous page. Defaults to the first page.
+        limit (int): The number of documents per page, at most 100. Defaults to 20.
+        current_user (User): The currently authenticated user, obtained through dependency.
+        db: Database dependency, injected by FastAPI.
+
+    Raises:
+        HTTPException: If the cursor is malformed.
+
+    Returns:
+        DocumentPage: The documents and the cursor of the next page.
+    """
+    try:
+        query = keyset_filter(current_user.id, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # One extra document tells whether there is a next page
+    documents = await db["documents"].find(query, DOCUMENT_FIELDS).sort(DOCUMENT_SORT).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return DocumentPage(documents=[to_document(document) for document in documents[:limit]], next_cursor=next_cursor)
+
+@router.get("/documents/{document_id}", response_model=Document)
+async def read_document(document_id: str, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    """
+    Retrieves one of the user's documents.
+
+    Args:
+        document_id (str): The id of the catalogue entry.
+        current_user (User): The currently authenticated user, obtained through dependency.
+        db: Database dependency, injected by FastAPI.
+
+    Raises:
+        HTTPException: If the user has no document with this id.
+
+    Returns:
+        Document: The catalogue entry.
+    """
+    if not ObjectId.is_valid(document_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    document = await db["documents"].find_one({"_id": ObjectId(document_id), "user_id": current_user.id}, DOCUMENT_FIELDS)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return to_document(document)
+
+@router.delete("/documents/{document_id}")
+async def delete_document(document_id: str, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    """
+    Removes a document from the user's catalogue. The PDF itself stays in the PDF store.
+
+    Args:
+        document_id (str): The id of the catalogue entry.
+        current_user (User): The currently authenticated user, obtained through dependency.
+        db: Database dependency, injected by FastAPI.
+
+    Raises:
+        HTTPException: If the user has no document with this id.
+
+    Returns:
+        dict: A message indicating the document was deleted.
+    """
+    if not ObjectId.is_valid(document_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    result = await db["documents"].delete_one({"_id": ObjectId(document_id), "user_id": current_user.id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"message": "Document deleted"}
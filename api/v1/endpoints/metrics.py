@@ -0,0 +1,20 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+import metrics
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """
+    Returns this worker's request, stage timing and image size metrics for Prometheus.
+
+    Raises:
+        HTTPException: If metrics are disabled with `METRICS_ENABLED=false`.
+
+    Returns:
+        PlainTextResponse: The metrics in the Prometheus text exposition format.
+    """
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
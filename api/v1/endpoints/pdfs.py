@@ -0,0 +1,234 @@
+from fastapi import APIRouter, HTTPException, Request, File, UploadFile, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import List
+import functools
+from lazy_imports import lazy_import
+from blob_store import byte_range
+from pdf_store import pdf_store, etag_matches
+from pdf_utils import PdfUpdater, prepare_pages, read_pdf_structure, read_page_image, stream_pdf
+from thumbnails import THUMBNAIL_SIZES, render_page_thumbnail, thumbnail_cache
+
+pytesseract = lazy_import("pytesseract")
+
+router = APIRouter()
+
+# Stored PDFs never change, so clients may keep them as long as they like
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+@router.api_route("/pdfs/{document_id}", methods=["GET", "HEAD"])
+async def download_pdf(document_id: str, request: Request):
+    """
+    Downloads a stored PDF.
+
+    The document id identifies immutable contents and doubles as the ETag, so a client
+    that sends it back in `If-None-Match` gets an empty 304 response. It is the
+    SHA-256 of the file, except for documents made by `add_pdf_pages` and stored as an
+    update, whose id is the SHA-256 of their base's id followed by the update's bytes;
+    see `pdf_store.PdfStore`. `Range` requests
+    are answered with 206 partial content for resumable downloads. PDFs on the local
+    disk are sent by servers that support the ASGI path-send extension without copying
+    them through Python; PDFs in GridFS, and PDFs stored as an update to another one,
+    are streamed chunk by chunk, so memory per download does not depend on the file size.
+
+    Args:
+        document_id (str): The id returned when the PDF was saved.
+        request (Request): The incoming request, for its conditional headers.
+
+    Raises:
+        HTTPException: If no PDF with this id is stored.
+
+    Returns:
+        Response: The PDF, a 206 partial response or a 304 Not Modified response.
+    """
+    metadata = await pdf_store.metadata(document_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    headers = {"ETag": f'"{document_id}"', "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    path = pdf_store.local_path(document_id) if metadata.get("base") is None else None
+    if path is not None:
+        return FileResponse(path, media_type="application/pdf", headers=headers,
+                            filename=f"{document_id[:12]}.pdf", content_disposition_type="inline")
+    return await _stream_stored_pdf(document_id, request, headers)
+
+async def _stream_stored_pdf(document_id, request, headers):
+    """
+    Streams a stored PDF from the blob store, honouring `Range` and `If-Range`.
+    """
+    reader = await pdf_store.open(document_id)
+    if reader is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    headers = {**headers, "Accept-Ranges": "bytes", "Content-Disposition": f'inline; filename="{document_id[:12]}.pdf"'}
+    # A range only applies to the representation the client already has part of
+    if_range = request.headers.get("if-range")
+    try:
+        span = None if if_range and if_range != headers["ETag"] else byte_range(request.headers.get("range"), reader.length)
+    except ValueError:
+        reader.close()
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{reader.length}"})
+
+    start, end = span or (0, reader.length - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if span is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{reader.length}"
+    if request.method == "HEAD":
+        reader.close()
+        return Response(status_code=206 if span else 200, headers=headers, media_type="application/pdf")
+
+    async def body():
+        try:
+            async for chunk in reader.chunks(start, end):
+                yield chunk
+        finally:
+            reader.close()
+
+    return StreamingResponse(body(), status_code=206 if span else 200, headers=headers, media_type="application/pdf")
+
+@router.get("/pdfs/{document_id}/metadata")
+async def pdf_metadata(document_id: str):
+    """
+    Returns the metadata of a stored PDF.
+
+    Args:
+        document_id (str): The id returned when the PDF was saved.
+
+    Raises:
+        HTTPException: If no PDF with this id is stored.
+
+    Returns:
+        dict: The document's id, size in bytes, page count and creation time.
+    """
+    metadata = await pdf_store.metadata(document_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return metadata
+
+async def _read_stored(document_id, parse, *args):
+    """
+    Runs a blocking parser on a stored PDF in a worker thread.
+
+    Args:
+        document_id (str): The id of the stored PDF.
+        parse (callable): Called with a binary file object and `args`.
+
+    Raises:
+        ValueError: If the PDF does not exist or cannot be parsed.
+
+    Returns:
+        The result of `parse`.
+    """
+    reader = await pdf_store.open(document_id)
+    if reader is None:
+        raise ValueError("Document not found")
+    try:
+        return await run_in_threadpool(parse, reader.blocking(), *args)
+    finally:
+        reader.close()
+
+@router.post("/pdfs/{document_id}/pages")
+async def add_pdf_pages(document_id: str, files: List[UploadFile] = File(...), position: int = Query(default=None, ge=0), searchable: bool = Query(default=False), lang: str = Query(default="eng"), compact: bool = Query(default=False), max_side: int = Query(default=None, gt=0), workers: int = Query(default=None, gt=0)):
+    """
+    Appends or inserts pages into a stored PDF and stores the result as a new document.
+
+    The pages are added with a PDF incremental update: the new page objects, a new page
+    tree and a cross-reference section for them follow the existing bytes. Those are
+    not parsed beyond the page tree and nothing in them is decoded or re-encoded, so
+    the work per added page does not depend on the document's length. Only the update
+    is stored, under the updated document's own id and linked to the original, which
+    stays available; downloads of the new document send the original's bytes followed
+    by the update. After `pdf_store.PDF_STORE_MAX_UPDATES` updates in a row, the whole
+    document is stored again instead.
+
+    The pages are prepared as in `/upload`, with the same options.
+
+    Args:
+        document_id (str): The id of the stored PDF.
+        files (List[UploadFile]): The images of the new pages, in order.
+        position (int): The 0-based page index to insert the new pages at. Defaults to appending.
+        searchable (bool): Whether to add an OCR text layer to the new pages. Defaults to False.
+        lang (str): The Tesseract language code used for the text layer. Defaults to "eng".
+        compact (bool): Whether to re-encode pages with the compact encodings. Defaults to False.
+        max_side (int): The maximum length of a page's longer side in pixels. Defaults to no limit.
+        workers (int): The number of pages prepared in parallel, capped at `PDF_WORKERS`. Defaults to `PDF_WORKERS`.
+
+    Raises:
+        HTTPException: If the document does not exist, `position` is past its end, an
+        upload is not a valid image or OCR fails.
+
+    Returns:
+        dict: The new document's metadata and download URL.
+    """
+    metadata = await pdf_store.metadata(document_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    try:
+        structure = await _read_stored(document_id, read_pdf_structure)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Cannot update document: {str(e)}")
+    if position is not None and position > len(structure["page_ids"]):
+        raise HTTPException(status_code=400, detail=f"position must be at most {len(structure['page_ids'])}")
+
+    pages = prepare_pages(files, workers=workers, compact=compact, max_side=max_side,
+                          searchable=searchable, lang=lang)
+    update = stream_pdf(pages, functools.partial(PdfUpdater, structure=structure, at=position))
+    try:
+        document = await pdf_store.save(update, base=document_id, pages=len(structure["page_ids"]) + len(files),
+                                        searchable=metadata.get("searchable", False) and searchable,
+                                        parent=document_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:
+        raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
+    return {**document, "url": f"/pdfs/{document['id']}"}
+
+def _render_thumbnail(f, page, size):
+    structure = read_pdf_structure(f)
+    if page >= len(structure["page_ids"]):
+        return None
+    return render_page_thumbnail(read_page_image(f, structure, page), size)
+
+@router.get("/pdfs/{document_id}/thumbnail")
+async def pdf_thumbnail(document_id: str, request: Request, size: int = Query(default=256), page: int = Query(default=0, ge=0)):
+    """
+    Returns a JPEG preview of a page of a stored PDF.
+
+    The page image is read straight from the PDF; JPEG pages are decoded at a reduced
+    size and mixed raster pages are composited from their mask and background.
+    Previews are kept in the thumbnail cache and, as stored PDFs never change, sent
+    with long-lived cache headers and an ETag.
+
+    Args:
+        document_id (str): The id of the stored PDF.
+        request (Request): The incoming request, for its conditional headers.
+        size (int): The longer side of the preview: 128, 256 or 512 pixels. Defaults to 256.
+        page (int): The 0-based page index. Defaults to the first page.
+
+    Raises:
+        HTTPException: If the size is not supported or the document or page does not exist.
+
+    Returns:
+        Response: The JPEG preview, or a 304 Not Modified response.
+    """
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(map(str, THUMBNAIL_SIZES))}")
+    if await pdf_store.metadata(document_id) is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    key = f"{document_id}.{page}"
+    headers = {"ETag": f'"{key}-{size}"', "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    data = thumbnail_cache.get(key, size)
+    if data is None:
+        try:
+            data = await _read_stored(document_id, _render_thumbnail, page, size)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Cannot render preview: {str(e)}")
+        if data is None:
+            raise HTTPException(status_code=404, detail="Page not found")
+        thumbnail_cache.put(key, size, data)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
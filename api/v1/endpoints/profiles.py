@@ -0,0 +1,58 @@
+import os
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+from profiling import check_token, profile_store
+
+router = APIRouter()
+
+def _require_token(token):
+    if not check_token(token):
+        raise HTTPException(status_code=403, detail="Profiling is disabled or the token is invalid")
+
+@router.get("/profiles")
+async def list_profiles(x_profile_token: str = Header(default=None)):
+    """
+    Lists the stored request profiles, newest first.
+
+    Requests are profiled by sending them with the `X-Profile-Token` header; see
+    `profiling.ProfilingMiddleware`.
+
+    Args:
+        x_profile_token (str): The `X-Profile-Token` header, which must match `PROFILING_TOKEN`.
+
+    Raises:
+        HTTPException: If profiling is disabled or the token does not match.
+
+    Returns:
+        list: The name, size and creation time of each profile.
+    """
+    _require_token(x_profile_token)
+    return profile_store.list()
+
+@router.get("/profiles/{name}")
+async def download_profile(name: str, x_profile_token: str = Header(default=None)):
+    """
+    Downloads a stored request profile.
+
+    ".collapsed" profiles are collapsed stacks, which flamegraph.pl, inferno and
+    speedscope render as flame graphs; ".pstats" profiles are read with `pstats` or snakeviz.
+
+    Args:
+        name (str): The profile name from the `X-Profile-Id` response header or `/profiles`.
+        x_profile_token (str): The `X-Profile-Token` header, which must match `PROFILING_TOKEN`.
+
+    Raises:
+        HTTPException: If the token does not match or the profile does not exist.
+
+    Returns:
+        FileResponse: The profile.
+    """
+    _require_token(x_profile_token)
+    try:
+        path = profile_store.path(name)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain" if name.endswith(".collapsed") else "application/octet-stream",
+                        filename=name)
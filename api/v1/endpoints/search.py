@@ -0,0 +1,84 @@
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Form, Query
+from fastapi.concurrency import run_in_threadpool
+import numpy as np
+from db.schemas.user_schema import User
+from ocr_cache import cached_ocr_image
+from lazy_imports import lazy_import
+from search_index import search_index
+from .users import get_current_user
+
+cv2 = lazy_import("cv2")
+
+router = APIRouter()
+
+@router.post("/search/index/")
+async def index_page(file: UploadFile = File(...), document_id: str = Form(...), page: int = Form(default=0), lang: str = Form(default="eng"), current_user: User = Depends(get_current_user)):
+    """
+    Performs OCR on one page of a document and stores its text in the user's search index.
+
+    Re-indexing a page replaces its previous text. This is the only way pages enter the
+    index: `/upload?searchable=true&save=true` adds a text layer to the stored PDF but
+    does not index it, since uploads are not tied to a user. To make a saved document
+    searchable, index its pages here with the returned id as `document_id`.
+
+    Args:
+        file (UploadFile): The page image.
+        document_id (str): The identifier of the document the page belongs to.
+        page (int): The page number within the document. Defaults to 0.
+        lang (str): The Tesseract language code. Defaults to "eng".
+        current_user (User): The currently authenticated user, obtained through dependency.
+
+    Raises:
+        HTTPException: If the image is invalid or OCR fails.
+
+    Returns:
+        dict: The document id, page number and recognized text.
+    """
+    contents = await file.read()
+    nparr = np.frombuffer(contents, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+
+    if image is None:
+        raise HTTPException(status_code=400, detail="Invalid image")
+
+    try:
+        text = (await run_in_threadpool(cached_ocr_image, image, lang=lang))["text"]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
+
+    search_index.index_page(current_user.id, document_id, page, text)
+    return {"document_id": document_id, "page": page, "text": text}
+
+@router.delete("/search/documents/{document_id}")
+async def delete_document_index(document_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Removes all pages of a document from the user's search index.
+
+    Args:
+        document_id (str): The identifier of the document.
+        current_user (User): The currently authenticated user, obtained through dependency.
+
+    Returns:
+        dict: The number of pages removed.
+    """
+    return {"deleted_pages": search_index.delete_document(current_user.id, document_id)}
+
+@router.get("/search/")
+async def search_documents(q: str, page: int = Query(default=1, ge=1), page_size: int = Query(default=20, ge=1, le=100), current_user: User = Depends(get_current_user)):
+    """
+    Searches the text of the user's OCR'd pages.
+
+    Every word of the query must match; a word ending in `*` matches as a prefix.
+    Results are ranked by BM25 relevance.
+
+    Args:
+        q (str): The search query.
+        page (int): The 1-based page of results. Defaults to 1.
+        page_size (int): The number of results per page, at most 100. Defaults to 20.
+        current_user (User): The currently authenticated user, obtained through dependency.
+
+    Returns:
+        dict: The total number of matching pages, the pagination parameters and the results.
+    """
+    results = search_index.search(current_user.id, q, limit=page_size, offset=(page - 1) * page_size)
+    return {"query": q, "page": page, "page_size": page_size, **results}
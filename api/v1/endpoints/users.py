@@ -1,35 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException, Security, File, UploadFile, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from db.schemas.user_schema import UserCreate, User, LoginRequest, ChangePasswordRequest
-from db.mongodb_utils import get_db
+from db.mongodb_utils import get_db, get_pool_stats
 from bson import ObjectId
-import bcrypt
+from pymongo.errors import DuplicateKeyError
 from jwt import PyJWTError,  decode as jwt_decode
 import jwt
 import os
 import datetime
+import hashlib
 from io import BytesIO
 import base64
-import cv2
 import numpy as np
-from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from typing import List
-from math import sqrt
-from itertools import permutations
-from scipy.interpolate import interp1d
-from scipy.ndimage import zoom
-from scipy.ndimage import convolve
-import tempfile
-import shutil
-from fpdf import FPDF
-from PIL import Image
 import logging
-from pytesseract import image_to_string
+from lazy_imports import lazy_import
+import corners
+from passwords import hash_password, verify_password
+from pdf_utils import prepare_pages, stream_pdf
+from pdf_store import pdf_store
+from thumbnails import THUMBNAIL_SIZES, make_thumbnail, thumbnail_cache
+from ocr_cache import ocr_cache, cached_ocr_image
+from user_cache import user_cache
+from metrics import record_image, stage
+
+# Loaded on the first request that needs them; see `lazy_imports`
+cv2 = lazy_import("cv2")
+Image = lazy_import("PIL.Image")
+pytesseract = lazy_import("pytesseract")
 
 router = APIRouter()
 
-pdf_save_directory = "saved_pdfs"
-os.makedirs(pdf_save_directory, exist_ok=True)
+# The user fields sent to clients; password hashes are only fetched where they are checked
+PUBLIC_USER_FIELDS = {"email": 1, "username": 1}
 
 def bgr_to_grayscale(image):
     """
@@ -219,6 +224,9 @@ async def get_current_user(db=Depends(get_db), credentials: HTTPAuthorizationCre
     """
     Retrieves the current user based on the provided JWT token.
 
+    Verified tokens are kept in the user cache for up to `USER_CACHE_TTL` seconds (never
+    beyond the token's expiry), so protected endpoints only query MongoDB on a miss.
+
     Args:
         db: Database dependency, injected by FastAPI.
         credentials (HTTPAuthorizationCredentials): The authorization credentials with JWT token.
@@ -230,6 +238,10 @@ async def get_current_user(db=Depends(get_db), credentials: HTTPAuthorizationCre
         User: The user details of the authenticated user.
     """
     token = credentials.credentials
+    cached = user_cache.get(token)
+    if cached is not None:
+        return User(**cached)
+
     try:
         payload = jwt.decode(token, os.getenv("JWT_SECRET"), algorithms=["HS256"])
         user_id = payload.get("user_id")
@@ -239,16 +251,22 @@ async def get_current_user(db=Depends(get_db), credentials: HTTPAuthorizationCre
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
     user_collection = db["users"]
-    user = await user_collection.find_one({"_id": ObjectId(payload["user_id"])})
+    user = await user_collection.find_one({"_id": ObjectId(payload["user_id"])}, PUBLIC_USER_FIELDS)
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return User(id=str(user["_id"]), **user)
+    current_user = User(id=str(user["_id"]), **user)
+    user_cache.put(token, current_user.model_dump(exclude_none=True), expires_at=payload.get("exp"))
+    return current_user
 
 @router.post("/users/", response_model=User)
 async def create_user(user: UserCreate, db=Depends(get_db)):
     """
     Creates a new user with the provided user details.
 
+    Signup is a single insert: the unique index on `email` (see `db.mongodb_utils.INDEXES`)
+    rejects duplicates, also between concurrent signups, and the response is built from
+    the inserted data instead of reading the document back.
+
     Args:
         user (UserCreate): The user details for creating a new user.
         db: Database dependency, injected by FastAPI.
@@ -260,22 +278,21 @@ async def create_user(user: UserCreate, db=Depends(get_db)):
         User: The newly created user details, including a JWT token.
     """
     user_collection = db["users"]
-    
-    if await user_collection.find_one({ "email": user.email }):
-        raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = bcrypt.hashpw(user.password.encode("utf-8"), bcrypt.gensalt())
+    hashed_password = await hash_password(user.password)
 
     user_data = user.model_dump(exclude={"password"})
     user_data["password"] = hashed_password
 
-    new_user = await user_collection.insert_one(user_data)
-    
+    try:
+        new_user = await user_collection.insert_one(user_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+
     expiration = datetime.datetime.utcnow() + datetime.timedelta(hours=200)
     token = jwt.encode({"user_id": str(new_user.inserted_id), "exp": expiration}, os.getenv("JWT_SECRET"), algorithm="HS256")
-    
-    created_user = await user_collection.find_one({"_id": ObjectId(new_user.inserted_id)})
-    return User(id=str(created_user["_id"]), token=token, **created_user)
+
+    return User(id=str(new_user.inserted_id), token=token, email=user.email, username=user.username)
 
 @router.get("/users/{user_id}", response_model=User)
 async def read_user(user_id: str, db=Depends(get_db)):
@@ -286,11 +303,18 @@ async def read_user(user_id: str, db=Depends(get_db)):
         user_id (str): The unique identifier of the user.
         db: Database dependency, injected by FastAPI.
 
+    Raises:
+        HTTPException: If no user has this ID.
+
     Returns:
         User: The user details corresponding to the given user ID.
     """
+    if not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
     user_collection = db["users"]
-    user = await user_collection.find_one({"_id": ObjectId(user_id)})
+    user = await user_collection.find_one({"_id": ObjectId(user_id)}, PUBLIC_USER_FIELDS)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
     return User(id=str(user["_id"]), **user)
 
 @router.post("/login/", response_model=User)
@@ -309,9 +333,8 @@ async def login(request: LoginRequest, db=Depends(get_db)):
         User: The authenticated user's details, including a JWT token.
     """
     user_collection = db["users"]
-    user = await user_collection.find_one({"email": request.email})
-    print('USER', user)
-    if not user or not bcrypt.checkpw(request.password.encode("utf-8"), user["password"]):
+    user = await user_collection.find_one({"email": request.email}, {**PUBLIC_USER_FIELDS, "password": 1})
+    if not user or not await verify_password(request.password, user["password"]):
         raise HTTPException(status_code=401, detail="Incorrect email or password")
 
     expiration = datetime.datetime.utcnow() + datetime.timedelta(hours=200)
@@ -337,13 +360,14 @@ async def change_password(request: ChangePasswordRequest, current_user: User = D
         dict: A message indicating successful password change.
     """
     user_collection = db["users"]
-    user = await user_collection.find_one({ "_id": ObjectId(current_user.id) })
+    user = await user_collection.find_one({"_id": ObjectId(current_user.id)}, {"password": 1})
 
-    if not user or not bcrypt.checkpw(request.old_password.encode("utf-8"), user["password"]):
+    if not user or not await verify_password(request.old_password, user["password"]):
         raise HTTPException(status_code=401, detail="Incorrect current password")
     
-    hashed_new_password = bcrypt.hashpw(request.new_password.encode("utf-8"), bcrypt.gensalt())
+    hashed_new_password = await hash_password(request.new_password)
     await user_collection.update_one({"_id": ObjectId(user["_id"])}, {"$set": {"password": hashed_new_password}})
+    user_cache.invalidate_user(current_user.id)
     return {"message": "Password changed successfully"}
 
 def apply_grayscale(image):
@@ -409,39 +433,51 @@ async def process_image(file: UploadFile = File(...)):
         StreamingResponse: The processed image in PNG format.
     """
     contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    with stage("decode"):
+        nparr = np.frombuffer(contents, np.uint8)
+        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    record_image(image.shape[1], image.shape[0])
 
-    ratio = image.shape[0] / 500.0
-    orig = image.copy()
-    resized = cv2.resize(image, (int(image.shape[1] / ratio), 500))
+    with stage("resize"):
+        ratio = image.shape[0] / 500.0
+        orig = image.copy()
+        resized = cv2.resize(image, (int(image.shape[1] / ratio), 500))
 
-    edged = pre_process(resized)
+    with stage("pre_process"):
+        edged = pre_process(resized)
 
-    contours, hierarchy = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    contours = sorted(contours, key=cv2.contourArea, reverse=True)  # Corrected line
+    with stage("find_contours"):
+        contours, hierarchy = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        contours = sorted(contours, key=cv2.contourArea, reverse=True)  # Corrected line
 
+    with stage("contour_loop"):
+        quad = None
+        for contour in contours:
+            peri = cv2.arcLength(contour, True)
+            approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
 
-    for contour in contours:
-        peri = cv2.arcLength(contour, True)
-        approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
+            if len(approx) == 4:
+                quad = approx
+                break
 
-        if len(approx) == 4:
-            scaled_approx = np.array(approx, dtype='float32') * ratio
-            scaled_approx = np.array(scaled_approx, dtype='int32')  # Convert back to integer
+    if quad is not None:
+        scaled_approx = np.array(quad, dtype='float32') * ratio
+        scaled_approx = np.array(scaled_approx, dtype='int32')  # Convert back to integer
 
+        with stage("four_point_transform"):
             warped = four_point_transform(orig, scaled_approx.reshape(4, 2))
+        with stage("threshold"):
             warped_gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
             adaptive_thresh = cv2.adaptiveThreshold(warped_gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 9, 15)
             blurred_final = cv2.GaussianBlur(adaptive_thresh, (3, 3), 0)
 
+        with stage("encode"):
             success, encoded_image = cv2.imencode('.png', blurred_final)
-            if not success:
-                raise HTTPException(status_code=500, detail="Failed to encode image")
-
-            encoded_image_bytes = encoded_image.tobytes()
-            return StreamingResponse(BytesIO(encoded_image_bytes), media_type="image/png")
+        if not success:
+            raise HTTPException(status_code=500, detail="Failed to encode image")
 
+        encoded_image_bytes = encoded_image.tobytes()
+        return StreamingResponse(BytesIO(encoded_image_bytes), media_type="image/png")
 
     raise HTTPException(status_code=500, detail="Document edges not found")
 
@@ -455,22 +491,8 @@ def order_points(pts):
     Returns:
         np.ndarray: An array of points ordered as (top-left, top-right, bottom-right, bottom-left).
     """
-    # Sort the points based on their x-coordinates
-    xSorted = pts[np.argsort(pts[:, 0]), :]
-
-    # Grab the left-most and right-most points from the sorted x-coordinate points
-    leftMost = xSorted[:2, :]
-    rightMost = xSorted[2:, :]
-
-    # Now, sort the left-most coordinates according to their y-coordinates
-    leftMost = leftMost[np.argsort(leftMost[:, 1]), :]
-    (tl, bl) = leftMost
-
-    # Calculate the Euclidean distance between the left-most points
-    D = np.linalg.norm(rightMost - tl, axis=1)
-    (br, tr) = rightMost[np.argsort(D)[::-1], :]
-
-    return np.array([tl, tr, br, bl], dtype="float32")
+    # The upper of the two left-most points, then the others clockwise around the centroid
+    return corners.order_points(pts[np.newaxis])[0]
 
 def four_point_transform(image, pts):
     """
@@ -528,93 +550,76 @@ def pre_process(src):
     return cv2.Canny(blurred, 75, 100)
 
 @router.post("/upload")
-async def create_upload_files(files: List[UploadFile] = File(...)):
+async def create_upload_files(files: List[UploadFile] = File(...), searchable: bool = Query(default=False), lang: str = Query(default="eng"), compact: bool = Query(default=False), max_side: int = Query(default=None, gt=0), workers: int = Query(default=None, gt=0), save: bool = Query(default=False)):
     """
     Creates a PDF file from a list of uploaded images.
 
-    This route handler takes multiple image files, converts them to JPEG (if needed),
-    and compiles them into a single PDF file, which is then returned to the client.
+    This route handler takes multiple image files and compiles them into a single PDF
+    file that is streamed to the client page by page, so memory use and the time to
+    the first byte do not grow with the number of pages. JPEG uploads are embedded
+    as-is and PNG uploads keep their compressed data, so pages are not re-encoded.
+    Each page is sized to its image's aspect ratio. When `searchable` is set, every
+    page is recognized once with Tesseract and the words are added as an invisible,
+    selectable text layer. When `compact` is set, black-and-white pages are stored
+    with one bit per pixel and other pages with mixed raster content (a 1-bit text
+    mask over a low-resolution background), whichever is smaller than the upload.
+    Pages larger than `max_side` are downscaled first.
+
+    Decoding, downscaling, compression and OCR run for up to `workers` upcoming pages
+    at once in a shared pool of `PDF_WORKERS` threads; only the ordered assembly of
+    the PDF is serial.
+
+    When `save` is set, the PDF is written to the content-addressed PDF store instead
+    of being returned, and the response holds its id and metadata; the document is
+    then downloaded from `/pdfs/{id}`. Identical documents are stored only once.
+    The text layer of a saved PDF is not added to the search index; see `/search/index/`.
+
+    Errors on the first page are reported with an HTTP error status. Once streaming
+    has started, an error on a later page aborts the response; when saving, every
+    error is reported with an HTTP error status.
 
     Args:
         files (List[UploadFile]): A list of image files to be compiled into a PDF.
+        searchable (bool): Whether to add an OCR text layer. Defaults to False.
+        lang (str): The Tesseract language code used for the text layer. Defaults to "eng".
+        compact (bool): Whether to re-encode pages with the compact encodings. Defaults to False.
+        max_side (int): The maximum length of a page's longer side in pixels. Defaults to no limit.
+        workers (int): The number of pages prepared in parallel, capped at `PDF_WORKERS`. Defaults to `PDF_WORKERS`.
+        save (bool): Whether to store the PDF and return its metadata. Defaults to False.
+
+    Raises:
+        HTTPException: 400 if the first upload is not a readable image, naming the file, and
+        500 if OCR fails on it.
 
     Returns:
-        StreamingResponse: A streaming response containing the compiled PDF file.
+        StreamingResponse | dict: The compiled PDF file, or the stored document's metadata.
     """
-    pdf = FPDF()
-
-    temp_files = []  # List to keep track of temporary files
-
-    for file in files:
-        contents = await file.read()
-
-        # Create a temporary file
-        temp_img_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-        temp_files.append(temp_img_file.name)
-
-        if file.filename.endswith('.png'):
-            # Convert PNG to JPEG
-            img = Image.open(BytesIO(contents))
-            img.convert('RGB').save(temp_img_file, format='JPEG')
-        else:
-            # Write content for JPEG
-            temp_img_file.write(contents)
-
-        temp_img_file.close()
-
-        try:
-            pdf.add_page()
-            pdf.image(temp_img_file.name, x=10, y=8, w=100)  # Adjust dimensions as needed
-        except RuntimeError as e:
-            raise HTTPException(status_code=500, detail=str(e))
-
-    # Generate the PDF and write it to a BytesIO stream
-    pdf_bytes = pdf.output(dest='S').encode('latin1')  # PDF is generated as a string
-    pdf_stream = BytesIO(pdf_bytes)
-    pdf_stream.seek(0)
-
-    # Cleanup temporary image files
-    for temp_file in temp_files:
-        os.unlink(temp_file)
-
-    return StreamingResponse(pdf_stream, media_type='application/pdf')
-    pdf = FPDF()
-
-    temp_files = []  # List to keep track of temporary files
-
-    for file in files:
-        contents = await file.read()
-
-        # Create a temporary file
-        temp_img_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-        temp_files.append(temp_img_file.name)
-
-        if file.filename.endswith('.png'):
-            # Convert PNG to JPEG
-            img = Image.open(BytesIO(contents))
-            img.convert('RGB').save(temp_img_file, format='JPEG')
-        else:
-            # Write content for JPEG
-            temp_img_file.write(contents)
+    pages = prepare_pages(files, workers=workers, compact=compact, max_side=max_side,
+                          searchable=searchable, lang=lang)
+    try:
+        first_page = await pages.__anext__()
+    except ValueError as e:
+        await pages.aclose()
+        raise HTTPException(status_code=400, detail=str(e))
+    except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:
+        await pages.aclose()
+        raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
 
-        temp_img_file.close()
+    async def all_pages():
+        yield first_page
+        async for page in pages:
+            yield page
 
+    if save:
         try:
-            pdf.add_page()
-            pdf.image(temp_img_file.name, x=10, y=8, w=100)  # Adjust dimensions as needed
-        except RuntimeError as e:
-            raise HTTPException(status_code=500, detail=str(e))
-
-    # Generate the PDF in memory
-    pdf_output_stream = BytesIO()
-    pdf.output(pdf_output_stream, 'F')
-    pdf_output_stream.seek(0)
+            document = await pdf_store.save(stream_pdf(all_pages()), pages=len(files), searchable=searchable)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:
+            raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
+        return {**document, "url": f"/pdfs/{document['id']}"}
 
-    # Cleanup temporary image files
-    for temp_file in temp_files:
-        os.unlink(temp_file)
-
-    return StreamingResponse(pdf_output_stream, media_type='application/pdf')
+    return StreamingResponse(stream_pdf(all_pages()), media_type='application/pdf')
 
 @router.post("/rotate-image/")
 async def rotate_image(file: UploadFile = File(...), angle: float = Query(default=0.0)):
@@ -645,6 +650,41 @@ async def rotate_image(file: UploadFile = File(...), angle: float = Query(defaul
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/thumbnail/")
+async def create_thumbnail(file: UploadFile = File(...), size: int = Query(default=256)):
+    """
+    Creates a JPEG preview of a scanned page.
+
+    JPEG uploads are decoded at a reduced size, so a preview of a 12 MP photo takes a
+    few milliseconds instead of a full decode. Previews are cached on disk under the
+    upload's SHA-256, so the same page is only shrunk once; the digest is also the
+    preview's ETag.
+
+    Args:
+        file (UploadFile): The page image.
+        size (int): The longer side of the preview: 128, 256 or 512 pixels. Defaults to 256.
+
+    Raises:
+        HTTPException: If the size is not supported or the image is invalid.
+
+    Returns:
+        Response: The JPEG preview.
+    """
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(map(str, THUMBNAIL_SIZES))}")
+    contents = await file.read()
+    key = hashlib.sha256(contents).hexdigest()
+
+    data = thumbnail_cache.get(key, size)
+    if data is None:
+        try:
+            data = await run_in_threadpool(make_thumbnail, contents, size)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        thumbnail_cache.put(key, size, data)
+    headers = {"ETag": f'"{key}-{size}"', "Cache-Control": "private, max-age=31536000, immutable"}
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
 @router.post("/enhance-image/")
 async def enhance_image(file: UploadFile = File(...)):
     """
@@ -725,32 +765,76 @@ def rotate_image_cv(image: np.ndarray, angle: float) -> np.ndarray:
     return rotated
 
 @router.post("/ocr/")
-async def perform_ocr(file: UploadFile = File(...)):
+async def perform_ocr(file: UploadFile = File(...), mode: str = Query(default="page"), lang: str = Query(default="eng"), psm: int = Query(default=3), rescale: bool = Query(default=True)):
     """
     Performs Optical Character Recognition (OCR) on an uploaded image file.
 
+    Results are cached on disk by page content and OCR parameters, so repeated requests
+    for the same scan skip Tesseract. Unless disabled, the page is first rescaled so that its dominant character height
+    matches what Tesseract recognizes best. In "page" mode the whole page is then passed
+    to Tesseract in one call. In "blocks" mode the page is segmented into text blocks
+    that are recognized in parallel, and the response also lists each block with its
+    bounding box and OCR time.
+
     Args:
         file (UploadFile): The image file to perform OCR on.
+        mode (str): Either "page" or "blocks". Defaults to "page".
+        lang (str): The Tesseract language code. Defaults to "eng".
+        psm (int): The Tesseract page segmentation mode used in "page" mode. Defaults to 3.
+        rescale (bool): Whether to rescale the page to the target text height. Defaults to True.
+
+    Raises:
+        HTTPException: If the mode is unknown or OCR fails.
 
     Returns:
-        dict: A dictionary containing the recognized text.
+        dict: A dictionary containing the recognized text and the applied scale factor.
     """
+    if mode not in ("page", "blocks"):
+        raise HTTPException(status_code=400, detail="mode must be 'page' or 'blocks'")
+
     # Read the uploaded file
     contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    with stage("decode"):
+        nparr = np.frombuffer(contents, np.uint8)
+        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    record_image(image.shape[1], image.shape[0])
 
     # Convert to grayscale for better OCR results
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    with stage("grayscale"):
+        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    # Perform OCR using pytesseract
+    # Perform OCR using pytesseract, skipping pages already in the cache
     try:
-        ocr_result = image_to_string(gray_image)
-        print("OCR result:", ocr_result)
+        with stage("ocr"):
+            ocr_result = await run_in_threadpool(cached_ocr_image, gray_image, mode=mode, lang=lang, psm=psm,
+                                                 rescale=rescale)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
 
-    return {"text": ocr_result}
+    return ocr_result
+
+@router.get("/ocr/cache-stats")
+async def ocr_cache_stats():
+    """
+    Returns the hit rate and size of the persistent OCR result cache.
+
+    Returns:
+        dict: The cache statistics aggregated over all workers.
+    """
+    return ocr_cache.stats()
+
+@router.get("/db/pool-stats")
+async def db_pool_stats(current_user: User = Depends(get_current_user)):
+    """
+    Returns the settings and usage counters of this worker's MongoDB connection pool.
+
+    Args:
+        current_user (User): The currently authenticated user, obtained through dependency.
+
+    Returns:
+        dict: The pool size limits, open and checked-out connections, and checkout counts.
+    """
+    return get_pool_stats()
 
 @router.post("/apply-grayscale/")
 async def grayscale_effect(file: UploadFile = File(...)):